@@ -5,6 +5,7 @@ import mathutils
 import numpy as np
 
 from .LensFile import LensFile
+from ..Tracing.Tracing import traced
 
 
 
@@ -33,6 +34,7 @@ class LensMapper:
                 print("path {} does not exist".format(lens_file))
                 
                 
+    @traced("lens.getK1U")
     def getK1U(self, zoom, focus):
         # no lens file, return default value
         if self.lens_file is None:
@@ -43,6 +45,7 @@ class LensMapper:
         return self.lens_file.getK1UndistortOCV(zoom, focus)
     
     
+    @traced("lens.getK1D")
     def getK1D(self, zoom, focus):
         # no lens file, return default value
         if self.lens_file is None:
@@ -53,6 +56,7 @@ class LensMapper:
         return self.lens_file.getK1DistortOCV(zoom, focus)
     
     
+    @traced("lens.getK2U")
     def getK2U(self, zoom, focus):
         # no lens file, return default value
         if self.lens_file is None:
@@ -63,6 +67,7 @@ class LensMapper:
         return self.lens_file.getK2UndistortOCV(zoom, focus)
     
     
+    @traced("lens.getK2D")
     def getK2D(self, zoom, focus):
         # no lens file, return default value
         if self.lens_file is None:
@@ -73,6 +78,7 @@ class LensMapper:
         return self.lens_file.getK2DistortOCV(zoom, focus)
     
     
+    @traced("lens.getFocal")
     def getFocal(self, zoom, focus):
         # no lens file, return default value
         if self.lens_file is None:
@@ -81,6 +87,7 @@ class LensMapper:
         return self.lens_file.getFocalMM(zoom, focus)
     
     
+    @traced("lens.getFocus")
     def getFocus(self, zoom, focus):
         # no lens file, return default value
         if self.lens_file is None:
@@ -89,6 +96,7 @@ class LensMapper:
         return self.lens_file.getFocusDistanceM(zoom, focus)
     
     
+    @traced("lens.getEPD")
     def getEPD(self, zoom, focus):
         # no lens file, return default value
         if self.lens_file is None:
@@ -4,57 +4,481 @@ Copyright Miraxyz 2024
 Defines how to decode the FreeD protocol
 """
 
+import sys
+import time
 import socket
+import select
+import ipaddress
 from threading import Thread
 import struct
+import bisect
+
+import numpy as np
+
+try:
+    from ..Tracing.Tracing import TRACER
+except ImportError: # used as a standalone module, outside of Blender, not traced
+    from types import SimpleNamespace
+    TRACER = SimpleNamespace(enabled=False)
+
+
+FREED_D1 = 0xD1
+FREED_PACKET_SIZE = 29
+
+# scaling of the raw 24 bits values, in legacy field order x,y,z,pan,tilt,roll,zoom,focus
+FREED_POSITION_SCALE = 1/64     # 1/64 mm
+FREED_ANGLE_SCALE    = 1/32768  # 1/32768 degree
+FREED_SCALES = np.array([FREED_POSITION_SCALE]*3 + [FREED_ANGLE_SCALE]*3 + [1.0, 1.0])
+
+# width of the decoded fields of a sample row, x,y,z,pan,tilt,roll,zoom,focus
+FREED_SAMPLE_WIDTH = 8
+
+# receivers deliver rows of x,y,z,pan,tilt,roll,zoom,focus,timestamp
+# timestamp is the arrival time in seconds, on the time.monotonic clock
+FREED_TIMESTAMP = 8
+FREED_ROW_WIDTH = 9
+
+# report the real datagram length so that oversized datagrams are not mistaken for D1 packets
+MSG_TRUNC = getattr(socket, 'MSG_TRUNC', 0)
+
+# wildcards of the FreedDemuxReceiver routes: packets from any source address, with any camera id
+ANY_SOURCE = ""
+ANY_CAMERA = -1
+
+# kernel receive timestamps (linux), as a struct timespec on the realtime clock.
+# the socket module does not export the option, 35 is its value on linux
+SO_TIMESTAMPNS = getattr(socket, 'SO_TIMESTAMPNS', 35 if sys.platform.startswith('linux') else None)
+TIMESPEC = struct.Struct('@ll')
+
+# per receiver statistics, kept in one fixed size float64 array (see FreedStats)
+STATS_PACKETS   = 0 # valid D1 packets
+STATS_MALFORMED = 1 # datagrams which are not 29 bytes D1 packets
+STATS_CHECKSUM  = 2 # D1 packets with a wrong checksum
+STATS_GAPS      = 3 # reads coming more than STATS_GAP_FACTOR periods per packet read after the previous one
+STATS_LAST      = 4 # timestamp of the last packet
+STATS_PERIOD    = 5 # mean inter arrival time since the first packet (s)
+STATS_JITTER    = 6 # smoothed absolute deviation of the inter arrival time from the period (s)
+STATS_FIRST     = 7 # timestamp of the first packet
+STATS_READ_INTERVAL = 8 # inter arrival time before the last read (s)
+STATS_READ_PACKETS  = 9 # packets of the last read
+STATS_HISTOGRAM = 10 # first bin of the jitter histogram
+STATS_JITTER_BINS = np.array([0.0005, 0.001, 0.002, 0.005, 0.01, 0.02]) # upper bounds (s), the last bin is open
+STATS_JITTER_BOUNDS = STATS_JITTER_BINS.tolist() # for the single packet updates
+STATS_SIZE = STATS_HISTOGRAM + len(STATS_JITTER_BINS) + 1
+STATS_SMOOTHING = 0.05
+STATS_GAP_FACTOR = 2.5
+STATS_MIN_INTERVAL = 0.0001 # s, packets closer than that were read together (drained, read time stamps), not timed
+
+# decoded sample layout. angles in degrees, positions in mm, zoom and focus are raw encoder values
+FREED_DTYPE = np.dtype([
+    ('x', np.float64),
+    ('y', np.float64),
+    ('z', np.float64),
+    ('pan', np.float64),
+    ('tilt', np.float64),
+    ('roll', np.float64),
+    ('zoom', np.int32),
+    ('focus', np.int32),
+    ('camera_id', np.uint8),
+    ('checksum_ok', np.bool_),
+    ('timestamp', np.float64), # arrival time, set by the receivers
+])
+
+
+def is_multicast(ip):
+    """
+        True if ip is a multicast group address (224.0.0.0 to 239.255.255.255)
+    """
+    try:
+        return ipaddress.ip_address(ip).is_multicast
+    except ValueError:
+        return False
+
+
+def checksum(packet):
+    """
+        FreeD checksum, 0x40 minus the sum of all preceding bytes, modulo 256
+    """
+    return (0x40 - sum(packet[:FREED_PACKET_SIZE-1])) & 0xFF
+
+
+def unpack_batch(buffer):
+    """
+        decode a contiguous buffer of N 29 bytes D1 packets into a (N,) FREED_DTYPE array.
+        rows which are not D1 packets are dropped
+    """
+    raw = np.frombuffer(buffer, dtype=np.uint8)
+    if raw.size % FREED_PACKET_SIZE != 0:
+        raise ValueError("buffer size {} is not a multiple of {}".format(raw.size, FREED_PACKET_SIZE))
+    raw = raw.reshape(-1, FREED_PACKET_SIZE)
+    raw = raw[raw[:, 0] == FREED_D1]
+    n = raw.shape[0]
+
+    # 24 bits to 32 bits: copy the 3 big endian bytes in the high bytes of a 32 bits word
+    # then shift right, the arithmetic shift extends the sign
+    words = np.zeros((n, 8, 4), dtype=np.uint8)
+    words[:, :, :3] = raw[:, 2:26].reshape(n, 8, 3)
+    values = words.view('>i4')[:, :, 0] >> 8
+
+    samples = np.empty(n, dtype=FREED_DTYPE)
+    samples['pan']   = values[:, 0] * FREED_ANGLE_SCALE
+    samples['tilt']  = values[:, 1] * FREED_ANGLE_SCALE
+    samples['roll']  = values[:, 2] * FREED_ANGLE_SCALE
+    samples['x']     = values[:, 3] * FREED_POSITION_SCALE
+    samples['y']     = values[:, 4] * FREED_POSITION_SCALE
+    samples['z']     = values[:, 5] * FREED_POSITION_SCALE
+    samples['zoom']  = values[:, 6] & 0xFFFFFF # encoders are unsigned
+    samples['focus'] = values[:, 7] & 0xFFFFFF
+    samples['camera_id'] = raw[:, 1]
+    samples['checksum_ok'] = ((0x40 - raw[:, :FREED_PACKET_SIZE-1].sum(axis=1, dtype=np.uint32)) & 0xFF) == raw[:, FREED_PACKET_SIZE-1]
+    samples['timestamp'] = 0
+
+    return samples
+
 
 def unpack(packet):
-    if(packet[0] == 0xD1 and len(packet) == 29 ): # freed
-        p = int.from_bytes(packet[2:5], 'big', signed=True)
-        t = int.from_bytes(packet[5:8], 'big', signed=True)
-        r = int.from_bytes(packet[8:11], 'big', signed=True)
-        x = int.from_bytes(packet[11:14], 'big', signed=True)
-        y = int.from_bytes(packet[14:17], 'big', signed=True)
-        z = int.from_bytes(packet[17:20], 'big', signed=True)
-        zo = int.from_bytes(packet[20:23], 'big')
-        fo = int.from_bytes(packet[23:26], 'big')
-
-        fields = [x,y,z,p,t,r,zo,fo]
-
-        #shift data
-        fields[3]/=32768
-        fields[4]/=32768
-        fields[5]/=32768
-        fields[0]/=64
-        fields[1]/=64
-        fields[2]/=64 
-        
-        return fields
+    if(packet[0] == FREED_D1 and len(packet) == FREED_PACKET_SIZE): # freed
+        return list(unpack_batch(packet)[0].tolist()[:8]) # x,y,z,pan,tilt,roll,zoom,focus
     return None
 
+
+def pack_batch(samples, camera_ids = 0, out = None):
+    """
+        encode a (N, 8) array of x,y,z,pan,tilt,roll,zoom,focus (the receivers rows) into
+        a (N, 29) uint8 array of D1 packets with their checksums, in out if given.
+        camera_ids is a camera id or one per sample
+    """
+    samples = np.asarray(samples, dtype=np.float64)[:, :FREED_SAMPLE_WIDTH]
+    n = samples.shape[0]
+    if out is None:
+        out = np.empty((n, FREED_PACKET_SIZE), dtype=np.uint8)
+
+    values = np.rint(samples / FREED_SCALES).astype(np.int64)
+    values[:, :6] = np.clip(values[:, :6], -(1 << 23), (1 << 23) - 1)
+    values[:, 6:] = np.clip(values[:, 6:], 0, (1 << 24) - 1)
+    values = values[:, [3, 4, 5, 0, 1, 2, 6, 7]] # packet order, pan,tilt,roll,x,y,z,zoom,focus
+
+    fields = out[:, 2:26].reshape(n, 8, 3)
+    fields[:, :, 0] = (values >> 16) & 0xFF
+    fields[:, :, 1] = (values >> 8) & 0xFF
+    fields[:, :, 2] = values & 0xFF
+    out[:, 0] = FREED_D1
+    out[:, 1] = camera_ids
+    out[:, 26:28] = 0 # user defined / spare
+    out[:, FREED_PACKET_SIZE-1] = (0x40 - out[:, :FREED_PACKET_SIZE-1].sum(axis=1, dtype=np.uint32)) & 0xFF
+    return out
+
+
+class FreedDecoder:
+    """
+        Decodes D1 packets stored in a preallocated buffer into the rows of a preallocated
+        float64 array, without allocating any array once constructed.
+
+        Packets are written in self.slots (one memoryview of 29 bytes per packet, usable with recv_into),
+        decode(n) fills self.samples[:n] with x,y,z,pan,tilt,roll,zoom,focus.
+        The timestamp column of self.samples is left to the receiver
+    """
+
+    def __init__(self, capacity = 1):
+        self.capacity = capacity
+        self.buffer = bytearray(capacity*FREED_PACKET_SIZE)
+        self.view = memoryview(self.buffer)
+        self.slots = [self.view[i*FREED_PACKET_SIZE:(i+1)*FREED_PACKET_SIZE] for i in range(capacity)]
+        self.raw = np.frombuffer(self.buffer, dtype=np.uint8).reshape(capacity, FREED_PACKET_SIZE)
+        self.samples = np.zeros((capacity, FREED_ROW_WIDTH))
+        self.fields = self.samples[:, :FREED_SAMPLE_WIDTH]
+        self.timestamps = self.samples[:, FREED_TIMESTAMP]
+
+        # the 3 big endian bytes of each field are copied reversed in the high bytes of a
+        # little endian 32 bits word, an arithmetic shift then extends the sign.
+        # packets hold pan,tilt,roll before x,y,z, the copy also reorders them
+        self.words = np.zeros((capacity, 8, 4), dtype=np.uint8)
+        fields = self.raw[:, 2:26].reshape(capacity, 8, 3)
+        self.copies = [(self.words[:, 3:6, 3:0:-1], fields[:, 0:3]), # pan,tilt,roll
+                       (self.words[:, 0:3, 3:0:-1], fields[:, 3:6]), # x,y,z
+                       (self.words[:, 6:8, 3:0:-1], fields[:, 6:8])] # zoom,focus
+        self.words_le = self.words.view('<i4').reshape(capacity, 8)
+        self.values = np.zeros((capacity, 8), dtype=np.int32)
+        self.encoders = self.values[:, 6:8]
+
+    def decode(self, n = None):
+        """
+            decode the first n packets of the buffer into the first n rows of self.samples
+        """
+        if n is None or n == self.capacity:
+            for dst, src in self.copies:
+                np.copyto(dst, src)
+            self._decode(self.words_le, self.values, self.encoders, self.fields)
+        else:
+            for dst, src in self.copies:
+                np.copyto(dst[:n], src[:n])
+            self._decode(self.words_le[:n], self.values[:n], self.encoders[:n], self.fields[:n])
+
+    @staticmethod
+    def _decode(words_le, values, encoders, fields):
+        np.right_shift(words_le, 8, out=values)
+        np.bitwise_and(encoders, 0xFFFFFF, out=encoders) # encoders are unsigned
+        np.multiply(values, FREED_SCALES, out=fields)
+
+    def isD1(self, i = 0):
+        return self.buffer[i*FREED_PACKET_SIZE] == FREED_D1
+
+    def checksumErrors(self, n = None):
+        """
+            (n,) bool array, True for the packets with a wrong checksum among the first n
+        """
+        raw = self.raw if n is None else self.raw[:n]
+        expected = (0x40 - raw[:, :FREED_PACKET_SIZE-1].sum(axis=1, dtype=np.uint32)) & 0xFF
+        return expected != raw[:, FREED_PACKET_SIZE-1]
+
+    def checksumFailures(self, n = None):
+        """
+            number of packets with a wrong checksum among the first n
+        """
+        return int(np.count_nonzero(self.checksumErrors(n)))
+
+
+
+class FreedStats:
+    """
+        Low overhead statistics of a FreeD stream: packets, packet rate, inter arrival jitter
+        (smoothed and as an histogram), malformed packets, checksum failures and gaps.
+
+        The rate is the packet count over the time elapsed since the first packet, gaps and jitter are
+        measured against the matching mean period. Inter arrival times under STATS_MIN_INTERVAL are packets
+        read together from the socket (drained with read time stamps), they are not timed: a read is a gap
+        when the interval before it is longer than STATS_GAP_FACTOR periods for each of its packets.
+        A read is known complete at the next one, so are its gaps.
+
+        Everything is stored in self.counters, a float64 array of STATS_SIZE indexed by the STATS_ constants,
+        which can be given to share it (with the ingest process shared memory for instance).
+        Updated from the receive path, read from anywhere.
+    """
+
+    def __init__(self, counters = None):
+        self.counters = np.zeros(STATS_SIZE) if counters is None else counters
+        self.histogram = self.counters[STATS_HISTOGRAM:]
+
+    def reset(self):
+        self.counters[:] = 0
+
+    def malformed(self):
+        self.counters[STATS_MALFORMED] += 1
+
+    def count(self, n, first, last, checksum_failures = 0):
+        """
+            account for n valid packets received from first to last without timing them.
+            For the streams mixing several trackers (a whole demultiplexed socket), only the counts and rate mean something
+        """
+        c = self.counters
+        if c[STATS_PACKETS] == 0:
+            c[STATS_FIRST] = first
+        c[STATS_PACKETS] += n
+        c[STATS_CHECKSUM] += checksum_failures
+        c[STATS_LAST] = last
+        if c[STATS_PACKETS] > 1:
+            c[STATS_PERIOD] = (last - c[STATS_FIRST])/(c[STATS_PACKETS] - 1)
+
+    def update(self, timestamps, checksum_failures = 0):
+        """
+            account for a batch of valid packets received at timestamps
+        """
+        c = self.counters
+        if c[STATS_PACKETS] > 0:
+            intervals = np.diff(timestamps, prepend=c[STATS_LAST])
+        else:
+            intervals = np.diff(timestamps)
+        self.count(len(timestamps), timestamps[0], timestamps[-1], checksum_failures)
+
+        reads = np.flatnonzero(intervals >= STATS_MIN_INTERVAL)
+        if reads.size == 0:
+            c[STATS_READ_PACKETS] += intervals.size
+            return
+        period = c[STATS_PERIOD]
+        # the reads completed by this batch: the pending one and all but the last of the batch
+        read_intervals = np.concatenate(([c[STATS_READ_INTERVAL]], intervals[reads[:-1]]))
+        read_packets = np.diff(reads, prepend=0)
+        read_packets[0] += c[STATS_READ_PACKETS]
+        c[STATS_GAPS] += np.count_nonzero(read_intervals > STATS_GAP_FACTOR*period*read_packets)
+        c[STATS_READ_INTERVAL] = intervals[reads[-1]]
+        c[STATS_READ_PACKETS] = intervals.size - reads[-1]
+
+        deviations = np.abs(intervals[reads] - period)
+        weight = min(1.0, STATS_SMOOTHING*reads.size)
+        c[STATS_JITTER] += weight*(deviations.mean() - c[STATS_JITTER])
+        self.histogram += np.bincount(np.searchsorted(STATS_JITTER_BINS, deviations), minlength=self.histogram.size)
+
+    def updateOne(self, timestamp, checksum_failure = False):
+        """
+            update() for a single packet, on scalars only so that it allocates no array
+        """
+        c = self.counters
+        interval = timestamp - c[STATS_LAST] if c[STATS_PACKETS] > 0 else 0.0
+        self.count(1, timestamp, timestamp, 1 if checksum_failure else 0)
+
+        if interval < STATS_MIN_INTERVAL:
+            c[STATS_READ_PACKETS] += 1
+            return
+        period = c[STATS_PERIOD]
+        if c[STATS_READ_INTERVAL] > STATS_GAP_FACTOR*period*c[STATS_READ_PACKETS]:
+            c[STATS_GAPS] += 1
+        c[STATS_READ_INTERVAL] = interval
+        c[STATS_READ_PACKETS] = 1
+
+        deviation = abs(interval - period)
+        c[STATS_JITTER] += STATS_SMOOTHING*(deviation - c[STATS_JITTER])
+        self.histogram[bisect.bisect_left(STATS_JITTER_BOUNDS, deviation)] += 1
+
+    def rate(self):
+        """
+            packets per second since the first packet
+        """
+        period = self.counters[STATS_PERIOD]
+        return 1/period if period > 0 else 0.0
+
         
 class FreedReceiver:
 
-    def __init__(self, ip = "0.0.0.0", port = 5000, callback = None):
-        self.data = [0,0,0,0,0,0,0,0]
+    def __init__(self, ip = "0.0.0.0", port = 5000, callback = None, zero_copy = False,
+                 drain_all = False, delivery = 'ALL', capacity = 256, rcvbuf = 0, kernel_timestamps = False,
+                 interface = "0.0.0.0"):
+        """
+            ip: address to bind, or a multicast group to join on the interface address
+            (any interface if 0.0.0.0). Group members on one machine share the port, so any number
+            of local consumers can receive the same stream
+
+            zero_copy: receive with recv_into in a preallocated buffer and decode in place.
+            The callback then gets a view on the preallocated sample row, which is overwritten
+            by the next packet: copy it if it has to be kept.
+
+            drain_all: at each wakeup read every pending datagram (up to capacity) without blocking
+            and decode them as one batch. delivery selects what the callback gets:
+            'ALL' the (n,9) batch view, 'LATEST' only the newest sample row.
+            Implies zero_copy.
+
+            rcvbuf: SO_RCVBUF size in bytes, 0 keeps the system default
+
+            Samples carry their arrival time at index FREED_TIMESTAMP (seconds, time.monotonic clock).
+            kernel_timestamps: use the time the kernel received the datagram (SO_TIMESTAMPNS) rather than
+            the time it is read, when the platform supports it
+        """
+        self.data = [0,0,0,0,0,0,0,0,0]
         self.port = port
         self.ip = ip
         self.sock = None
         self.thread = None
         self.isRunning = False
         self.callback = callback
+        self.zero_copy = zero_copy
+        self.drain_all = drain_all
+        self.delivery = delivery
+        self.capacity = capacity
+        self.rcvbuf = rcvbuf
+        self.kernel_timestamps = False
+        self.request_kernel_timestamps = kernel_timestamps
+        self.clock_offset_ns = 0 # realtime - monotonic
+        self.ancbufsize = socket.CMSG_SPACE(TIMESPEC.size) if hasattr(socket, 'CMSG_SPACE') else 0
+        self.decoder = FreedDecoder(capacity if drain_all else 1)
+        self.stats = FreedStats()
+        self.frequency = 0.0
+        self.recorder = None # FreedCaptureWriter recording every datagram
+        self.receiver_id = 0 # id of this receiver in captures
+        self.interface = interface
+        self.sources = None # source ip of the datagram in each decoder slot, only recorded if set to a list
+        self.hub = None # FreedHub serving the receiver, if any
 
-    def start(self):
-        self.stop() # try stopping 
+    def open(self):
+        """
+            create and bind the UDP socket, returns False if it could not be bound
+        """
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # UDP
+        multicast = is_multicast(self.ip)
+        if multicast:
+            # let the other consumers of the group on this machine bind the same port
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if hasattr(socket, 'SO_REUSEPORT'):
+                try:
+                    self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+                except OSError:
+                    pass
         try:
-            self.sock.bind((self.ip, self.port))
+            # windows cannot bind a group address, elsewhere binding it keeps out the traffic of other groups
+            self.sock.bind(("" if multicast and sys.platform == 'win32' else self.ip, self.port))
+            if multicast:
+                membership = struct.pack('4s4s', socket.inet_aton(self.ip), socket.inet_aton(self.interface))
+                self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
         except:
-            print("invalid ip adress or port number")
+            print("invalid ip adress, port number or multicast interface")
+            self.sock.close()
+            self.sock = None
+            return False
+        if self.rcvbuf > 0:
+            try:
+                self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+            except OSError:
+                print("could not set receive buffer size to", self.rcvbuf)
+        self.kernel_timestamps = False
+        if self.request_kernel_timestamps:
+            if SO_TIMESTAMPNS is not None and self.ancbufsize > 0:
+                self.sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+                self.kernel_timestamps = True
+                self.syncClocks()
+            else:
+                print("kernel timestamps not supported, using arrival time on the monotonic clock")
+        return True
+
+    def syncClocks(self):
+        """
+            kernel timestamps are on the realtime clock, samples on the monotonic clock
+        """
+        self.clock_offset_ns = time.time_ns() - time.monotonic_ns()
+
+    def receive(self, i = 0):
+        """
+            receive one datagram in the decoder slot i and write its arrival time in the sample row i.
+            returns the datagram length (real length when it was truncated)
+        """
+        decoder = self.decoder
+        timestamp = None
+        source = ANY_SOURCE
+        if self.kernel_timestamps:
+            nbytes, ancdata, _, address = self.sock.recvmsg_into((decoder.slots[i],), self.ancbufsize, MSG_TRUNC)
+            for level, kind, cdata in ancdata:
+                if level == socket.SOL_SOCKET and kind == SO_TIMESTAMPNS:
+                    sec, nsec = TIMESPEC.unpack_from(cdata)
+                    timestamp = (sec*1000000000 + nsec - self.clock_offset_ns)*1e-9
+            source = address[0]
+            if self.sources is not None:
+                self.sources[i] = source
+        elif self.sources is not None:
+            nbytes, address = self.sock.recvfrom_into(decoder.slots[i], FREED_PACKET_SIZE, MSG_TRUNC)
+            source = self.sources[i] = address[0]
+        else:
+            nbytes = self.sock.recv_into(decoder.slots[i], FREED_PACKET_SIZE, MSG_TRUNC)
+        if timestamp is None:
+            timestamp = time.monotonic()
+        decoder.timestamps[i] = timestamp
+
+        if self.recorder is not None:
+            self.recorder.append(self.receiver_id, timestamp, decoder.slots[i], nbytes, source)
+        return nbytes
+
+    def start(self):
+        self.stop() # try stopping 
+        if not self.open():
             return
-        self.sock.settimeout(1)
         self.isRunning = True
-        self.thread = Thread(target=self.run)
+        if self.drain_all:
+            self.sock.setblocking(False)
+            self.data = self.decoder.samples[0]
+            self.thread = Thread(target=self.run_drain)
+        elif self.zero_copy:
+            self.sock.settimeout(1)
+            self.data = self.decoder.samples[0]
+            self.thread = Thread(target=self.run_zero_copy)
+        else:
+            self.sock.settimeout(1)
+            self.thread = Thread(target=self.run)
         self.thread.start()
        
     #FreeD Receiver
@@ -66,13 +490,150 @@ class FreedReceiver:
                 continue
              
             if(msg):
+                if self.recorder is not None:
+                    self.recorder.append(self.receiver_id, time.monotonic(), msg)
+                start = TRACER.begin() if TRACER.enabled else 0
                 data = unpack(msg)
+                if start:
+                    TRACER.end("freed.unpack", start)
                 if data is not None:
+                    data.append(time.monotonic())
                     self.data = data
+                    self.stats.update(data[FREED_TIMESTAMP:], int(checksum(msg) != msg[FREED_PACKET_SIZE-1]))
+                else:
+                    self.stats.malformed()
                 
                 if self.callback is not None:
                     self.callback(self.data)
 
+    #FreeD Receiver, no allocation per packet
+    def run_zero_copy(self):
+        decoder = self.decoder
+        while(self.isRunning):
+            if self.kernel_timestamps:
+                self.syncClocks()
+            try:
+                nbytes = self.receive(0)
+            except:
+                continue
+
+            if nbytes == FREED_PACKET_SIZE and decoder.isD1():
+                start = TRACER.begin() if TRACER.enabled else 0
+                decoder.decode()
+                self.stats.updateOne(self.data[FREED_TIMESTAMP], checksum(decoder.slots[0]) != decoder.buffer[FREED_PACKET_SIZE-1])
+                if start:
+                    start = TRACER.end("freed.decode", start)
+
+                if self.callback is not None:
+                    self.callback(self.data)
+                if start:
+                    TRACER.end("freed.callback", start)
+            else:
+                self.stats.malformed()
+
+    #FreeD Receiver, decodes everything pending at each wakeup as one batch
+    def run_drain(self):
+        while(self.isRunning):
+            try:
+                readable, _, _ = select.select([self.sock], [], [], 1)
+            except (OSError, ValueError):
+                continue
+            if readable:
+                n = self.drain()
+                if n > 0:
+                    self.dispatch(n)
+
+    def handle_readable(self):
+        """
+            process what is pending on the non blocking socket, without a thread of our own (used by FreedHub)
+        """
+        if self.drain_all:
+            n = self.drain()
+            if n > 0:
+                self.dispatch(n)
+            return
+
+        decoder = self.decoder
+        if self.kernel_timestamps:
+            self.syncClocks()
+        try:
+            nbytes = self.receive(0)
+        except OSError:
+            return
+        if nbytes == FREED_PACKET_SIZE and decoder.isD1():
+            decoder.decode(1)
+            self.data = decoder.samples[0]
+            self.stats.updateOne(self.data[FREED_TIMESTAMP], checksum(decoder.slots[0]) != decoder.buffer[FREED_PACKET_SIZE-1])
+            if self.callback is not None:
+                self.callback(self.data)
+        else:
+            self.stats.malformed()
+
+    def drain(self):
+        """
+            read all pending datagrams without blocking into the decoder slots,
+            returns the number of D1 packets stored
+        """
+        decoder = self.decoder
+        start = TRACER.begin() if TRACER.enabled else 0
+        if self.kernel_timestamps:
+            self.syncClocks()
+        n = 0
+        while n < decoder.capacity:
+            try:
+                nbytes = self.receive(n)
+            except OSError: # BlockingIOError when nothing is pending anymore
+                break
+            if nbytes == FREED_PACKET_SIZE and decoder.isD1(n):
+                n += 1
+            else:
+                self.stats.malformed()
+        if start:
+            TRACER.end("freed.receive", start)
+            TRACER.counter("freed.batch", n)
+        return n
+
+    def inject(self, packets, timestamps, sources = None):
+        """
+            process D1 packets as if they had been received, without a socket (replay).
+            packets is a (n, 29) uint8 array, timestamps the (n,) arrival times, sources their n source ips
+            (ANY_SOURCE if None), routed on by FreedDemuxReceiver.
+            Must not run along the receiving thread, which decodes into the same buffers (see FreedHub.call)
+        """
+        decoder = self.decoder
+        for start in range(0, len(packets), decoder.capacity):
+            n = min(decoder.capacity, len(packets) - start)
+            decoder.raw[:n] = packets[start:start+n]
+            decoder.timestamps[:n] = timestamps[start:start+n]
+            if self.sources is not None:
+                self.sources[:n] = [ANY_SOURCE]*n if sources is None else sources[start:start+n]
+            if self.drain_all:
+                self.dispatch(n)
+            else: # one packet at a time
+                decoder.decode(1)
+                self.data = decoder.samples[0]
+                self.stats.updateOne(self.data[FREED_TIMESTAMP], checksum(decoder.slots[0]) != decoder.buffer[FREED_PACKET_SIZE-1])
+                if self.callback is not None:
+                    self.callback(self.data)
+
+    def dispatch(self, n):
+        """
+            decode the n first packets of the decoder and deliver them according to the delivery policy
+        """
+        start = TRACER.begin() if TRACER.enabled else 0
+        self.decoder.decode(n)
+        self.stats.update(self.decoder.timestamps[:n], self.decoder.checksumFailures(n))
+        self.data = self.decoder.samples[n-1]
+        if start:
+            start = TRACER.end("freed.decode", start)
+        if self.callback is not None:
+            if self.delivery == 'LATEST':
+                self.callback(self.data)
+            else:
+                self.callback(self.decoder.samples[:n])
+        if start:
+            TRACER.end("freed.callback", start)
+
     def stop(self):
         self.isRunning = False
         try:
@@ -85,5 +646,129 @@ class FreedReceiver:
         except:
             pass
         self.sock = None
-        self.frequency = 0.0
-           
\ No newline at end of file
+        self.frequency = self.stats.rate()
+           
+
+
+
+class FreedRoute:
+    """
+        Tracker fed by a FreedDemuxReceiver: the packets of a source address and camera id.
+        callback, delivery, stats and data have the same meaning as on FreedReceiver
+    """
+
+    def __init__(self, source = ANY_SOURCE, camera_id = ANY_CAMERA, callback = None, delivery = 'ALL'):
+        self.source = source
+        self.camera_id = camera_id
+        self.callback = callback
+        self.delivery = delivery
+        self.stats = FreedStats()
+        self.data = None
+
+    def label(self):
+        return "{} camera {}".format(self.source or "any source", "any" if self.camera_id == ANY_CAMERA else self.camera_id)
+
+
+
+class FreedDemuxReceiver(FreedReceiver):
+    """
+        One socket shared by any number of trackers. Each packet is routed by its (source ip, camera id)
+        to a FreedRoute, the routes of a drained batch are delivered their samples in one call each.
+
+        Routes are looked up in a dict holding exact keys and wildcards (ANY_SOURCE, ANY_CAMERA),
+        the resolved route of each key met is cached so that routing costs one dict lookup per packet.
+        Precedence: exact source and camera, exact source, exact camera, any.
+        Packets matching no route are counted in self.unrouted.
+        Always drains (see FreedReceiver drain_all). self.stats counts the packets of the whole socket, a mix
+        of sources which is not timed: the gaps and jitter are those of the routes stats.
+    """
+
+    def __init__(self, ip = "0.0.0.0", port = 5000, capacity = 256, rcvbuf = 0, kernel_timestamps = False,
+                 interface = "0.0.0.0"):
+        super().__init__(ip, port, None, drain_all = True, capacity = capacity, rcvbuf = rcvbuf,
+                         kernel_timestamps = kernel_timestamps, interface = interface)
+        self.sources = [ANY_SOURCE]*self.decoder.capacity
+        self.route_indices = np.zeros(self.decoder.capacity, dtype=np.intp)
+        self.routes = []
+        self.table = {} # (source, camera id): route index, with wildcards
+        self.cache = {} # (source, camera id) met: route index, -1 if unrouted
+        self.unrouted = 0
+
+    def route(self, source = ANY_SOURCE, camera_id = ANY_CAMERA, callback = None, delivery = 'ALL'):
+        """
+            add a tracker, returns its FreedRoute. Can be called while receiving
+        """
+        key = (source, camera_id)
+        if key in self.table:
+            raise ValueError("{}:{} already routes {}".format(self.ip, self.port, self.routes[self.table[key]].label()))
+        route = FreedRoute(source, camera_id, callback, delivery)
+        self.routes.append(route)
+        self.table[key] = len(self.routes) - 1
+        self.cache = {} # replaced, not cleared, the receiving thread may be reading it
+        return route
+
+    def unroute(self, route):
+        """
+            remove a tracker, its packets become unrouted unless a wildcard route takes them
+        """
+        index = self.table.pop((route.source, route.camera_id), None)
+        if index is not None:
+            self.routes[index] = None
+            self.cache = {}
+
+    def resolve(self, key):
+        source, camera_id = key
+        for candidate in (key, (source, ANY_CAMERA), (ANY_SOURCE, camera_id), (ANY_SOURCE, ANY_CAMERA)):
+            index = self.table.get(candidate)
+            if index is not None:
+                break
+        else:
+            index = -1
+        self.cache[key] = index
+        return index
+
+    def dispatch(self, n):
+        """
+            decode the n first packets of the decoder and deliver them to their routes
+        """
+        decoder = self.decoder
+        start = TRACER.begin() if TRACER.enabled else 0
+        decoder.decode(n)
+        errors = decoder.checksumErrors(n)
+        self.stats.count(n, decoder.timestamps[0], decoder.timestamps[n-1], int(np.count_nonzero(errors)))
+        self.data = decoder.samples[n-1]
+
+        buffer = decoder.buffer
+        sources = self.sources
+        cache = self.cache
+        indices = self.route_indices[:n]
+        for i in range(n):
+            key = (sources[i], buffer[i*FREED_PACKET_SIZE + 1])
+            index = cache.get(key)
+            if index is None:
+                index = self.resolve(key)
+            indices[i] = index
+        if start:
+            start = TRACER.end("freed.route", start)
+
+        if (indices == indices[0]).all(): # a single tracker in this batch, deliver the decoder rows
+            self.deliver(indices[0], decoder.samples[:n], errors)
+        else:
+            order = np.argsort(indices, kind='stable')
+            for rows in np.split(order, np.flatnonzero(np.diff(indices[order])) + 1):
+                self.deliver(indices[rows[0]], decoder.samples[rows], errors[rows])
+        if start:
+            TRACER.end("freed.callback", start)
+
+    def deliver(self, index, samples, errors):
+        route = self.routes[index] if index >= 0 else None
+        if route is None:
+            self.unrouted += samples.shape[0]
+            return
+        route.stats.update(samples[:, FREED_TIMESTAMP], int(np.count_nonzero(errors)))
+        route.data = samples[-1]
+        if route.callback is not None:
+            if route.delivery == 'LATEST':
+                route.callback(route.data)
+            else:
+                route.callback(samples)
@@ -0,0 +1,152 @@
+"""
+Copyright Miraxyz 2024
+
+Defines the arbitration of redundant FreeD streams of one tracker (the same camera sent over two
+network cards or by two tracker servers), forwarding the earliest arriving copy of each sample
+"""
+
+from collections import deque
+from threading import Lock
+
+import numpy as np
+
+try:
+    from .Freed import FREED_SAMPLE_WIDTH, FREED_TIMESTAMP, FreedStats
+except ImportError: # used as a standalone module, outside of Blender
+    from Freed import FREED_SAMPLE_WIDTH, FREED_TIMESTAMP, FreedStats
+
+
+# per source counters, one row of FreedArbiter.counters per source
+ARBITER_PACKETS    = 0 # samples received from the source
+ARBITER_FIRST      = 1 # samples of which the source delivered the earliest copy, forwarded
+ARBITER_DUPLICATES = 2 # later copies, dropped
+ARBITER_DELAY      = 3 # smoothed delay of the later copies behind the earliest one (s)
+ARBITER_DELAY_MAX  = 4 # worst delay behind the earliest copy (s)
+ARBITER_LAST       = 5 # arrival time of the last sample
+ARBITER_LAST_FIRST = 6 # arrival time of the last forwarded sample
+ARBITER_STALLS     = 7 # times the source went silent for longer than the stall timeout
+ARBITER_SIZE = 8
+ARBITER_SMOOTHING = 0.05
+
+ARBITER_WINDOW = 0.05        # s, a copy arriving later than that after the first one is taken as a new sample
+ARBITER_STALL_TIMEOUT = 0.1  # s, a source silent for longer than that is stalled
+
+
+class FreedArbiter:
+    """
+        Merges the redundant streams of one tracker: the sources deliver their samples to source(k),
+        copies of a sample are matched on their decoded values, the earliest copy is forwarded to callback
+        and the later ones are dropped. The forwarded stream keeps going as long as one source does,
+        failing over to the others when a source stalls.
+
+        A camera at rest sends identical samples, the n-th copy of a value from a source is matched with
+        the n-th copy from the others. window bounds the delay between the sources: a copy arriving
+        later is taken as a new sample, and a sample repeating the values of one received within window
+        from another source only is taken as its copy. Arrival times are the sample timestamps, so the
+        delays between sources are measured on the receive path of each (kernel timestamps make them exact).
+
+        delivery: 'ALL' forwards every new sample, 'LATEST' only the newest of each batch.
+        stats accounts for the forwarded stream.
+    """
+
+    def __init__(self, callback, n_sources, delivery = 'ALL', window = ARBITER_WINDOW, stall_timeout = ARBITER_STALL_TIMEOUT):
+        self.callback = callback
+        self.n_sources = n_sources
+        self.delivery = delivery
+        self.window = window
+        self.stall_timeout = stall_timeout
+        self.counters = np.zeros((n_sources, ARBITER_SIZE))
+        self.stalled = [False]*n_sources
+        self.stats = FreedStats()
+        self.active = -1 # source which delivered the last forwarded sample
+        self.failovers = 0 # stalls of a source while it was delivering the earliest copies
+        self.copies = {} # sample values: [[first arrival, mask of the sources which delivered it], ...] oldest first
+        self.order = deque() # (first arrival, sample values) of the copies, to forget them after the window
+        self.lock = Lock() # sources may be served by different threads
+
+    def source(self, k):
+        """
+            callback of the receiver (or route) of source k
+        """
+        return lambda samples: self.receive(k, samples)
+
+    def receive(self, k, samples):
+        samples = np.atleast_2d(samples)
+        bit = 1 << k
+        c = self.counters[k]
+        forwarded = []
+        with self.lock:
+            for i in range(samples.shape[0]):
+                row = samples[i]
+                arrival = row[FREED_TIMESTAMP]
+                key = row[:FREED_SAMPLE_WIDTH].tobytes()
+                copies = self.copies.get(key)
+                match = None
+                if copies is not None:
+                    for copy in copies:
+                        if not copy[1] & bit:
+                            match = copy
+                            break
+                if match is None: # earliest copy
+                    copy = [arrival, bit]
+                    if copies is None:
+                        self.copies[key] = [copy]
+                    else:
+                        copies.append(copy)
+                    self.order.append((arrival, key))
+                    forwarded.append(i)
+                    c[ARBITER_FIRST] += 1
+                    c[ARBITER_LAST_FIRST] = arrival
+                else:
+                    match[1] |= bit
+                    delay = arrival - match[0]
+                    c[ARBITER_DELAY] = delay if c[ARBITER_DUPLICATES] == 0 else c[ARBITER_DELAY] + ARBITER_SMOOTHING*(delay - c[ARBITER_DELAY])
+                    c[ARBITER_DELAY_MAX] = max(c[ARBITER_DELAY_MAX], delay)
+                    c[ARBITER_DUPLICATES] += 1
+            c[ARBITER_PACKETS] += samples.shape[0]
+
+            now = samples[-1, FREED_TIMESTAMP]
+            c[ARBITER_LAST] = now
+            self.stalled[k] = False
+            self.checkStalls(now)
+            self.forget(now - self.window)
+
+            if forwarded:
+                self.active = k
+                rows = samples[forwarded[-1:]] if self.delivery == 'LATEST' else samples[forwarded]
+                self.stats.update(rows[:, FREED_TIMESTAMP])
+                if self.callback is not None:
+                    self.callback(rows)
+
+    def checkStalls(self, now):
+        for k in range(self.n_sources):
+            last = self.counters[k, ARBITER_LAST]
+            if not self.stalled[k] and last > 0 and now - last > self.stall_timeout:
+                self.stalled[k] = True
+                self.counters[k, ARBITER_STALLS] += 1
+                if last - self.counters[k, ARBITER_LAST_FIRST] < self.stall_timeout:
+                    self.failovers += 1
+
+    def forget(self, before):
+        """
+            forget the copies which arrived first before the given time
+        """
+        while self.order and self.order[0][0] < before:
+            _, key = self.order.popleft()
+            copies = self.copies[key]
+            copies.pop(0)
+            if not copies:
+                del self.copies[key]
+
+    def report(self):
+        """
+            one line per source: share of the forwarded samples and delay behind the earliest copy
+        """
+        lines = []
+        for k in range(self.n_sources):
+            c = self.counters[k]
+            share = c[ARBITER_FIRST]/c[ARBITER_PACKETS]*100 if c[ARBITER_PACKETS] > 0 else 0.0
+            lines.append("source {}: first {:.0f}%, {:+.3f} ms behind (max {:.3f}), {:.0f} stalls{}{}".format(
+                         k, share, c[ARBITER_DELAY]*1000, c[ARBITER_DELAY_MAX]*1000, c[ARBITER_STALLS],
+                         ", stalled" if self.stalled[k] else "", ", active" if k == self.active else ""))
+        return lines
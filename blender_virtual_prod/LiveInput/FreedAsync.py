@@ -0,0 +1,127 @@
+"""
+Copyright Miraxyz 2024
+
+Defines an asyncio FreeD receiver, for headless tools running outside of Blender
+"""
+
+import time
+import asyncio
+
+try:
+    from .Freed import FREED_PACKET_SIZE, FREED_TIMESTAMP, FreedDecoder, FreedStats, checksum
+except ImportError: # used as a standalone module, outside of Blender
+    from Freed import FREED_PACKET_SIZE, FREED_TIMESTAMP, FreedDecoder, FreedStats, checksum
+
+
+class FreedProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, receiver):
+        self.receiver = receiver
+
+    def datagram_received(self, data, addr):
+        self.receiver.feed(data)
+
+    def connection_lost(self, exc):
+        self.receiver.close()
+
+
+class AsyncFreedReceiver:
+    """
+        asyncio counterpart of FreedReceiver, built on loop.create_datagram_endpoint.
+        Any number of them can share one event loop, no thread is created.
+
+        Decoded samples are (FREED_ROW_WIDTH,) float64 rows x,y,z,pan,tilt,roll,zoom,focus,timestamp like the
+        samples of FreedReceiver (timestamp is the arrival time on the monotonic clock), each its own array, available:
+            - through the callback, called for each sample
+            - by iterating with "async for sample in receiver", keeping up to maxsize samples (oldest dropped first)
+            - with "await receiver.latest()", the newest sample
+    """
+
+    def __init__(self, ip = "0.0.0.0", port = 5000, callback = None, maxsize = 1024):
+        self.data = None
+        self.port = port
+        self.ip = ip
+        self.callback = callback
+        self.transport = None
+        self.isRunning = False
+        self.queue = asyncio.Queue(maxsize)
+        self.updated = asyncio.Event()
+        self.decoder = FreedDecoder(1)
+        self.stats = FreedStats()
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        try:
+            self.transport, _ = await loop.create_datagram_endpoint(lambda: FreedProtocol(self),
+                                                                    local_addr=(self.ip, self.port))
+        except OSError:
+            print("invalid ip adress or port number")
+            return
+        self.isRunning = True
+
+    def feed(self, msg):
+        """
+            decode one datagram and deliver the sample
+        """
+        decoder = self.decoder
+        if len(msg) != FREED_PACKET_SIZE:
+            self.stats.malformed()
+            return
+        decoder.slots[0][:] = msg
+        if not decoder.isD1():
+            self.stats.malformed()
+            return
+        decoder.decode(1)
+        decoder.timestamps[0] = time.monotonic()
+        self.data = decoder.samples[0].copy() # queued, the decoder row is reused
+        self.stats.updateOne(self.data[FREED_TIMESTAMP], checksum(msg) != msg[FREED_PACKET_SIZE-1])
+
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(self.data)
+        self.updated.set()
+
+        if self.callback is not None:
+            self.callback(self.data)
+
+    async def latest(self):
+        """
+            newest sample, waits for the first one if nothing has been received yet
+        """
+        while self.data is None and self.isRunning:
+            await self.updated.wait()
+        return self.data
+
+    async def next(self):
+        """
+            wait for the next received sample
+        """
+        self.updated.clear()
+        await self.updated.wait()
+        return self.data
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.queue.empty() and not self.isRunning:
+            raise StopAsyncIteration
+        sample = await self.queue.get()
+        if sample is None: # closed
+            raise StopAsyncIteration
+        return sample
+
+    def close(self):
+        if not self.isRunning:
+            return
+        self.isRunning = False
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None) # wake up iterators
+        self.updated.set()
+
+    def stop(self):
+        if self.transport is not None:
+            self.transport.close()
+        self.transport = None
+        self.close()
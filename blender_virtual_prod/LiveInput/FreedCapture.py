@@ -0,0 +1,208 @@
+"""
+Copyright Miraxyz 2024
+
+Defines the raw FreeD capture format, recording every received datagram with its receiver id,
+source address and arrival time in fixed size records, readable with numpy.memmap without any parsing.
+
+File layout: a CAPTURE_HEADER_SIZE bytes header, then CAPTURE_DTYPE records.
+The file grows by preallocated chunks of zeroed records, the header holds the number of records
+written at the last flush. Records after that count with a non zero timestamp were written after
+the last flush (crash), they are recovered when reading.
+"""
+
+import os
+import socket
+import struct
+from threading import Lock
+
+import numpy as np
+
+try:
+    from .Freed import FREED_D1, FREED_PACKET_SIZE, ANY_SOURCE
+except ImportError: # used as a standalone module, outside of Blender
+    from Freed import FREED_D1, FREED_PACKET_SIZE, ANY_SOURCE
+
+
+CAPTURE_MAGIC = b'BVPFREED'
+CAPTURE_VERSION = 2
+CAPTURE_PAYLOAD_SIZE = 32
+
+# magic, version, header size, record size, record count
+CAPTURE_HEADER = struct.Struct('<8sIIIQ')
+CAPTURE_HEADER_SIZE = 64
+
+CAPTURE_DTYPE = np.dtype([
+    ('timestamp', '<f8'), # arrival time, seconds on the time.monotonic clock
+    ('receiver', '<u2'),  # id of the receiver which got the datagram
+    ('length', '<u2'),    # datagram length, the payload keeps its first CAPTURE_PAYLOAD_SIZE bytes
+    ('source', '>u4'),    # IPv4 source address of the datagram, 0 if the receiver did not get it
+    ('payload', 'u1', (CAPTURE_PAYLOAD_SIZE,)),
+])
+# record layout of each version, version 1 had no source address
+CAPTURE_DTYPES = {
+    1: np.dtype([(name, CAPTURE_DTYPE.fields[name][0]) for name in ('timestamp', 'receiver', 'length', 'payload')]),
+    2: CAPTURE_DTYPE,
+}
+
+
+def source_address(ip):
+    """
+        IPv4 address string to its 32 bits value, 0 if unknown
+    """
+    if not ip:
+        return 0
+    try:
+        return int.from_bytes(socket.inet_aton(ip), 'big')
+    except OSError:
+        return 0
+
+
+def source_ip(address):
+    """
+        32 bits value of a capture source to its IPv4 address string, ANY_SOURCE if unknown
+    """
+    return socket.inet_ntoa(int(address).to_bytes(4, 'big')) if address else ANY_SOURCE
+
+
+class FreedCaptureWriter:
+    """
+        Appends raw datagrams to a capture file. Thread safe, several receivers can share one writer.
+        When the file cannot grow anymore the capture stops, keeping what was recorded, and self.failure tells why
+    """
+
+    def __init__(self, path, chunk_records = 65536):
+        self.path = path
+        self.chunk_records = chunk_records
+        self.count = 0
+        self.capacity = 0
+        self.records = None
+        self.failure = None
+        self.lock = Lock()
+
+        with open(path, "wb") as f:
+            f.write(self.header())
+        self.grow()
+
+    def header(self):
+        return CAPTURE_HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION, CAPTURE_HEADER_SIZE,
+                                   CAPTURE_DTYPE.itemsize, self.count).ljust(CAPTURE_HEADER_SIZE, b'\0')
+
+    def grow(self):
+        """
+            extend the file by one chunk of zeroed records and map it
+        """
+        if self.records is not None:
+            self.records.flush()
+        # a mapped file cannot be resized (Windows), every view of the map is dropped first
+        self.unmap()
+        capacity = self.capacity + self.chunk_records
+        with open(self.path, "r+b") as f:
+            f.truncate(CAPTURE_HEADER_SIZE + capacity*CAPTURE_DTYPE.itemsize)
+        self.records = np.memmap(self.path, dtype=CAPTURE_DTYPE, mode='r+',
+                                 offset=CAPTURE_HEADER_SIZE, shape=(capacity,))
+        self.capacity = capacity
+        self.timestamps = self.records['timestamp']
+        self.receivers = self.records['receiver']
+        self.lengths = self.records['length']
+        self.sources = self.records['source']
+        self.payloads = self.records['payload']
+
+    def unmap(self):
+        self.records = None
+        self.timestamps = self.receivers = self.lengths = self.sources = self.payloads = None
+
+    def append(self, receiver_id, timestamp, packet, nbytes = None, source = None):
+        """
+            record a datagram (bytes like) received at timestamp from the source ip, if known
+        """
+        if nbytes is None:
+            nbytes = len(packet)
+        stored = min(nbytes, len(packet), CAPTURE_PAYLOAD_SIZE)
+        with self.lock:
+            if self.records is None:
+                return
+            if self.count == self.capacity:
+                try:
+                    self.grow()
+                except OSError as e:
+                    self.stopCapture(e)
+                    return
+            i = self.count
+            self.payloads[i, :stored] = np.frombuffer(packet, dtype=np.uint8, count=stored)
+            self.lengths[i] = nbytes
+            self.receivers[i] = receiver_id
+            self.sources[i] = source_address(source)
+            self.timestamps[i] = timestamp # written last, marks the record as complete
+            self.count += 1
+
+    def stopCapture(self, error):
+        """
+            the file cannot grow, stop recording and keep the records written so far
+        """
+        self.unmap()
+        self.failure = "capture {} stopped after {} datagrams: {}".format(self.path, self.count, error)
+        print(self.failure)
+        try:
+            self.writeHeader()
+        except OSError:
+            pass # the records after the header count are recovered when reading
+
+    def flush(self):
+        with self.lock:
+            self.writeHeader()
+
+    def writeHeader(self):
+        if self.records is not None:
+            self.records.flush()
+        with open(self.path, "r+b") as f:
+            f.write(self.header())
+
+    def close(self):
+        with self.lock:
+            if self.records is not None:
+                self.writeHeader()
+            self.unmap()
+
+
+def read_capture(path):
+    """
+        map the records of a capture file, read only
+    """
+    with open(path, "rb") as f:
+        magic, version, header_size, record_size, count = CAPTURE_HEADER.unpack(f.read(CAPTURE_HEADER.size))
+    dtype = CAPTURE_DTYPES.get(version)
+    if magic != CAPTURE_MAGIC or dtype is None or record_size != dtype.itemsize:
+        raise ValueError("{} is not a FreeD capture".format(path))
+
+    capacity = (os.path.getsize(path) - header_size) // record_size
+    if capacity == 0:
+        return np.zeros(0, dtype=dtype)
+    records = np.memmap(path, dtype=dtype, mode='r', offset=header_size, shape=(capacity,))
+
+    # recover the records written after the last flush
+    tail = np.flatnonzero(records['timestamp'][count:] == 0)
+    count += tail[0] if tail.size > 0 else capacity - count
+    return records[:count]
+
+
+def capture_packets(records, receiver = None):
+    """
+        contiguous buffer of the D1 packets of the records (of one receiver if given), for unpack_batch,
+        and the matching records
+    """
+    keep = (records['length'] == FREED_PACKET_SIZE) & (records['payload'][:, 0] == FREED_D1)
+    if receiver is not None:
+        keep &= records['receiver'] == receiver
+    records = records[keep]
+    return np.ascontiguousarray(records['payload'][:, :FREED_PACKET_SIZE]), records
+
+
+def capture_sources(records):
+    """
+        source ip of each record, ANY_SOURCE when it was not captured (version 1 captures)
+    """
+    if 'source' not in records.dtype.names:
+        return [ANY_SOURCE]*len(records)
+    addresses, inverse = np.unique(records['source'], return_inverse=True)
+    ips = [source_ip(address) for address in addresses]
+    return [ips[i] for i in inverse.ravel()]
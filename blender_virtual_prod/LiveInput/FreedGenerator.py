@@ -0,0 +1,234 @@
+"""
+Copyright Miraxyz 2024
+
+Defines a synthetic FreeD source, emitting valid D1 packets of generated camera motions,
+to stress test the receivers over loopback without any tracking hardware.
+
+Can also be run as a script:
+    python FreedGenerator.py --target 127.0.0.1 5000 [--target 127.0.0.1 5001 ...] --rate 1000 --motion ORBIT --loss 0.01
+"""
+
+import time
+import socket
+import argparse
+from threading import Thread
+
+import numpy as np
+
+try:
+    from .Freed import FREED_SAMPLE_WIDTH, pack_batch
+except ImportError: # used as a standalone script, outside of Blender
+    from Freed import FREED_SAMPLE_WIDTH, pack_batch
+
+
+MOTIONS = ('ORBIT', 'DOLLY', 'STATIC')
+
+SPIN_THRESHOLD = 0.002 # s, sleep until that close to a send time, then spin
+CHUNK_DURATION = 0.25  # s of packets generated at once
+
+
+def generate(t, motion = 'ORBIT', radius = 3000.0, height = 1500.0, period = 10.0,
+             zoom_range = (0, 0), focus_range = (0, 0), pull_period = 4.0,
+             position_noise = 0.0, angle_noise = 0.0, encoder_noise = 0.0, rng = None):
+    """
+        (len(t), 8) samples x,y,z,pan,tilt,roll,zoom,focus of a motion at the times t (s).
+            ORBIT: circle of radius (mm) at height (mm) around the origin, looking at it
+            DOLLY: back and forth along y over +-radius (mm), looking along y
+            STATIC: standing at (radius, 0, height)
+        zoom and focus pull smoothly between the ends of their range every pull_period seconds, in opposite directions.
+        gaussian noise of the given standard deviations (mm, degrees, encoder steps) is added if not 0
+    """
+    t = np.asarray(t, dtype=np.float64)
+    samples = np.zeros((t.size, FREED_SAMPLE_WIDTH))
+    phase = 2*np.pi*t/period
+
+    if motion == 'ORBIT':
+        samples[:, 0] = radius*np.cos(phase)
+        samples[:, 1] = radius*np.sin(phase)
+        pan = np.degrees(phase) + 180 # towards the origin
+        samples[:, 3] = (pan + 180) % 360 - 180
+        samples[:, 4] = -np.degrees(np.arctan2(height, radius))
+    elif motion == 'DOLLY':
+        samples[:, 1] = radius*np.sin(phase)
+    elif motion == 'STATIC':
+        samples[:, 0] = radius
+    else:
+        raise ValueError("unknown motion {}, expected one of {}".format(motion, MOTIONS))
+    samples[:, 2] = height
+
+    pull = 0.5 - 0.5*np.cos(2*np.pi*t/pull_period) # 0 to 1 and back, eased
+    samples[:, 6] = zoom_range[0] + (zoom_range[1] - zoom_range[0])*pull
+    samples[:, 7] = focus_range[0] + (focus_range[1] - focus_range[0])*(1 - pull)
+
+    if position_noise or angle_noise or encoder_noise:
+        rng = np.random.default_rng() if rng is None else rng
+        samples[:, 0:3] += rng.normal(0, position_noise, (t.size, 3)) if position_noise else 0
+        samples[:, 3:6] += rng.normal(0, angle_noise, (t.size, 3)) if angle_noise else 0
+        samples[:, 6:8] += rng.normal(0, encoder_noise, (t.size, 2)) if encoder_noise else 0
+
+    return samples
+
+
+class FreedGenerator:
+    """
+        Sends generated motions to targets, a list of (ip, port), the camera of target i has id camera_ids[i]
+        (i+1 by default) and is phase shifted so that the cameras do not overlap.
+
+        Each target receives rate packets per second. Impairments, applied per target:
+            loss: probability of dropping a packet
+            reorder: probability of swapping a packet with the next one
+            burst: (probability, length), probability of holding the next length packets
+                   and sending them all at once, like a congested network
+        motion is a dict of keyword arguments of generate()
+    """
+
+    def __init__(self, targets, rate = 60.0, camera_ids = None, motion = None,
+                 loss = 0.0, reorder = 0.0, burst = (0.0, 0), seed = None):
+        self.targets = [(ip, int(port)) for ip, port in targets]
+        self.rate = rate
+        self.camera_ids = list(camera_ids) if camera_ids is not None else list(range(1, len(self.targets) + 1))
+        self.motion = dict(motion or {})
+        self.loss = loss
+        self.reorder = reorder
+        self.burst = burst
+        self.rng = np.random.default_rng(seed)
+        self.isRunning = False
+        self.thread = None
+        self.report = None
+
+    def chunk(self, first, count):
+        """
+            packets of the ticks first to first+count, as (send offsets (s), target indices, (n, 29) packets),
+            sorted by send time
+        """
+        period = 1/self.rate
+        ticks = np.arange(first, first + count)
+        offsets, indices, packets = [], [], []
+
+        for i, camera_id in enumerate(self.camera_ids):
+            t = ticks*period
+            samples = generate(t + i*self.motion.get('period', 10.0)/max(len(self.targets), 1), rng=self.rng, **self.motion)
+            send_times = t.copy()
+
+            if self.reorder > 0:
+                swap = np.flatnonzero(self.rng.random(count - 1) < self.reorder)
+                swap = swap[np.diff(swap, prepend=-2) > 1] # swaps do not chain
+                samples[[*swap, *(swap+1)]] = samples[[*(swap+1), *swap]]
+
+            if self.burst[0] > 0 and self.burst[1] > 1:
+                length = int(self.burst[1])
+                for start in np.flatnonzero(self.rng.random(count) < self.burst[0]):
+                    end = min(start + length, count)
+                    send_times[start:end] = send_times[end-1]
+
+            keep = self.rng.random(count) >= self.loss
+            offsets.append(send_times[keep])
+            indices.append(np.full(np.count_nonzero(keep), i))
+            packets.append(pack_batch(samples[keep], camera_id))
+
+        offsets = np.concatenate(offsets)
+        order = np.argsort(offsets, kind='stable')
+        return offsets[order], np.concatenate(indices)[order], np.concatenate(packets)[order]
+
+    def run(self, duration = None):
+        """
+            send until duration (s) elapsed, forever if None, or until stop().
+            returns a report of the packets sent and the achieved rate
+        """
+        self.isRunning = True
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        chunk_ticks = max(int(self.rate*CHUNK_DURATION), 1)
+        total_ticks = None if duration is None else int(duration*self.rate)
+        sent = 0
+        dropped = 0
+        lateness = 0.0
+        first = 0
+
+        start = time.monotonic()
+        while self.isRunning and (total_ticks is None or first < total_ticks):
+            count = chunk_ticks if total_ticks is None else min(chunk_ticks, total_ticks - first)
+            offsets, indices, packets = self.chunk(first, count)
+            first += count
+
+            i = 0
+            n = len(offsets)
+            while i < n and self.isRunning:
+                wait = offsets[i] - (time.monotonic() - start)
+                if wait > SPIN_THRESHOLD:
+                    time.sleep(wait - SPIN_THRESHOLD)
+                    continue
+                if wait > 0:
+                    continue
+                lateness = max(lateness, float(-wait))
+                try:
+                    sock.sendto(packets[i], self.targets[indices[i]])
+                    sent += 1
+                except OSError: # full send buffer
+                    dropped += 1
+                i += 1
+
+        elapsed = time.monotonic() - start
+        sock.close()
+        self.isRunning = False
+        self.report = {
+            'sent': sent,
+            'send_errors': dropped,
+            'duration': elapsed,
+            'send_rate': sent/elapsed if elapsed > 0 else 0.0,
+            'max_lateness': lateness,
+        }
+        return self.report
+
+    def start(self, duration = None):
+        self.thread = Thread(target=self.run, args=(duration,))
+        self.thread.start()
+
+    def stop(self):
+        self.isRunning = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+def print_report(report):
+    print("sent {sent} packets in {duration:.3f} s ({send_rate:.0f} packets/s), {send_errors} send errors, "
+          "schedule lateness up to {ms:.2f} ms".format(ms=report['max_lateness']*1000, **report))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="send synthetic FreeD D1 packets")
+    parser.add_argument("--target", nargs=2, action="append", default=[], metavar=("IP", "PORT"),
+                        help="one camera per target, camera ids 1 to N")
+    parser.add_argument("--rate", type=float, default=60.0, help="packets per second and per camera")
+    parser.add_argument("--duration", type=float, default=None, help="seconds, until interrupted if not given")
+    parser.add_argument("--motion", choices=MOTIONS, default='ORBIT')
+    parser.add_argument("--radius", type=float, default=3000.0, help="mm")
+    parser.add_argument("--height", type=float, default=1500.0, help="mm")
+    parser.add_argument("--period", type=float, default=10.0, help="s, of the orbit or dolly")
+    parser.add_argument("--zoom", nargs=2, type=int, default=(0, 0), metavar=("MIN", "MAX"), help="zoom pull encoder range")
+    parser.add_argument("--focus", nargs=2, type=int, default=(0, 0), metavar=("MIN", "MAX"), help="focus pull encoder range")
+    parser.add_argument("--pull-period", type=float, default=4.0, help="s")
+    parser.add_argument("--position-noise", type=float, default=0.0, help="mm")
+    parser.add_argument("--angle-noise", type=float, default=0.0, help="degrees")
+    parser.add_argument("--encoder-noise", type=float, default=0.0, help="encoder steps")
+    parser.add_argument("--loss", type=float, default=0.0, help="packet loss probability")
+    parser.add_argument("--reorder", type=float, default=0.0, help="probability of swapping consecutive packets")
+    parser.add_argument("--burst", nargs=2, type=float, default=(0.0, 0), metavar=("PROBABILITY", "LENGTH"))
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    motion = {
+        'motion': args.motion, 'radius': args.radius, 'height': args.height, 'period': args.period,
+        'zoom_range': args.zoom, 'focus_range': args.focus, 'pull_period': args.pull_period,
+        'position_noise': args.position_noise, 'angle_noise': args.angle_noise, 'encoder_noise': args.encoder_noise,
+    }
+    generator = FreedGenerator(args.target or [("127.0.0.1", 5000)], args.rate, motion=motion,
+                               loss=args.loss, reorder=args.reorder, burst=args.burst, seed=args.seed)
+    generator.start(args.duration)
+    try:
+        while generator.thread.is_alive():
+            generator.thread.join(0.5)
+    except KeyboardInterrupt:
+        pass
+    generator.stop()
+    print_report(generator.report)
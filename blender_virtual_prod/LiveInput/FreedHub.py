@@ -0,0 +1,147 @@
+"""
+Copyright Miraxyz 2024
+
+Defines a single threaded multiplexer serving all the FreeD receivers
+"""
+
+import socket
+import selectors
+from collections import deque
+from threading import Thread
+
+
+class FreedHub:
+    """
+        Owns the UDP sockets of any number of FreedReceiver and serves them all
+        from one selectors loop on a single thread, instead of one thread per receiver.
+
+        Receivers are decoded and dispatched with their own settings (drain_all, delivery, callback)
+        through FreedReceiver.handle_readable, and can be added or removed while the hub runs.
+        A socket pair wakes the loop up so that stop() and changes are applied instantly.
+        call() runs a function on the loop thread, between two receives (injections into the receivers).
+    """
+
+    def __init__(self):
+        self.selector = None
+        self.receivers = []
+        self.commands = deque() # (add/remove, receiver) or (call, function) applied by the loop thread
+        self.thread = None
+        self.isRunning = False
+        self.wakeup_recv = None
+        self.wakeup_send = None
+
+    def start(self):
+        self.stop() # try stopping
+        self.selector = selectors.DefaultSelector()
+        self.wakeup_recv, self.wakeup_send = socket.socketpair()
+        self.wakeup_recv.setblocking(False)
+        self.wakeup_send.setblocking(False)
+        self.selector.register(self.wakeup_recv, selectors.EVENT_READ, None)
+        for receiver in self.receivers:
+            self.register(receiver)
+        self.isRunning = True
+        self.thread = Thread(target=self.run)
+        self.thread.start()
+
+    def run(self):
+        while(self.isRunning):
+            for key, _ in self.selector.select():
+                receiver = key.data
+                if receiver is None:
+                    self.applyCommands()
+                    continue
+                try:
+                    receiver.handle_readable()
+                except Exception as e:
+                    print("error in freed receiver on port", receiver.port, e)
+
+    def wakeup(self):
+        try:
+            self.wakeup_send.send(b'\0')
+        except OSError: # wakeup already pending
+            pass
+
+    def applyCommands(self):
+        try:
+            while self.wakeup_recv.recv(4096):
+                pass
+        except OSError:
+            pass
+        while self.commands:
+            command, target = self.commands.popleft()
+            if command == 'add':
+                self.register(target)
+            elif command == 'remove':
+                self.unregister(target)
+            else:
+                try:
+                    target()
+                except Exception as e:
+                    print("error in freed hub call", e)
+
+    def register(self, receiver):
+        if receiver.sock is None and not receiver.open():
+            print("could not open receiver on port", receiver.port)
+            return False
+        receiver.sock.setblocking(False)
+        self.selector.register(receiver.sock, selectors.EVENT_READ, receiver)
+        return True
+
+    def unregister(self, receiver):
+        if receiver.sock is not None:
+            try:
+                self.selector.unregister(receiver.sock)
+            except (KeyError, ValueError):
+                pass
+            receiver.sock.close()
+            receiver.sock = None
+
+    def add(self, receiver):
+        """
+            serve a new receiver, the others keep running
+        """
+        self.receivers.append(receiver)
+        receiver.hub = self
+        if self.isRunning:
+            self.commands.append(('add', receiver))
+            self.wakeup()
+
+    def remove(self, receiver):
+        """
+            stop serving a receiver and close its socket, the others keep running
+        """
+        if receiver in self.receivers:
+            self.receivers.remove(receiver)
+        receiver.hub = None
+        if self.isRunning:
+            self.commands.append(('remove', receiver))
+            self.wakeup()
+        elif receiver.sock is not None:
+            receiver.sock.close()
+            receiver.sock = None
+
+    def call(self, function):
+        """
+            run function() on the loop thread, in order with the other calls.
+            Run right away when the hub is not running, nothing is received then
+        """
+        if self.isRunning:
+            self.commands.append(('call', function))
+            self.wakeup()
+        else:
+            function()
+
+    def stop(self):
+        self.isRunning = False
+        if self.thread is not None:
+            self.wakeup()
+            self.thread.join()
+        self.thread = None
+        if self.selector is not None:
+            self.applyCommands() # changes requested after the last loop
+            for receiver in self.receivers:
+                self.unregister(receiver)
+            self.selector.close()
+            self.wakeup_recv.close()
+            self.wakeup_send.close()
+        self.selector = None
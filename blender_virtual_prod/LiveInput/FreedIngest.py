@@ -0,0 +1,303 @@
+"""
+Copyright Miraxyz 2024
+
+Defines the out of process FreeD ingest: a daemon receiving and decoding FreeD,
+publishing timestamped samples into one shared memory ring buffer per tracker.
+
+The daemon is launched and supervised from Blender with FreedIngestProcess, and can also be run by hand:
+    python FreedIngest.py --ring <ring name> <ip> <port> <source ip or *> <camera id or -1> [--ring ...]
+Rings on the same ip and port share one socket, their packets are told apart by source ip and camera id.
+A ring given several times is fed by redundant sources, arbitrated by a FreedArbiter: the earliest copy of each
+sample is published, the delays of the sources are printed when the daemon exits.
+An ip in 224.0.0.0 to 239.255.255.255 is a multicast group, joined on --interface.
+"""
+
+import os
+import sys
+import time
+import argparse
+import itertools
+import subprocess
+from multiprocessing import shared_memory
+
+import numpy as np
+
+try:
+    from .Freed import FREED_ROW_WIDTH, STATS_SIZE, ANY_SOURCE, FreedDemuxReceiver, FreedStats
+    from .FreedHub import FreedHub
+    from .FreedArbiter import FreedArbiter
+    from .FreedCapture import FreedCaptureWriter
+except ImportError: # run as the ingest daemon script
+    from Freed import FREED_ROW_WIDTH, STATS_SIZE, ANY_SOURCE, FreedDemuxReceiver, FreedStats
+    from FreedHub import FreedHub
+    from FreedArbiter import FreedArbiter
+    from FreedCapture import FreedCaptureWriter
+
+
+# ring rows are the receivers rows, x,y,z,pan,tilt,roll,zoom,focus,timestamp
+RING_WIDTH = FREED_ROW_WIDTH
+RING_HEADER = 4 # count, capacity, width, last write (monotonic ns)
+
+RING_NAMES = itertools.count()
+
+# a daemon dying is restarted after INGEST_RESTART_DELAY seconds, doubled at each consecutive death,
+# and given up after INGEST_MAX_RESTARTS. A daemon running for INGEST_STABLE_TIME seconds resets the count
+INGEST_RESTART_DELAY = 0.5 # s
+INGEST_MAX_RESTARTS = 5
+INGEST_STABLE_TIME = 10.0 # s
+
+
+class FreedRing:
+    """
+        Lock free single writer / multiple readers ring buffer of samples in shared memory.
+
+        Layout: int64 header[RING_HEADER], float64 stats[STATS_SIZE], int64 sequence[capacity], float64 rows[capacity, RING_WIDTH].
+        stats are the FreedStats counters of the receiver publishing to the ring.
+        The writer marks a slot as being written (sequence -1), writes the row, then stores the
+        sample sequence number in the slot and increments the count. Readers copy rows then check
+        that the slot sequences still match, rows overwritten during the copy are dropped.
+    """
+
+    def __init__(self, name, capacity = 4096, create = False):
+        self.name = name
+        size = 8*(RING_HEADER + STATS_SIZE + capacity + capacity*RING_WIDTH)
+        if create:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        else:
+            self.shm = attach_shared_memory(name)
+            capacity = int(np.ndarray((RING_HEADER,), dtype=np.int64, buffer=self.shm.buf)[1])
+
+        self.capacity = capacity
+        self.header = np.ndarray((RING_HEADER,), dtype=np.int64, buffer=self.shm.buf)
+        self.stats = FreedStats(np.ndarray((STATS_SIZE,), dtype=np.float64, buffer=self.shm.buf, offset=8*RING_HEADER))
+        self.sequence = np.ndarray((capacity,), dtype=np.int64, buffer=self.shm.buf, offset=8*(RING_HEADER + STATS_SIZE))
+        self.rows = np.ndarray((capacity, RING_WIDTH), dtype=np.float64, buffer=self.shm.buf,
+                               offset=8*(RING_HEADER + STATS_SIZE + capacity))
+        if create:
+            self.header[:] = [0, capacity, RING_WIDTH, 0]
+            self.stats.reset()
+            self.sequence[:] = 0
+
+    def write(self, samples):
+        """
+            append a (n, FREED_ROW_WIDTH) batch of samples
+        """
+        samples = samples[-self.capacity:]
+        n = samples.shape[0]
+        count = int(self.header[0])
+        numbers = np.arange(count + 1, count + n + 1)
+        slots = (numbers - 1) % self.capacity
+
+        self.sequence[slots] = -1
+        self.rows[slots] = samples
+        self.sequence[slots] = numbers
+        self.header[0] = count + n
+        self.header[3] = time.monotonic_ns()
+
+    def count(self):
+        return int(self.header[0])
+
+    def read(self, since = 0):
+        """
+            rows published after the since-th sample, and the count to pass at the next call
+        """
+        count = int(self.header[0])
+        first = max(since, count - self.capacity)
+        if count <= first:
+            return self.rows[:0].copy(), count
+
+        numbers = np.arange(first + 1, count + 1)
+        slots = (numbers - 1) % self.capacity
+        rows = self.rows[slots]
+        valid = self.sequence[slots] == numbers
+        return rows[valid], count
+
+    def latest(self):
+        """
+            newest row, or None if nothing has been published yet
+        """
+        rows, _ = self.read(self.count() - 1)
+        if rows.shape[0] == 0:
+            return None
+        return rows[-1]
+
+    def close(self):
+        self.header = self.stats = self.sequence = self.rows = None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+def attach_shared_memory(name):
+    """
+        attach to an existing shared memory block without letting this process' resource tracker destroy it on exit
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False) # python 3.13+
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        if os.name == 'posix':
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+
+class FreedIngestProcess:
+    """
+        Launches and supervises the ingest daemon, and owns the rings it publishes to.
+        trackers is a list of the sources of each tracker, lists of (ip, port, source ip, camera id),
+        ring i receives the samples of tracker i, the earliest copy of each if it has several sources.
+    """
+
+    def __init__(self, trackers, capacity = 4096, rcvbuf = 0, kernel_timestamps = False, capture = None,
+                 interface = "0.0.0.0"):
+        self.trackers = trackers
+        self.capacity = capacity
+        self.rcvbuf = rcvbuf
+        self.kernel_timestamps = kernel_timestamps
+        self.interface = interface # multicast interface
+        self.capture = capture # raw capture file path, recorded by the daemon
+        self.rings = []
+        self.process = None
+        self.restarts = 0 # daemons launched after the first one
+        self.deaths = 0 # consecutive deaths of the daemon
+        self.launch_time = 0.0
+        self.restart_time = None # monotonic time of the pending restart
+        self.failure = None # why the daemon was given up, None while it is supervised
+
+    def start(self):
+        self.stop()
+        self.deaths = 0
+        self.failure = None
+        for i in range(len(self.trackers)):
+            name = "bvp_freed_{}_{}".format(os.getpid(), next(RING_NAMES))
+            self.rings.append(FreedRing(name, self.capacity, create=True))
+        self.launch()
+
+    def launch(self):
+        args = [sys.executable, os.path.abspath(__file__), "--rcvbuf", str(self.rcvbuf), "--interface", self.interface]
+        if self.kernel_timestamps:
+            args.append("--kernel-timestamps")
+        if self.capture:
+            # a restarted daemon must not overwrite the capture of the previous one
+            capture = self.capture if self.restarts == 0 else "{}.{}".format(self.capture, self.restarts)
+            args += ["--capture", capture]
+        for ring, sources in zip(self.rings, self.trackers):
+            for ip, port, source, camera_id in sources:
+                args += ["--ring", ring.name, ip, str(port), source or "*", str(camera_id)]
+        # the daemon exits when its stdin is closed, so it never outlives Blender
+        self.process = subprocess.Popen(args, stdin=subprocess.PIPE)
+        self.launch_time = time.monotonic()
+
+    def check(self):
+        """
+            restart the daemon if it died, with an exponential backoff, and give up after INGEST_MAX_RESTARTS
+            consecutive deaths (failure then holds the reason). returns False while the daemon is not running
+        """
+        if self.failure is not None:
+            return False
+        now = time.monotonic()
+        if self.process is not None and self.process.poll() is not None:
+            code = self.process.returncode
+            self.process = None
+            if now - self.launch_time >= INGEST_STABLE_TIME:
+                self.deaths = 0
+            if self.deaths >= INGEST_MAX_RESTARTS:
+                self.failure = "freed ingest daemon exited with code {}, {} times in a row, not restarted".format(code, self.deaths + 1)
+                print(self.failure)
+                return False
+            delay = INGEST_RESTART_DELAY*2**self.deaths
+            self.deaths += 1
+            self.restart_time = now + delay
+            print("freed ingest daemon exited with code {}, restarting in {:.1f} s".format(code, delay))
+            return False
+        if self.process is None and self.restart_time is not None:
+            if now < self.restart_time:
+                return False
+            self.restart_time = None
+            self.restarts += 1
+            self.launch()
+        return self.process is not None
+
+    def stop(self):
+        if self.process is not None:
+            try:
+                self.process.stdin.close()
+                self.process.wait(timeout=2)
+            except (OSError, subprocess.TimeoutExpired):
+                self.process.kill()
+        self.process = None
+        self.restart_time = None
+        for ring in self.rings:
+            ring.close()
+            ring.unlink()
+        self.rings = []
+
+
+
+def run_daemon(rings, rcvbuf = 0, kernel_timestamps = False, capture = None, interface = "0.0.0.0"):
+    """
+        receive the (ring name, ip, port, source ip, camera id) trackers and publish them until stdin is closed.
+        a ring named several times is fed by the earliest copy of the samples of its sources.
+        the datagrams are also recorded in the capture file if given, receiver ids are the sockets order
+    """
+    hub = FreedHub()
+    try:
+        recorder = FreedCaptureWriter(capture) if capture else None
+    except OSError as e:
+        sys.exit("could not create capture {}: {}".format(capture, e))
+    receivers = {} # (ip, port): FreedDemuxReceiver
+    sources = {} # ring name: number of sources
+    for name, ip, port, source, camera_id in rings:
+        sources[name] = sources.get(name, 0) + 1
+    arbiters = {} # ring name: FreedArbiter of the rings with redundant sources
+    opened = {} # ring name: FreedRing
+    routed = {} # ring name: number of sources routed
+    for name, ip, port, source, camera_id in rings:
+        if (ip, int(port)) not in receivers:
+            receiver = FreedDemuxReceiver(ip, int(port), rcvbuf=rcvbuf, kernel_timestamps=kernel_timestamps,
+                                          interface=interface)
+            receiver.recorder = recorder
+            receiver.receiver_id = len(receivers)
+            receivers[(ip, int(port))] = receiver
+            hub.add(receiver)
+        if name not in opened:
+            opened[name] = FreedRing(name)
+        ring = opened[name]
+        if sources[name] == 1:
+            route = receivers[(ip, int(port))].route(ANY_SOURCE if source == "*" else source, int(camera_id), ring.write)
+            route.stats = ring.stats # published along with the samples
+        else:
+            if name not in arbiters:
+                arbiters[name] = FreedArbiter(ring.write, sources[name])
+                arbiters[name].stats = ring.stats # the published stream
+            arbiter = arbiters[name]
+            receivers[(ip, int(port))].route(ANY_SOURCE if source == "*" else source, int(camera_id), arbiter.source(routed.get(name, 0)))
+        routed[name] = routed.get(name, 0) + 1
+    hub.start()
+
+    try:
+        sys.stdin.read() # blocks until the parent closes the pipe or dies
+    except KeyboardInterrupt:
+        pass
+    hub.stop()
+    if recorder is not None:
+        recorder.close()
+    for name, arbiter in arbiters.items():
+        print("ring {}, {} failovers".format(name, arbiter.failovers))
+        for line in arbiter.report():
+            print("    " + line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="FreeD ingest daemon publishing to shared memory rings")
+    parser.add_argument("--ring", nargs=5, action="append", default=[], metavar=("NAME", "IP", "PORT", "SOURCE", "CAMERA_ID"),
+                        help="SOURCE * and CAMERA_ID -1 accept any source ip and camera id")
+    parser.add_argument("--rcvbuf", type=int, default=0)
+    parser.add_argument("--kernel-timestamps", action="store_true")
+    parser.add_argument("--interface", default="0.0.0.0", help="address of the interface joining the multicast groups")
+    parser.add_argument("--capture", default=None, help="record the raw datagrams in this capture file")
+    args = parser.parse_args()
+    run_daemon(args.ring, args.rcvbuf, args.kernel_timestamps, args.capture, args.interface)
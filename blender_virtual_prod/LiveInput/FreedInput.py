@@ -1,31 +1,203 @@
 import os
+import math
+import time
+from collections import deque
+
 import bpy
 import mathutils
 
 import numpy as np
 
-from .Freed import FreedReceiver
-
-
-def ZYX_to_quat(yaw, pitch, roll):
-    yaw*=(np.pi/180)
-    pitch*=-(np.pi/180)
-    roll*=-(np.pi/180)
-
-    cy = np.cos(yaw * 0.5)
-    sy = np.sin(yaw * 0.5)
-    cp = np.cos(pitch * 0.5)
-    sp = np.sin(pitch * 0.5)
-    cr = np.cos(roll * 0.5)
-    sr = np.sin(roll * 0.5)
-
-    q = np.zeros(4)
-    q[0] = cy * cr * cp + sy * sr * sp
-    q[1] = sy * cr * cp - cy * sr * sp
-    q[2] = cy * sr * cp + sy * cr * sp
-    q[3] = cy * cr * sp - sy * sr * cp
+from .Freed import FreedDemuxReceiver, FREED_TIMESTAMP, FREED_SAMPLE_WIDTH, FREED_ROW_WIDTH
+from .FreedHub import FreedHub
+from .FreedArbiter import FreedArbiter
+from .FreedIngest import FreedIngestProcess
+from .FreedCapture import FreedCaptureWriter
+from .FreedJournal import FreedJournalWriter, read_journal, journal_samples
+from .FreedSender import FreedRelay
+from ..Tracing.Tracing import traced
+from .FreedProcessing import FREED_TO_BLENDER, ZYX_to_quat, pose_to_freed, KeyframeDecimator, FrameResampler, PosePredictor, jitter_filter
+
+
+# (label, FreedStats) of the running receivers, shown in the statistics panel
+LIVE_STATS = []
+
+# (label, FreedArbiter) of the trackers received from redundant sources, shown in the statistics panel
+LIVE_ARBITERS = []
+
+# socket index (capture receiver id): FreedDemuxReceiver of the receivers running in Blender, for replays
+LIVE_RECEIVERS = {}
+STATS_REFRESH_INTERVAL = 0.5 # s
+
+DEG_TO_HALF_RAD = math.pi/360
+
+# keys are evicted from a rolling window once the oldest is this fraction of the window too old, in one pass
+WINDOW_SLACK = 0.1
+
+
+def refresh_stats_ui():
+    """
+        timer redrawing the properties editor while receivers are running
+    """
+    if not LIVE_STATS:
+        return None
+    for window in bpy.context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type == 'PROPERTIES':
+                area.tag_redraw()
+    return STATS_REFRESH_INTERVAL
+
+
+def tag_view3d_redraw():
+    for window in bpy.context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type == 'VIEW_3D':
+                area.tag_redraw()
+
+
+def tracked_receivers(scene):
+    """
+        receiver settings of the scene which drive an object, receivers driving the same object are redundant
+        sources of one tracker (see tracker_sources).
+        a receiver receiving the same packets (ip, port, source and camera id) as a previous one is left out
+    """
+    trackers = []
+    keys = set()
+    for props in scene.freed_receivers:
+        if props.posetarget is None:
+            continue
+        key = (props.ip, int(props.port), props.source, props.camera_id)
+        if key in keys:
+            print("{} receives the same packets as another tracker, not received".format(props.posetarget.name))
+            continue
+        keys.add(key)
+        trackers.append(props)
+    return trackers
+
+
+def tracker_sources(receivers):
+    """
+        receivers grouped by target object, in order of first use: receivers driving the same object are
+        redundant sources of one tracker, the first one holds the settings of the tracker
+    """
+    groups = {}
+    for props in receivers:
+        groups.setdefault(props.posetarget.name, []).append(props)
+    return list(groups.values())
+
+
+def receiver_sockets(trackers):
+    """
+        {(ip, port): socket index} of the trackers, in order of first use.
+        trackers on the same ip and port share a socket, the socket index is their receiver id in captures
+    """
+    sockets = {}
+    for props in trackers:
+        sockets.setdefault((props.ip, int(props.port)), len(sockets))
+    return sockets
+
+
+def scene_jitter_filter(scene):
+    """
+        new jitter filter of the scene settings, None if disabled
+    """
+    props = scene.virtual_prod_props
+    return jitter_filter(props.filter_model, props.filter_min_cutoff,
+                         [props.filter_beta_position]*3 + [props.filter_beta_angle]*3 + [props.filter_beta_encoder]*2)
+
+
+def append_keyframes(id_data, data_path, index, frames, values):
+    """
+        append keyframes to the F-curve of id_data at data_path[index], creating it if needed.
+        only the new keys are written, so that the cost does not grow with the take: their handles are
+        left on the keys until update_keyframes computes those of the whole F-curves, at the end of the take
+    """
+    if id_data.animation_data is None:
+        id_data.animation_data_create()
+    if id_data.animation_data.action is None:
+        id_data.animation_data.action = bpy.data.actions.new(id_data.name + "Action")
+    fcurves = id_data.animation_data.action.fcurves
+    fcurve = fcurves.find(data_path, index=index)
+    if fcurve is None:
+        fcurve = fcurves.new(data_path, index=index)
+
+    points = fcurve.keyframe_points
+    count = len(points)
+    points.add(len(frames))
+    for i, co in enumerate(zip(np.asarray(frames, dtype=np.float64).tolist(), np.asarray(values, dtype=np.float64).tolist())):
+        point = points[count + i]
+        point.co = co
+        point.handle_left = co
+        point.handle_right = co
+
+
+def update_keyframes(id_data):
+    """
+        compute the handles of all the F-curves of id_data, once keys were appended
+    """
+    if id_data.animation_data is None or id_data.animation_data.action is None:
+        return
+    for fcurve in id_data.animation_data.action.fcurves:
+        fcurve.update()
+
+
+def trim_keyframes(id_data, first_frame):
+    """
+        remove the keyframes before first_frame from all the F-curves of id_data, rebuilding each F-curve in one batch
+    """
+    if id_data.animation_data is None or id_data.animation_data.action is None:
+        return
+    for fcurve in id_data.animation_data.action.fcurves:
+        points = fcurve.keyframe_points
+        co = np.empty(2*len(points), dtype=np.float32)
+        points.foreach_get("co", co)
+        first = int(np.searchsorted(co[0::2], first_frame))
+        if first == 0:
+            continue
+        points.clear()
+        points.add(len(co)//2 - first)
+        points.foreach_set("co", co[2*first:])
+        fcurve.update()
+
+
+
+class KeyframeWindow:
+    """
+        Rolling window of the keyframed samples of a tracker, keeping only the keys of the last seconds
+        on the live objects. Evicted samples are appended to the spill file if given, as float64
+        rows of frame,x,y,z,pan,tilt,roll,zoom,focus,timestamp (np.fromfile(path).reshape(-1, 10))
+    """
+
+    def __init__(self, seconds, spill_path = None):
+        self.seconds = seconds
+        self.rows = np.zeros((0, 1 + FREED_ROW_WIDTH))
+        self.spill = open(spill_path, "ab") if spill_path else None
+
+    def append(self, frames, samples):
+        rows = np.empty((len(frames), 1 + FREED_ROW_WIDTH))
+        rows[:, 0] = frames
+        rows[:, 1:] = samples[:, :FREED_ROW_WIDTH]
+        self.rows = np.concatenate((self.rows, rows))
+
+    def evict(self, id_datas):
+        """
+            remove the keys older than the window from id_datas once they are WINDOW_SLACK too old
+        """
+        timestamps = self.rows[:, 1 + FREED_TIMESTAMP]
+        if timestamps.size == 0 or timestamps[-1] - timestamps[0] <= self.seconds*(1 + WINDOW_SLACK):
+            return
+        first = int(np.searchsorted(timestamps, timestamps[-1] - self.seconds))
+        for id_data in id_datas:
+            trim_keyframes(id_data, self.rows[first, 0])
+        if self.spill is not None:
+            self.spill.write(self.rows[:first].astype('<f8').tobytes())
+            self.spill.flush()
+        self.rows = self.rows[first:].copy()
 
-    return q
+    def close(self):
+        if self.spill is not None:
+            self.spill.close()
+            self.spill = None
 
 
 
@@ -36,7 +208,20 @@ class FreedReferential:
         self.rotation_world = mathutils.Quaternion(np.zeros(4))
         self.zoom  = 0
         self.focus = 0
+        self.timestamp = 0.0 # arrival time of the last sample, seconds on the monotonic clock
+        self.pending = deque() # batches of samples received since the last applyPending, filled by the receiver thread
         self.current_frame = 1
+        self.window = None # KeyframeWindow, keeps all keys if None
+        self.decimator = None # KeyframeDecimator, keys every sample if None
+        self.resampler = None # FrameResampler, one key per sample on consecutive frames if None
+        self.jitter = None # OneEuroFilter or KalmanFilter applied to the samples before anything else
+        self.predictor = None # PosePredictor, the shown pose is extrapolated prediction_horizon seconds ahead if set
+        self.prediction_horizon = 0.0
+        self.journal = None # FreedJournalWriter of the armed take, records the keyed samples if set
+        self.journal_tracker = 0 # index of this tracker in the journal
+        self.relay = None # FreedRelay re-broadcasting the filtered samples if set
+        self.relay_camera_id = 0 # camera id of the relayed packets
+        self.keyed = False # keys appended since the F-curves handles were last computed
         self.linked_object = linked_object
         self.is_camera = is_camera
         self.camera = camera
@@ -51,82 +236,349 @@ class FreedReferential:
             self.camera.data['K2 Disto'] = -0.0000000000000001
 
 
-    def updateCallback(self,data):
+    def queueCallback(self, data):
+        """
+            receiver thread callback, queues a sample or a batch of samples for applyPending.
+            receivers reuse their buffers, the samples are copied
+        """
+        self.pending.append(np.array(data, ndmin=2))
+
+
+    @traced("referential.apply")
+    def applyPending(self, record = True):
+        """
+            main thread, apply the latest queued pose to the linked objects and, if record,
+            keyframe all the queued samples. Otherwise (preview) older samples are dropped.
+            returns the number of samples applied
+        """
+        batches = []
+        while self.pending:
+            batches.append(self.pending.popleft())
+        if not batches:
+            return 0
+        samples = batches[0] if len(batches) == 1 else np.concatenate(batches)
+        if self.jitter is not None and samples.shape[1] > FREED_TIMESTAMP:
+            samples = self.jitter.filter(samples)
+        if self.relay is not None:
+            self.relay.sendBatch(samples, self.relay_camera_id)
+        if self.predictor is not None and samples.shape[1] > FREED_TIMESTAMP:
+            self.predictor.update(samples)
+            self.setPose(self.predictor.predict(time.monotonic() + self.prediction_horizon))
+        else:
+            self.setPose(samples[-1])
+
+        if not record:
+            self.finishTake()
+            if self.linked_object is not None:
+                self.applyPose()
+                self.preview_camera()
+            return 1
+        if self.linked_object is not None:
+            self.applyPose()
+            self.keyframeBatch(samples)
+        return samples.shape[0]
+
+
+    def applyPose(self):
+        self.linked_object.location = self.position_world
+        self.linked_object.rotation_mode = 'QUATERNION'
+        self.linked_object.rotation_quaternion = self.rotation_world
+
+
+    def setPose(self, data):
         """
-            called at each received freed message
+            convert a freed sample to the world pose and lens encoders
         """
         self.position_world[0] = data[0]/1000 # convert to meters
         self.position_world[1] = data[1]/1000
         self.position_world[2] = data[2]/1000
 
-        yaw   = -data[3]
-        pitch = data[4]
-        roll  = data[5]
-
-        quat = ZYX_to_quat(yaw, pitch-90, roll)
-        quat2 = np.array([quat[3],quat[0],quat[1],quat[2]])
-        self.rotation_world = mathutils.Quaternion(quat2)
+        # half angles of Rz(-pan) Ry(roll) Rx(tilt)
+        z = -data[3]*DEG_TO_HALF_RAD
+        y = data[5]*DEG_TO_HALF_RAD
+        x = data[4]*DEG_TO_HALF_RAD
+        cz, sz = math.cos(z), math.sin(z)
+        cy, sy = math.cos(y), math.sin(y)
+        cx, sx = math.cos(x), math.sin(x)
+        w = cx*cy*cz + sx*sy*sz
+        i = sx*cy*cz - cx*sy*sz
+        j = cx*sy*cz + sx*cy*sz
+        k = cx*cy*sz - sx*sy*cz
+
+        # then the constant axis change, written in place in the reused quaternion
+        kw, ki, kj, kk = FREED_TO_BLENDER
+        q = self.rotation_world
+        q[0] = w*kw - i*ki - j*kj - k*kk
+        q[1] = w*ki + i*kw + j*kk - k*kj
+        q[2] = w*kj - i*kk + j*kw + k*ki
+        q[3] = w*kk + i*kj - j*ki + k*kw
 
         self.zoom = data[6]
         self.focus = data[7]
 
-        if self.linked_object is not None:
-            self.updateLinkedObject()
+        if len(data) > FREED_TIMESTAMP:
+            self.timestamp = data[FREED_TIMESTAMP]
 
 
-    def updateLinkedObject(self):
+    @traced("referential.keyframe")
+    def keyframeBatch(self, samples):
         """
-            update linked object position and rotation and write to frames
+            keyframe (N, 8+) samples on N consecutive frames from current_frame, or on the scene frames
+            they cover if resampled, one F-curve write per channel
         """
-        self.linked_object.location = self.position_world
+        if self.resampler is not None and samples.shape[1] > FREED_TIMESTAMP:
+            frames, samples = self.resampler.resample(samples)
+            if len(frames) == 0:
+                return
+        else:
+            frames = np.arange(self.current_frame, self.current_frame + samples.shape[0])
+
+        if self.journal is not None:
+            self.journal.append(self.journal_tracker, frames, samples)
+
+        if self.decimator is None:
+            self.keyframeGroups([(frames, samples)]*3)
+        else:
+            self.keyframeGroups(self.decimator.select(frames, samples))
+        # next free slot: the next frame, or subframe when resampled on subframes
+        self.current_frame = frames[-1] + (1/self.resampler.subframes if self.resampler is not None else 1)
+
+        if self.window is not None and samples.shape[1] > FREED_TIMESTAMP:
+            self.window.append(frames, samples)
+            id_datas = [self.linked_object]
+            if self.is_camera and self.camera is not None:
+                id_datas += [self.camera.data, self.camera]
+            self.window.evict(id_datas)
+
+
+    def keyframeGroups(self, groups):
+        """
+            keyframe the (frames, samples) of the position, rotation and lens groups
+        """
+        (position_frames, positions), (rotation_frames, rotations), (lens_frames, lenses) = groups
 
-        quat = self.rotation_world
-        self.linked_object.rotation_mode = 'QUATERNION'
-        self.linked_object.rotation_quaternion = quat
+        if len(position_frames) > 0:
+            for i in range(3):
+                append_keyframes(self.linked_object, "location", i, position_frames, positions[:, i]/1000)
+        if len(rotation_frames) > 0:
+            quat = ZYX_to_quat(-rotations[:, 3], rotations[:, 4]-90, rotations[:, 5])
+            for i, q in enumerate((quat[3], quat[0], quat[1], quat[2])): # w,x,y,z
+                append_keyframes(self.linked_object, "rotation_quaternion", i, rotation_frames, q)
+        if len(lens_frames) > 0:
+            self.update_camera_batch(lens_frames, lenses[:, 6], lenses[:, 7])
+        self.keyed = True
 
-        self.linked_object.keyframe_insert(data_path="rotation_quaternion", frame=self.current_frame)
-        self.linked_object.keyframe_insert(data_path="location", frame=self.current_frame)
-        
-        self.update_camera()
-        
-        self.current_frame += 1
-        
-        
-    def update_camera(self):
+
+    def updateKeyframes(self):
+        """
+            compute the handles of the keys appended since the last call, on the whole F-curves
+        """
+        id_datas = [self.linked_object]
+        if self.is_camera and self.camera is not None:
+            id_datas += [self.camera.data, self.camera]
+        for id_data in id_datas:
+            update_keyframes(id_data)
+        self.keyed = False
+
+
+    def finishTake(self):
+        """
+            key the samples held back by the decimator, compute the handles of the take keys and restart
+            the resampling on the next frame, so that the samples received until the next take are not interpolated over
+        """
+        if self.decimator is not None and self.linked_object is not None:
+            self.keyframeGroups(self.decimator.flush())
+        if self.keyed and self.linked_object is not None:
+            self.updateKeyframes()
+        if self.resampler is not None:
+            self.resampler.reset(self.current_frame)
+
+
+    @traced("referential.lens")
+    def preview_camera(self):
+        """
+            set the current lens values, without keyframing
+        """
+        if self.is_camera and self.camera is not None:
+            self.camera.data['0_zoom'] = self.zoom
+            self.camera.data['0_focus'] = self.focus
+
+            if 'getK1U' in bpy.app.driver_namespace:
+                self.camera.data['K1 Undisto'] = bpy.app.driver_namespace['getK1U'](self.zoom, self.focus)
+                self.camera.data['K2 Undisto'] = bpy.app.driver_namespace['getK2U'](self.zoom, self.focus)
+                self.camera.data['K1 Disto'] = bpy.app.driver_namespace['getK1D'](self.zoom, self.focus)
+                self.camera.data['K2 Disto'] = bpy.app.driver_namespace['getK2D'](self.zoom, self.focus)
+                self.camera.data.lens = bpy.app.driver_namespace['getFocal'](self.zoom, self.focus)
+                self.camera.data.dof.focus_distance = bpy.app.driver_namespace['getFocus'](self.zoom, self.focus)
+                self.camera.location = [0,0,-bpy.app.driver_namespace['getEPD'](self.zoom, self.focus)]
+
+
+    @traced("referential.lens")
+    def update_camera_batch(self, frames, zooms, focuses):
+        """
+            keyframe the lens encoders and the mapped lens values on frames, the current values are the last ones
+        """
         if self.is_camera and self.camera is not None:
             self.camera.data['0_zoom'] = self.zoom
             self.camera.data['0_focus'] = self.focus
-            self.camera.data.keyframe_insert(data_path='["0_zoom"]', frame=self.current_frame)
-            self.camera.data.keyframe_insert(data_path='["0_focus"]', frame=self.current_frame)
-            
+            append_keyframes(self.camera.data, '["0_zoom"]', 0, frames, zooms)
+            append_keyframes(self.camera.data, '["0_focus"]', 0, frames, focuses)
+
             if 'getK1U' in bpy.app.driver_namespace:
-                k1U_widthone = bpy.app.driver_namespace['getK1U'](self.zoom, self.focus)
-                k1D_widthone = bpy.app.driver_namespace['getK1D'](self.zoom, self.focus)
-                k2U_widthone = bpy.app.driver_namespace['getK2U'](self.zoom, self.focus)
-                k2D_widthone = bpy.app.driver_namespace['getK2D'](self.zoom, self.focus)
-                focal = bpy.app.driver_namespace['getFocal'](self.zoom, self.focus)
-                focus = bpy.app.driver_namespace['getFocus'](self.zoom, self.focus)
-                epd = bpy.app.driver_namespace['getEPD'](self.zoom, self.focus)
-                
-                self.camera.data['K1 Undisto'] = k1U_widthone
-                self.camera.data['K2 Undisto'] = k2U_widthone
-                self.camera.data['K1 Disto'] = k1D_widthone
-                self.camera.data['K2 Disto'] = k2D_widthone
-                self.camera.data.keyframe_insert(data_path='["K1 Undisto"]', frame=self.current_frame)
-                self.camera.data.keyframe_insert(data_path='["K2 Undisto"]', frame=self.current_frame)
-                self.camera.data.keyframe_insert(data_path='["K1 Disto"]', frame=self.current_frame)
-                self.camera.data.keyframe_insert(data_path='["K2 Disto"]', frame=self.current_frame)
-                
-                # TODO add a try except here to handle object not being a camera
-                self.camera.data.lens = focal
-                self.camera.data.keyframe_insert(data_path='lens', frame=self.current_frame)
-                
-                self.camera.data.dof.focus_distance = focus
-                self.camera.data.dof.keyframe_insert(data_path='focus_distance', frame=self.current_frame)
-                
-                self.camera.location = [0,0,-epd]
-                self.camera.keyframe_insert(data_path="location", frame=self.current_frame)
-                
+                # lens mapping functions are scalar
+                names = ['getK1U', 'getK2U', 'getK1D', 'getK2D', 'getFocal', 'getFocus', 'getEPD']
+                functions = [bpy.app.driver_namespace[name] for name in names]
+                lens = np.array([[f(zoom, focus) for f in functions] for zoom, focus in zip(zooms, focuses)]).reshape(-1, len(names))
+
+                self.camera.data['K1 Undisto'] = lens[-1, 0]
+                self.camera.data['K2 Undisto'] = lens[-1, 1]
+                self.camera.data['K1 Disto'] = lens[-1, 2]
+                self.camera.data['K2 Disto'] = lens[-1, 3]
+                append_keyframes(self.camera.data, '["K1 Undisto"]', 0, frames, lens[:, 0])
+                append_keyframes(self.camera.data, '["K2 Undisto"]', 0, frames, lens[:, 1])
+                append_keyframes(self.camera.data, '["K1 Disto"]', 0, frames, lens[:, 2])
+                append_keyframes(self.camera.data, '["K2 Disto"]', 0, frames, lens[:, 3])
+
+                self.camera.data.lens = lens[-1, 4]
+                append_keyframes(self.camera.data, 'lens', 0, frames, lens[:, 4])
+
+                self.camera.data.dof.focus_distance = lens[-1, 5]
+                append_keyframes(self.camera.data, 'dof.focus_distance', 0, frames, lens[:, 5])
+
+                self.camera.location = [0,0,-lens[-1, 6]]
+                locations = np.zeros((len(frames), 3))
+                locations[:, 2] = -lens[:, 6]
+                for i in range(3):
+                    append_keyframes(self.camera, "location", i, frames, locations[:, i])
+
+
+
+
+def freed_samples(locations, quaternions, lens_values):
+    """
+        (N, 8) FreeD samples of Blender world locations, w,x,y,z rotations and (zoom, focus) encoders
+    """
+    samples = np.empty((len(locations), FREED_SAMPLE_WIDTH))
+    samples[:, :6] = pose_to_freed(locations, quaternions)
+    samples[:, 6:] = lens_values
+    return samples
+
+
+def lens_encoders(lens_object):
+    """
+        zoom and focus encoders keyed on a camera by the receivers, 0 without a camera
+    """
+    if lens_object is None or lens_object.type != 'CAMERA':
+        return (0, 0)
+    return (lens_object.data.get('0_zoom', 0), lens_object.data.get('0_focus', 0))
+
+
+def current_sample(pose_object, lens_object = None):
+    """
+        FreeD sample of the current world pose of pose_object and encoders of lens_object
+    """
+    matrix = pose_object.matrix_world
+    return freed_samples([matrix.to_translation()], [matrix.to_quaternion()], [lens_encoders(lens_object)])[0]
+
+
+def sample_range(scene, pose_object, lens_object, frame_start, frame_end, subframes = 1):
+    """
+        FreeD samples of pose_object and lens_object on each frame (or subframe) from frame_start to frame_end.
+        the scene is evaluated frame by frame, the conversion is done for all frames at once
+    """
+    frame_current, subframe_current = scene.frame_current, scene.frame_subframe
+    n = (frame_end - frame_start)*subframes + 1
+    locations = np.empty((n, 3))
+    quaternions = np.empty((n, 4))
+    lens_values = np.empty((n, 2))
+    for k in range(n):
+        frame, subframe = divmod(k, subframes)
+        scene.frame_set(frame_start + frame, subframe=subframe/subframes)
+        matrix = pose_object.matrix_world
+        locations[k] = matrix.to_translation()
+        quaternions[k] = matrix.to_quaternion()
+        lens_values[k] = lens_encoders(lens_object)
+    scene.frame_set(frame_current, subframe=subframe_current)
+    return freed_samples(locations, quaternions, lens_values)
+
+
+def import_take(path, replace = True, new_filter = None):
+    """
+        key the samples of a take journal on the objects they were recorded on, each channel in one batch.
+        the previous animation of the objects is removed if replace, otherwise the keys are added to it.
+        the samples of each tracker are smoothed by new_filter() if given (see scene_jitter_filter),
+        takes are recorded after the live filter already.
+        returns the number of samples imported
+    """
+    trackers, fps, columns = read_journal(path)
+    imported = 0
+    for tracker, (object_name, camera_name) in enumerate(trackers):
+        frames, samples = journal_samples(columns, tracker)
+        tracked_object = bpy.data.objects.get(object_name)
+        if tracked_object is None:
+            print("take tracker {}: no object named {}, skipped".format(tracker, object_name))
+            continue
+        if len(frames) == 0:
+            continue
+        camera = bpy.data.objects.get(camera_name) if camera_name else None
+        jitter = new_filter() if new_filter is not None else None
+        if jitter is not None:
+            samples = jitter.filter(samples)
+
+        if replace:
+            for id_data in [tracked_object] + ([camera, camera.data] if camera is not None else []):
+                if id_data.animation_data:
+                    id_data.animation_data.action = None
+
+        referential = FreedReferential(tracked_object, is_camera = camera is not None, camera = camera)
+        referential.setPose(samples[-1])
+        referential.applyPose()
+        referential.keyframeGroups([(frames, samples)]*3)
+        referential.updateKeyframes()
+        imported += len(frames)
+    return imported
+
+
+
+
+def benchmark_pose(n = 100000):
+    """
+        per sample cost of the FreedReferential pose conversion, before (ZYX_to_quat and a new quaternion)
+        and now, and the largest difference between both. Run from the Blender python console
+    """
+    rng = np.random.default_rng(0)
+    samples = rng.uniform(-180, 180, (n, 8))
+    samples[:, :3] *= 100
+    samples = list(samples) # rows as received
+    referential = FreedReferential()
+    position = np.zeros(3)
+
+    def legacy(data):
+        position[0] = data[0]/1000
+        position[1] = data[1]/1000
+        position[2] = data[2]/1000
+        quat = ZYX_to_quat(-data[3], data[4]-90, data[5])
+        return mathutils.Quaternion(np.array([quat[3],quat[0],quat[1],quat[2]]))
+
+    start = time.perf_counter()
+    for data in samples:
+        legacy(data)
+    before = (time.perf_counter() - start)/n
+
+    start = time.perf_counter()
+    for data in samples:
+        referential.setPose(data)
+    after = (time.perf_counter() - start)/n
+
+    difference = 0.0
+    for data in samples[:1000]:
+        referential.setPose(data)
+        reference = legacy(data)
+        difference = max(difference, max(abs(a - b) for a, b in zip(referential.rotation_world, reference)))
+
+    print("pose conversion: {:.2f} us per sample before, {:.2f} us now, largest quaternion difference {:.1e}".format(
+          before*1e6, after*1e6, difference))
+    return before, after, difference
 
 
 
@@ -136,59 +588,216 @@ class ModalOperator(bpy.types.Operator):
 
     def initialize(self, context):
         print("Start")
+        LIVE_STATS.clear()
+        LIVE_ARBITERS.clear()
+        LIVE_RECEIVERS.clear()
 
         self.n_trackers = 0
         self.tracker_frames = []
         self.receivers = []
-
-        self.tracker_ips = []   # add trackers ip here
-        self.tracker_ports = [] # add trackers ports here
-        self.tracker_objects = [] # add scene objects corresponding to trackers
-        self.cam = None # add scene objects corresponding to trackers
-
-
-        if type(context.scene.freed_receiver_0["posetarget"]) == bpy.types.Object:
-            self.tracker_ips.append(context.scene.freed_receiver_0.ip)
-            self.tracker_ports.append(int(context.scene.freed_receiver_0.port))
-            self.tracker_objects.append(context.scene.freed_receiver_0.posetarget)
-            self.cam = context.scene.freed_receiver_0.lenstarget
-
-        if type(context.scene.freed_receiver_1["posetarget"]) == bpy.types.Object:
-            self.tracker_ips.append(context.scene.freed_receiver_1.ip)
-            self.tracker_ports.append(int(context.scene.freed_receiver_1.port))
-            self.tracker_objects.append(context.scene.freed_receiver_1.posetarget)
-
-        if type(context.scene.freed_receiver_2["posetarget"]) == bpy.types.Object:
-            self.tracker_ips.append(context.scene.freed_receiver_2.ip)
-            self.tracker_ports.append(int(context.scene.freed_receiver_2.port))
-            self.tracker_objects.append(context.scene.freed_receiver_2.posetarget)
-
-        if type(context.scene.freed_receiver_3["posetarget"]) == bpy.types.Object:
-            self.tracker_ips.append(context.scene.freed_receiver_3.ip)
-            self.tracker_ports.append(int(context.scene.freed_receiver_3.port))
-            self.tracker_objects.append(context.scene.freed_receiver_3.posetarget)
-
-
-        self.n_trackers = len(self.tracker_ips)
+        self.hub = FreedHub() # serves all receivers from a single thread
+        self.ingest = None # out of process receivers, publishing to shared memory rings
+        self.ring_counts = []
+        self.ingest_mode = context.scene.virtual_prod_props.ingest_mode
+        self.failure = None # reason the receivers stopped on their own
+        self.recorder = None # raw capture of every datagram
+        self.capture_path = ""
+        if context.scene.virtual_prod_props.capture_enabled:
+            self.capture_path = bpy.path.abspath(context.scene.virtual_prod_props.capture_path)
+            if self.capture_path == "" or os.path.isdir(self.capture_path):
+                print("invalid capture file path, not recording raw FreeD")
+                self.capture_path = ""
+            elif self.ingest_mode != 'PROCESS':
+                self.recorder = FreedCaptureWriter(self.capture_path)
+
+        receivers = tracked_receivers(context.scene)
+        self.trackers = tracker_sources(receivers) # FreedReceiverProperties of the sources of each tracker
+        self.tracker_deliveries = [sources[0].delivery for sources in self.trackers]
+        self.sockets = receiver_sockets(receivers) # (ip, port): socket index, trackers on a same port share a socket
+        self.arbiters = [] # FreedArbiter of each tracker, None for a single source
+
+        self.n_trackers = len(self.trackers)
         if self.n_trackers == 0:
             print("no objects targeted, running in the darkness of the void")
 
-        for i in range(self.n_trackers):
-            tracked_object = self.tracker_objects[i]
-            if tracked_object is not None:
-                # remove all animation data
-                if tracked_object.animation_data: #Check for presence of animation data.
-                    tracked_object.animation_data.action = None
-
-                # link object to freed receiver
-                self.tracker_frames.append(FreedReferential(tracked_object,
-                                                            is_camera = i==0,
-                                                            camera = self.cam
-                                                            ))
-
-                # freed input
-                self.receivers.append(FreedReceiver(self.tracker_ips[i], self.tracker_ports[i], self.tracker_frames[i].updateCallback))
-                self.receivers[i].start()
+        self.relay = None # re-broadcast of the filtered samples of all trackers
+        if context.scene.virtual_prod_props.relay_enabled:
+            self.relay = FreedRelay(context.scene.virtual_prod_props.relay_group, int(context.scene.virtual_prod_props.relay_port),
+                                    context.scene.virtual_prod_props.relay_ttl, context.scene.virtual_prod_props.multicast_interface)
+            try:
+                self.relay.open()
+            except OSError as e:
+                print("could not open the relay to {}: {}".format(context.scene.virtual_prod_props.relay_group, e))
+                self.relay = None
+
+        for i, sources in enumerate(self.trackers):
+            props = sources[0]
+            tracked_object = props.posetarget
+            # remove all animation data
+            if tracked_object.animation_data: #Check for presence of animation data.
+                tracked_object.animation_data.action = None
+
+            # link object to freed receiver
+            self.tracker_frames.append(FreedReferential(tracked_object,
+                                                        is_camera = props.lenstarget is not None,
+                                                        camera = props.lenstarget
+                                                        ))
+            if context.scene.virtual_prod_props.window_enabled:
+                spill_path = bpy.path.abspath(context.scene.virtual_prod_props.window_spill_path)
+                self.tracker_frames[-1].window = KeyframeWindow(context.scene.virtual_prod_props.window_seconds,
+                                                                "{}.{}".format(spill_path, i) if spill_path else None)
+            self.tracker_frames[-1].jitter = scene_jitter_filter(context.scene)
+            if self.relay is not None:
+                # consumers tell the relayed trackers apart by camera id
+                self.tracker_frames[-1].relay = self.relay
+                self.tracker_frames[-1].relay_camera_id = props.camera_id if props.camera_id >= 0 else (i + 1) % 256
+            if props.prediction != 'NONE':
+                self.tracker_frames[-1].predictor = PosePredictor(props.prediction)
+                self.tracker_frames[-1].prediction_horizon = props.prediction_horizon/1000
+            if context.scene.virtual_prod_props.resample_enabled:
+                fps = context.scene.render.fps/context.scene.render.fps_base
+                self.tracker_frames[-1].resampler = FrameResampler(fps, context.scene.virtual_prod_props.resample_subframes,
+                                                                   self.tracker_frames[-1].current_frame)
+            if context.scene.virtual_prod_props.decimation_enabled:
+                self.tracker_frames[-1].decimator = KeyframeDecimator(context.scene.virtual_prod_props.decimation_position,
+                                                                      context.scene.virtual_prod_props.decimation_angle,
+                                                                      context.scene.virtual_prod_props.decimation_encoder)
+
+            # freed input, received by the ingest daemon and polled from the rings
+            if self.ingest_mode == 'PROCESS':
+                continue
+
+            # redundant sources, the earliest copy of each sample is queued
+            arbiter = None
+            if len(sources) > 1:
+                arbiter = FreedArbiter(self.tracker_frames[-1].queueCallback, len(sources), delivery = props.delivery)
+                LIVE_ARBITERS.append((tracked_object.name, arbiter))
+            self.arbiters.append(arbiter)
+
+            # freed input, queued by the receiver thread and applied on the main thread by applySamples
+            for k, source in enumerate(sources):
+                ip, port = source.ip, int(source.port)
+                socket_id = self.sockets[(ip, port)]
+                if socket_id == len(self.receivers):
+                    self.receivers.append(FreedDemuxReceiver(ip, port,
+                                                             rcvbuf = context.scene.virtual_prod_props.rcvbuf_kb*1024,
+                                                             kernel_timestamps = context.scene.virtual_prod_props.kernel_timestamps,
+                                                             interface = context.scene.virtual_prod_props.multicast_interface
+                                                             ))
+                    self.receivers[-1].recorder = self.recorder
+                    self.receivers[-1].receiver_id = socket_id
+                    self.hub.add(self.receivers[-1])
+                    LIVE_RECEIVERS[socket_id] = self.receivers[-1]
+                if arbiter is None:
+                    route = self.receivers[socket_id].route(source.source, source.camera_id, self.tracker_frames[-1].queueCallback,
+                                                            delivery = source.delivery)
+                else: # every sample goes through the arbiter, which applies the delivery of the tracker
+                    route = self.receivers[socket_id].route(source.source, source.camera_id, arbiter.source(k))
+                LIVE_STATS.append(("{} {}:{} {}".format(tracked_object.name, ip, port, route.label()), route.stats))
+
+        if self.ingest_mode == 'PROCESS':
+            trackers = [[(props.ip, int(props.port), props.source, props.camera_id) for props in sources]
+                        for sources in self.trackers]
+            self.ingest = FreedIngestProcess(trackers, rcvbuf = context.scene.virtual_prod_props.rcvbuf_kb*1024,
+                                             kernel_timestamps = context.scene.virtual_prod_props.kernel_timestamps,
+                                             capture = self.capture_path,
+                                             interface = context.scene.virtual_prod_props.multicast_interface)
+            self.ingest.start()
+            self.ring_counts = [0] * len(trackers)
+            for sources, ring in zip(self.trackers, self.ingest.rings):
+                LIVE_STATS.append(("{} {}".format(sources[0].posetarget.name,
+                                                  ", ".join("{}:{}".format(props.ip, props.port) for props in sources)), ring.stats))
+        else:
+            self.hub.start()
+
+        if LIVE_STATS and not bpy.app.timers.is_registered(refresh_stats_ui):
+            bpy.app.timers.register(refresh_stats_ui, first_interval=STATS_REFRESH_INTERVAL)
+
+        self.journal = None # take journal of the armed recording
+        self.journal_dir = ""
+        if context.scene.virtual_prod_props.journal_enabled:
+            self.journal_dir = bpy.path.abspath(context.scene.virtual_prod_props.journal_dir)
+        self.fps = context.scene.render.fps/context.scene.render.fps_base
+
+        self.update_interval = 1/context.scene.virtual_prod_props.update_rate
+        self.update_job = self.applySamples # kept to unregister the same function object
+        bpy.app.timers.register(self.update_job, first_interval=self.update_interval)
+
+
+    @traced("scene.update")
+    def applySamples(self):
+        """
+            bpy.app.timers job, applies the samples received since the last call to the scene, on the main thread.
+            recording can be armed or disarmed at any time, from the next call
+        """
+        self.poll_rings()
+        record = bpy.context.scene.virtual_prod_props.record
+        if record and self.journal is None and self.journal_dir:
+            self.openJournal()
+        elif not record and self.journal is not None:
+            self.closeJournal()
+        applied = 0
+        for frame in self.tracker_frames:
+            applied += frame.applyPending(record)
+        if applied > 0:
+            tag_view3d_redraw()
+        return self.update_interval
+
+
+    def openJournal(self):
+        """
+            start the take journal of a new armed recording, named after its start time (and numbered when
+            several start within the same second)
+        """
+        name = os.path.join(self.journal_dir, time.strftime("take_%Y%m%d_%H%M%S"))
+        path = name + ".bvptake"
+        trackers = [(frame.linked_object.name, frame.camera.name if frame.is_camera and frame.camera is not None else "")
+                    for frame in self.tracker_frames]
+        try:
+            os.makedirs(self.journal_dir, exist_ok=True)
+            index = 1
+            while self.journal is None:
+                try:
+                    self.journal = FreedJournalWriter(path, trackers, self.fps)
+                except FileExistsError: # armed again within the same second
+                    index += 1
+                    path = "{}_{}.bvptake".format(name, index)
+        except OSError as e:
+            print("could not create take journal {}: {}".format(path, e))
+            self.journal_dir = "" # do not retry at each update
+            return
+        for i, frame in enumerate(self.tracker_frames):
+            frame.journal = self.journal
+            frame.journal_tracker = i
+        bpy.context.scene.virtual_prod_props.take_path = path
+        print("recording take journal", path)
+
+
+    def closeJournal(self):
+        for frame in self.tracker_frames:
+            frame.journal = None
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+
+    def poll_rings(self):
+        """
+            queue the samples published by the ingest daemon since the last poll
+        """
+        if self.ingest is None:
+            return
+        if not self.ingest.check() and self.ingest.failure is not None and self.failure is None:
+            # reported and stopped by modal()
+            self.failure = self.ingest.failure
+            bpy.context.scene.virtual_prod_props.is_running = False
+        for i, ring in enumerate(self.ingest.rings):
+            rows, self.ring_counts[i] = ring.read(self.ring_counts[i])
+            if rows.shape[0] == 0:
+                continue
+            if self.tracker_deliveries[i] == 'LATEST':
+                rows = rows[-1:]
+            self.tracker_frames[i].pending.append(rows)
 
 
     def __del__(self):
@@ -197,13 +806,35 @@ class ModalOperator(bpy.types.Operator):
 
     def stop(self):
         try:
-            for i in range(self.n_trackers):
-                try:
-                    self.receivers[i].stop()
-                except:
-                    print("could not close receiver for tracker on port", self.tracker_ports[i])
+            self.hub.stop()
         except:
-            pass
+            print("could not close freed receivers")
+
+        LIVE_STATS.clear()
+        LIVE_ARBITERS.clear()
+        LIVE_RECEIVERS.clear()
+        for frame in getattr(self, 'tracker_frames', []):
+            try:
+                frame.finishTake()
+            except ReferenceError: # objects removed while receiving
+                pass
+            if frame.window is not None:
+                frame.window.close()
+        if getattr(self, 'journal', None) is not None:
+            self.closeJournal()
+        if getattr(self, 'relay', None) is not None:
+            self.relay.close()
+            self.relay = None
+        if getattr(self, 'recorder', None) is not None:
+            self.recorder.close()
+            self.recorder = None
+        if getattr(self, 'ingest', None) is not None:
+            self.ingest.stop()
+            self.ingest = None
+        if getattr(self, 'update_job', None) is not None:
+            if bpy.app.timers.is_registered(self.update_job):
+                bpy.app.timers.unregister(self.update_job)
+            self.update_job = None
 
         print("End")
 
@@ -217,10 +848,18 @@ class ModalOperator(bpy.types.Operator):
 
     def modal(self, context, event): # executed in the event loop, as long as 'RUNNING_MODAL' or 'PASS_THROUGH' has been issued
         if event.type == 'ESC' or not context.scene.virtual_prod_props.is_running: # press escape to end
+            if self.failure is not None:
+                self.report({'ERROR'}, self.failure)
             self.stop()
             context.scene.virtual_prod_props.is_running = False
             return {'FINISHED'}
 
+        if self.recorder is not None and self.recorder.failure is not None:
+            # the capture stopped on its own, receiving goes on
+            self.report({'WARNING'}, self.recorder.failure)
+            self.recorder.close()
+            self.recorder = None
+
         return {'PASS_THROUGH'}
 
 
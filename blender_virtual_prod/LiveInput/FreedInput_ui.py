@@ -6,6 +6,16 @@ from bpy.props import (StringProperty, BoolProperty, IntProperty, FloatProperty,
                        FloatVectorProperty, EnumProperty, PointerProperty, CollectionProperty)
 
 from bpy.types import Panel, Menu, Operator, PropertyGroup
+from bpy.app.handlers import persistent
+
+from threading import Thread
+
+from . import FreedInput
+from .FreedReplay import FreedReplay, print_report
+from .FreedSender import FreedSender, print_report as print_send_report
+from .Freed import (STATS_PACKETS, STATS_MALFORMED, STATS_CHECKSUM, STATS_GAPS,
+                    STATS_JITTER, STATS_JITTER_BINS)
+from .FreedArbiter import ARBITER_PACKETS, ARBITER_FIRST, ARBITER_DELAY, ARBITER_DELAY_MAX
 
 
 # all classes defined in this file
@@ -20,19 +30,33 @@ CLASSES = []
 class FreedReceiverProperties(PropertyGroup):
     ip: StringProperty(
         name = "IP",
-        description="receiver ip",
+        description="receiver ip, or a multicast group (224.0.0.0 to 239.255.255.255) to join",
         default = "0.0.0.0",
         )
 
     port: StringProperty(
         name = "Port",
-        description="receiver port",
+        description="receiver port, trackers on the same ip and port share one socket",
         default = "5000",
         )
 
+    source: StringProperty(
+        name = "Source",
+        description="only receive the packets sent from this ip, any if empty",
+        default = "",
+        )
+
+    camera_id: IntProperty(
+        name = "Camera ID",
+        description="only receive the packets of this FreeD camera id, any if -1",
+        default = -1,
+        min = -1,
+        max = 255
+        )
+
     posetarget: PointerProperty(
         name = "Pose Target",
-        description = "object linked to the freed receiver for pose",
+        description = "object linked to the freed receiver for pose. receivers with the same target are redundant sources of one tracker, the earliest copy of each sample is used and the tracker settings are taken from the first one",
         type = bpy.types.Object
         )
         
@@ -42,6 +66,31 @@ class FreedReceiverProperties(PropertyGroup):
         type = bpy.types.Object
         )
 
+    delivery: EnumProperty(
+        name = "Delivery",
+        description = "what is processed when several packets are pending at once",
+        items = [('ALL', "All Samples", "process every pending packet, nothing is dropped"),
+                 ('LATEST', "Latest Sample", "only process the newest pending packet, drop the stale backlog")],
+        default = 'ALL'
+        )
+
+    prediction: EnumProperty(
+        name = "Prediction",
+        description = "extrapolate the shown pose and lens values ahead of the last sample, to compensate latency. Keys are not affected",
+        items = [('NONE', "None", "show the last received sample"),
+                 ('VELOCITY', "Constant Velocity", "line fit through the recent samples"),
+                 ('KALMAN', "Kalman", "constant velocity Kalman filter, smoother on noisy trackers")],
+        default = 'NONE'
+        )
+
+    prediction_horizon: FloatProperty(
+        name = "Horizon (ms)",
+        description = "how far ahead of the time of arrival in Blender the pose is predicted",
+        default = 50,
+        min = 0,
+        max = 500
+        )
+
 CLASSES.append(FreedReceiverProperties)
 
 
@@ -54,6 +103,304 @@ class SceneProperties(PropertyGroup):
         default = False
         )
 
+    record: BoolProperty(
+        name="Record",
+        description="keyframe every received sample. When off (preview), only the newest pose and lens values are shown, "
+                    "can be switched while receiving",
+        default = True
+        )
+
+    journal_enabled: BoolProperty(
+        name="Take Journal",
+        description="stream the keyed samples of each armed recording to a journal file on disk, "
+                    "so that a take survives a crash and can be imported back",
+        default = False
+        )
+
+    journal_dir: StringProperty(
+        name = "Journal Folder",
+        description="folder of the take journals, one file per armed recording named after its start time",
+        default = "//takes/",
+        subtype='DIR_PATH'
+        )
+
+    take_path: StringProperty(
+        name = "Take Journal",
+        description="take journal to import, the last recorded one by default",
+        default = "",
+        subtype='FILE_PATH'
+        )
+
+    take_replace: BoolProperty(
+        name="Replace Animation",
+        description="remove the animation of the take objects before importing, otherwise the keys are added to it",
+        default = True
+        )
+
+    take_filter: BoolProperty(
+        name="Filter Jitter",
+        description="smooth the imported samples with the jitter filter of the live input settings, "
+                    "for takes recorded unfiltered (live takes are recorded after the filter)",
+        default = False
+        )
+
+    window_enabled: BoolProperty(
+        name="Rolling Window",
+        description="only keep the keys of the last seconds on the live objects, older keys are removed",
+        default = False
+        )
+
+    window_seconds: FloatProperty(
+        name="Window (s)",
+        description="duration of the kept keys",
+        default = 60,
+        min = 1
+        )
+
+    window_spill_path: StringProperty(
+        name = "Spill File",
+        description="append the samples removed from the window to this file (one per tracker, suffixed with its index), "
+                    "nothing is kept if empty",
+        default = "",
+        subtype='FILE_PATH'
+        )
+
+    filter_model: EnumProperty(
+        name="Jitter Filter",
+        description="smoothing of the received samples, applied before anything else",
+        items = [('NONE', "None", "use the raw samples"),
+                 ('ONE_EURO', "One Euro", "smooths more at rest than when moving, set by the minimum cutoff and speed coefficients"),
+                 ('KALMAN', "Kalman", "constant velocity Kalman filter")],
+        default = 'NONE'
+        )
+
+    filter_min_cutoff: FloatProperty(
+        name="Min Cutoff (Hz)",
+        description="one euro cutoff frequency at rest, lower is smoother",
+        default = 5.0,
+        min = 0.01
+        )
+
+    filter_beta_position: FloatProperty(
+        name="Position Speed Coefficient",
+        description="one euro cutoff increase per mm/s, higher lags less when moving",
+        default = 0.05,
+        min = 0
+        )
+
+    filter_beta_angle: FloatProperty(
+        name="Angle Speed Coefficient",
+        description="one euro cutoff increase per degree/s, higher lags less when moving",
+        default = 1.0,
+        min = 0
+        )
+
+    filter_beta_encoder: FloatProperty(
+        name="Encoder Speed Coefficient",
+        description="one euro cutoff increase per encoder step/s, higher lags less when moving",
+        default = 0.01,
+        min = 0
+        )
+
+    resample_enabled: BoolProperty(
+        name="Resample to Scene Frames",
+        description="key the samples interpolated on the scene frame rate from their arrival times, "
+                    "instead of one frame per received sample",
+        default = False
+        )
+
+    resample_subframes: IntProperty(
+        name="Subframes",
+        description="keys per scene frame",
+        default = 1,
+        min = 1,
+        max = 16
+        )
+
+    decimation_enabled: BoolProperty(
+        name="Decimate Keys",
+        description="only key a channel group when it moved past its tolerance since its last key",
+        default = False
+        )
+
+    decimation_position: FloatProperty(
+        name="Position Tolerance (mm)",
+        default = 0.5,
+        min = 0
+        )
+
+    decimation_angle: FloatProperty(
+        name="Angle Tolerance (deg)",
+        default = 0.01,
+        min = 0
+        )
+
+    decimation_encoder: IntProperty(
+        name="Encoder Tolerance",
+        description="zoom and focus tolerance, in encoder steps",
+        default = 2,
+        min = 0
+        )
+
+    rcvbuf_kb: IntProperty(
+        name="Receive Buffer (KB)",
+        description="socket receive buffer size of the freed receivers, to absorb bursts. 0 keeps the system default",
+        default = 1024,
+        min = 0
+        )
+
+    kernel_timestamps: BoolProperty(
+        name="Kernel Timestamps",
+        description="timestamp packets with the time the network stack received them instead of the time they are read (Linux only)",
+        default = False
+        )
+
+    capture_enabled: BoolProperty(
+        name="Record Raw Capture",
+        description="record every received FreeD datagram with its arrival time in a capture file",
+        default = False
+        )
+
+    capture_path: StringProperty(
+        name = "Capture File",
+        description="raw FreeD capture file, overwritten at each start",
+        default = "//freed_capture.bvpcap",
+        subtype='FILE_PATH'
+        )
+
+    replay_path: StringProperty(
+        name = "Replay Capture",
+        description="raw FreeD capture file to replay through the running receivers",
+        default = "",
+        subtype='FILE_PATH'
+        )
+
+    replay_mode: EnumProperty(
+        name="Replay",
+        description="how captured packets are fed to the receivers",
+        items = [('UDP', "Loopback UDP", "send the packets to the receivers ports"),
+                 ('INJECT', "Direct Injection", "give the packets to the receivers running in Blender, without sockets")],
+        default = 'UDP'
+        )
+
+    replay_speed: FloatProperty(
+        name="Replay Speed",
+        description="1 plays in real time, N is N times faster, 0 as fast as possible",
+        default = 1,
+        min = 0
+        )
+
+    send_ip: StringProperty(
+        name = "Target IP",
+        description="where the FreeD output is sent, a broadcast address reaches every render node",
+        default = "127.0.0.1",
+        )
+
+    send_port: StringProperty(
+        name = "Target Port",
+        description="port of the FreeD output",
+        default = "6000",
+        )
+
+    send_camera_id: IntProperty(
+        name = "Camera ID",
+        description="FreeD camera id of the output packets",
+        default = 1,
+        min = 0,
+        max = 255
+        )
+
+    send_pose_target: PointerProperty(
+        name = "Pose Source",
+        description = "object whose world pose is sent",
+        type = bpy.types.Object
+        )
+
+    send_lens_target: PointerProperty(
+        name = "Lens Source",
+        description = "camera whose zoom and focus encoders (keyed by the receivers) are sent, 0 if not set",
+        type = bpy.types.Object
+        )
+
+    send_mode: EnumProperty(
+        name="Output",
+        description="what is sent",
+        items = [('LIVE', "Live Pose", "send the current pose at the send rate, follows the viewport and the timeline"),
+                 ('RANGE', "Animation Range", "pre-render the scene frame range and send it in real time at the scene fps")],
+        default = 'LIVE'
+        )
+
+    send_rate: FloatProperty(
+        name="Send Rate (Hz)",
+        description="packets per second of the live output",
+        default = 60,
+        min = 1,
+        max = 1000
+        )
+
+    send_subframes: IntProperty(
+        name="Subframes",
+        description="samples sent per frame of the animation range, the packet rate is the scene fps times this",
+        default = 1,
+        min = 1,
+        max = 64
+        )
+
+    send_loop: BoolProperty(
+        name="Loop",
+        description="send the animation range again from its start until stopped",
+        default = False
+        )
+
+    multicast_interface: StringProperty(
+        name = "Multicast Interface",
+        description="ip of the network interface joining the multicast groups and sending the relay, any if 0.0.0.0",
+        default = "0.0.0.0",
+        )
+
+    relay_enabled: BoolProperty(
+        name="Relay",
+        description="re-broadcast the filtered samples of every tracker to a multicast group, "
+                    "with the tracker camera id (or its position in the list if any), for other machines to join",
+        default = False
+        )
+
+    relay_group: StringProperty(
+        name = "Relay Group",
+        description="multicast group the samples are relayed to",
+        default = "239.255.0.1",
+        )
+
+    relay_port: StringProperty(
+        name = "Relay Port",
+        description="port the samples are relayed to",
+        default = "6001",
+        )
+
+    relay_ttl: IntProperty(
+        name="Relay TTL",
+        description="number of routers the relayed packets may cross, 1 keeps them on the local network",
+        default = 1,
+        min = 1,
+        max = 255
+        )
+
+    ingest_mode: EnumProperty(
+        name="Ingest",
+        description="where FreeD packets are received and decoded",
+        items = [('THREAD', "In Blender", "receive on a thread of the Blender process"),
+                 ('PROCESS', "Ingest Process", "receive in a separate process publishing to shared memory, away from Blender's GIL")],
+        default = 'THREAD'
+        )
+
+    update_rate: FloatProperty(
+        name="Update Rate (Hz)",
+        description="rate at which the received samples are applied to the scene, on the main thread",
+        default = 60,
+        min = 1,
+        max = 1000
+        )
+
 CLASSES.append(SceneProperties)
 
 
@@ -72,6 +419,7 @@ class StartOp(Operator):
         freed = scene.virtual_prod_props
 
         print("starting freed receiving...")
+        migrate_legacy_receivers(scene)
 
         while not freed.is_running:
             bpy.ops.julouj_virtual_prod.freed_input_modal_operator('INVOKE_DEFAULT')
@@ -97,6 +445,167 @@ class StopOp(Operator):
 CLASSES.append(StopOp)
 
 
+# replay in progress, a single one at a time
+REPLAY = None
+
+
+class ReplayOp(Operator):
+    bl_label = "Replay Capture Operator"
+    bl_idname = "julouj_virtual_prod.freed_input_replay_op"
+    bl_description = "Replay a raw FreeD capture through the running receivers and report throughput and latency in the console"
+
+    def execute(self, context):
+        global REPLAY
+        scene = context.scene
+        freed = scene.virtual_prod_props
+
+        if REPLAY is not None and REPLAY.isRunning:
+            print("stopping replay...")
+            REPLAY.stop()
+            return {'FINISHED'}
+
+        path = bpy.path.abspath(freed.replay_path)
+        try:
+            REPLAY = FreedReplay.fromFile(path, freed.replay_speed)
+        except (OSError, ValueError) as e:
+            print("could not read capture", path, e)
+            return {'CANCELLED'}
+
+        # capture receiver ids are the socket indices, trackers on a same port share a socket
+        receivers = dict(FreedInput.LIVE_RECEIVERS)
+        if freed.replay_mode == 'INJECT':
+            if not receivers:
+                print("direct injection needs receivers running in Blender")
+                return {'CANCELLED'}
+            replay = lambda: print_report(REPLAY.toReceivers(receivers))
+        else:
+            targets = {}
+            for (ip, port), socket_id in FreedInput.receiver_sockets(FreedInput.tracked_receivers(scene)).items():
+                targets[socket_id] = ("127.0.0.1" if ip == "0.0.0.0" else ip, port)
+            replay = lambda: print_report(REPLAY.toUdp(targets, receivers))
+
+        print("replaying {}...".format(path))
+        Thread(target=replay).start()
+
+        return {'FINISHED'}
+CLASSES.append(ReplayOp)
+
+
+class ImportTakeOp(Operator):
+    bl_label = "Import Take Operator"
+    bl_idname = "julouj_virtual_prod.freed_input_import_take_op"
+    bl_description = "Key the samples of a take journal on the objects they were recorded on"
+
+    def execute(self, context):
+        freed = context.scene.virtual_prod_props
+
+        path = bpy.path.abspath(freed.take_path)
+        try:
+            new_filter = (lambda: FreedInput.scene_jitter_filter(context.scene)) if freed.take_filter else None
+            imported = FreedInput.import_take(path, freed.take_replace, new_filter)
+        except (OSError, ValueError) as e:
+            print("could not read take journal", path, e)
+            return {'CANCELLED'}
+        print("imported {} samples from {}".format(imported, path))
+
+        return {'FINISHED'}
+CLASSES.append(ImportTakeOp)
+
+
+# FreeD output in progress, a single one at a time
+SENDER = None
+
+
+def send_live_pose():
+    """
+        bpy.app.timers job of the live output, sends the current pose until the sender is closed
+    """
+    if SENDER is None or SENDER.sock is None:
+        return None
+    props = bpy.context.scene.virtual_prod_props
+    if props.send_pose_target is None:
+        SENDER.close()
+        return None
+    SENDER.send(FreedInput.current_sample(props.send_pose_target, props.send_lens_target))
+    return 1/props.send_rate
+
+
+def report_output(sender, thread):
+    thread.join()
+    print_send_report(sender.report)
+
+
+class SendOp(Operator):
+    bl_label = "Send FreeD Operator"
+    bl_idname = "julouj_virtual_prod.freed_input_send_op"
+    bl_description = "Stream the pose and lens encoders of an object out as FreeD, or stop streaming"
+
+    def execute(self, context):
+        global SENDER
+        scene = context.scene
+        freed = scene.virtual_prod_props
+
+        if SENDER is not None and (SENDER.isRunning or SENDER.sock is not None):
+            print("stopping freed output...")
+            SENDER.stop()
+            return {'FINISHED'}
+
+        if freed.send_pose_target is None:
+            print("no pose source to send")
+            return {'CANCELLED'}
+
+        SENDER = FreedSender([(freed.send_ip, int(freed.send_port))], freed.send_camera_id)
+        if freed.send_mode == 'RANGE':
+            samples = FreedInput.sample_range(scene, freed.send_pose_target, freed.send_lens_target,
+                                              scene.frame_start, scene.frame_end, freed.send_subframes)
+            rate = scene.render.fps/scene.render.fps_base*freed.send_subframes
+            print("sending {} packets at {:g} packets/s to {}:{}".format(len(samples), rate, freed.send_ip, freed.send_port))
+            SENDER.start(SENDER.packetTable(samples), rate, freed.send_loop)
+            Thread(target=report_output, args=(SENDER, SENDER.thread)).start()
+        else:
+            SENDER.open()
+            bpy.app.timers.register(send_live_pose)
+
+        return {'FINISHED'}
+CLASSES.append(SendOp)
+
+
+class AddReceiverOp(Operator):
+    bl_label = "Add Receiver Operator"
+    bl_idname = "julouj_virtual_prod.freed_input_add_receiver_op"
+    bl_description = "Add a tracker, on the port of the selected one"
+
+    def execute(self, context):
+        scene = context.scene
+        receivers = scene.freed_receivers
+
+        receiver = receivers.add()
+        if len(receivers) > 1:
+            active = receivers[min(scene.freed_receivers_index, len(receivers) - 2)]
+            receiver.ip = active.ip
+            receiver.port = active.port
+        scene.freed_receivers_index = len(receivers) - 1
+
+        return {'FINISHED'}
+CLASSES.append(AddReceiverOp)
+
+
+class RemoveReceiverOp(Operator):
+    bl_label = "Remove Receiver Operator"
+    bl_idname = "julouj_virtual_prod.freed_input_remove_receiver_op"
+    bl_description = "Remove the selected tracker"
+
+    def execute(self, context):
+        scene = context.scene
+
+        if 0 <= scene.freed_receivers_index < len(scene.freed_receivers):
+            scene.freed_receivers.remove(scene.freed_receivers_index)
+            scene.freed_receivers_index = max(0, min(scene.freed_receivers_index, len(scene.freed_receivers) - 1))
+
+        return {'FINISHED'}
+CLASSES.append(RemoveReceiverOp)
+
+
 
 
 # ========================================================== Menus
@@ -114,87 +623,201 @@ class BlenderFreedUi(bpy.types.Panel):
 
         layout.operator("julouj_virtual_prod.freed_input_start_op", text="Start")
         layout.operator("julouj_virtual_prod.freed_input_stop_op", text="Stop")
+        layout.prop(context.scene.virtual_prod_props, "record")
+        layout.prop(context.scene.virtual_prod_props, "journal_enabled")
+        if context.scene.virtual_prod_props.journal_enabled:
+            layout.prop(context.scene.virtual_prod_props, "journal_dir")
+        layout.prop(context.scene.virtual_prod_props, "window_enabled")
+        if context.scene.virtual_prod_props.window_enabled:
+            layout.prop(context.scene.virtual_prod_props, "window_seconds")
+            layout.prop(context.scene.virtual_prod_props, "window_spill_path")
+        layout.prop(context.scene.virtual_prod_props, "filter_model")
+        if context.scene.virtual_prod_props.filter_model == 'ONE_EURO':
+            layout.prop(context.scene.virtual_prod_props, "filter_min_cutoff")
+            layout.prop(context.scene.virtual_prod_props, "filter_beta_position")
+            layout.prop(context.scene.virtual_prod_props, "filter_beta_angle")
+            layout.prop(context.scene.virtual_prod_props, "filter_beta_encoder")
+        layout.prop(context.scene.virtual_prod_props, "resample_enabled")
+        if context.scene.virtual_prod_props.resample_enabled:
+            layout.prop(context.scene.virtual_prod_props, "resample_subframes")
+        layout.prop(context.scene.virtual_prod_props, "decimation_enabled")
+        if context.scene.virtual_prod_props.decimation_enabled:
+            layout.prop(context.scene.virtual_prod_props, "decimation_position")
+            layout.prop(context.scene.virtual_prod_props, "decimation_angle")
+            layout.prop(context.scene.virtual_prod_props, "decimation_encoder")
+        layout.prop(context.scene.virtual_prod_props, "rcvbuf_kb")
+        layout.prop(context.scene.virtual_prod_props, "kernel_timestamps")
+        layout.prop(context.scene.virtual_prod_props, "multicast_interface")
+        layout.prop(context.scene.virtual_prod_props, "relay_enabled")
+        if context.scene.virtual_prod_props.relay_enabled:
+            layout.prop(context.scene.virtual_prod_props, "relay_group")
+            layout.prop(context.scene.virtual_prod_props, "relay_port")
+            layout.prop(context.scene.virtual_prod_props, "relay_ttl")
+        layout.prop(context.scene.virtual_prod_props, "ingest_mode")
+        layout.prop(context.scene.virtual_prod_props, "update_rate")
+        layout.prop(context.scene.virtual_prod_props, "capture_enabled")
+        if context.scene.virtual_prod_props.capture_enabled:
+            layout.prop(context.scene.virtual_prod_props, "capture_path")
 CLASSES.append(BlenderFreedUi)
 
 
-
-
-
-
-
-
-class ReceiverListUi(bpy.types.Panel):
-    bl_label = "Tracking Receivers"
+class FreedReplayUi(bpy.types.Panel):
+    bl_label = "Replay"
     bl_parent_id = "julouj_virtual_prod.freed_input_ui"
-    bl_idname = "julouj_virtual_prod.freed_input_receiver_list_ui"
+    bl_idname = "julouj_virtual_prod.freed_input_replay_ui"
     bl_space_type = 'PROPERTIES'
     bl_region_type = 'WINDOW'
     bl_context = "scene"
+    bl_options = {'DEFAULT_CLOSED'}
 
     def draw(self, context):
         layout = self.layout
-CLASSES.append(ReceiverListUi)
+        props = context.scene.virtual_prod_props
 
+        layout.prop(props, "replay_path")
+        layout.prop(props, "replay_mode")
+        layout.prop(props, "replay_speed")
+        running = REPLAY is not None and REPLAY.isRunning
+        layout.operator("julouj_virtual_prod.freed_input_replay_op", text="Stop Replay" if running else "Replay")
+CLASSES.append(FreedReplayUi)
 
-class FreedReceiverUi_0(bpy.types.Panel):
-    bl_label = "Freed Receiver 0 (Camera)"
-    bl_parent_id = "julouj_virtual_prod.freed_input_receiver_list_ui"
-    bl_idname = "julouj_virtual_prod.freed_input_freed_receiver_ui"
+
+class FreedTakeUi(bpy.types.Panel):
+    bl_label = "Import Take"
+    bl_parent_id = "julouj_virtual_prod.freed_input_ui"
+    bl_idname = "julouj_virtual_prod.freed_input_take_ui"
     bl_space_type = 'PROPERTIES'
     bl_region_type = 'WINDOW'
     bl_context = "scene"
+    bl_options = {'DEFAULT_CLOSED'}
 
     def draw(self, context):
-        self.layout.prop(context.scene.freed_receiver_0, "ip")
-        self.layout.prop(context.scene.freed_receiver_0, "port")
-        self.layout.prop(context.scene.freed_receiver_0, "posetarget", text="Pose Target")
-        self.layout.prop(context.scene.freed_receiver_0, "lenstarget", text="Lens Target")
-CLASSES.append(FreedReceiverUi_0)
+        layout = self.layout
+        props = context.scene.virtual_prod_props
 
+        layout.prop(props, "take_path")
+        layout.prop(props, "take_replace")
+        layout.prop(props, "take_filter")
+        layout.operator("julouj_virtual_prod.freed_input_import_take_op", text="Import Take")
+CLASSES.append(FreedTakeUi)
 
-class FreedReceiverUi_1(bpy.types.Panel):
-    bl_label = "Freed Receiver 1"
-    bl_parent_id = "julouj_virtual_prod.freed_input_receiver_list_ui"
-    bl_idname = "julouj_virtual_prod.freed_input_freed_receiver_ui_1"
+
+class FreedSendUi(bpy.types.Panel):
+    bl_label = "FreeD Output"
+    bl_parent_id = "julouj_virtual_prod.freed_input_ui"
+    bl_idname = "julouj_virtual_prod.freed_input_send_ui"
     bl_space_type = 'PROPERTIES'
     bl_region_type = 'WINDOW'
     bl_context = "scene"
+    bl_options = {'DEFAULT_CLOSED'}
 
     def draw(self, context):
-        self.layout.prop(context.scene.freed_receiver_1, "ip")
-        self.layout.prop(context.scene.freed_receiver_1, "port")
-        self.layout.prop(context.scene.freed_receiver_1, "posetarget")
-CLASSES.append(FreedReceiverUi_1)
-
-
-class FreedReceiverUi_2(bpy.types.Panel):
-    bl_label = "Freed Receiver 2"
-    bl_parent_id = "julouj_virtual_prod.freed_input_receiver_list_ui"
-    bl_idname = "julouj_virtual_prod.freed_input_freed_receiver_ui_2"
+        layout = self.layout
+        props = context.scene.virtual_prod_props
+
+        layout.prop(props, "send_ip")
+        layout.prop(props, "send_port")
+        layout.prop(props, "send_camera_id")
+        layout.prop(props, "send_pose_target")
+        layout.prop(props, "send_lens_target")
+        layout.prop(props, "send_mode")
+        if props.send_mode == 'LIVE':
+            layout.prop(props, "send_rate")
+        else:
+            layout.prop(props, "send_subframes")
+            layout.prop(props, "send_loop")
+        sending = SENDER is not None and (SENDER.isRunning or SENDER.sock is not None)
+        layout.operator("julouj_virtual_prod.freed_input_send_op", text="Stop Output" if sending else "Send")
+CLASSES.append(FreedSendUi)
+
+
+class FreedStatsUi(bpy.types.Panel):
+    bl_label = "Stream Statistics"
+    bl_parent_id = "julouj_virtual_prod.freed_input_ui"
+    bl_idname = "julouj_virtual_prod.freed_input_stats_ui"
     bl_space_type = 'PROPERTIES'
     bl_region_type = 'WINDOW'
     bl_context = "scene"
+    bl_options = {'DEFAULT_CLOSED'}
 
     def draw(self, context):
-        self.layout.prop(context.scene.freed_receiver_2, "ip")
-        self.layout.prop(context.scene.freed_receiver_2, "port")
-        self.layout.prop(context.scene.freed_receiver_2, "posetarget")
-CLASSES.append(FreedReceiverUi_2)
+        layout = self.layout
+
+        if not FreedInput.LIVE_STATS:
+            layout.label(text="receivers are not running")
+            return
+
+        bins = ["<{:g}".format(b*1000) for b in STATS_JITTER_BINS] + [">{:g}".format(STATS_JITTER_BINS[-1]*1000)]
+        for label, stats in FreedInput.LIVE_STATS:
+            c = stats.counters
+            box = layout.box()
+            box.label(text=label)
+            col = box.column(align=True)
+            col.label(text="{:.1f} packets/s, jitter {:.2f} ms".format(stats.rate(), c[STATS_JITTER]*1000))
+            col.label(text="packets {:.0f}, gaps {:.0f}".format(c[STATS_PACKETS], c[STATS_GAPS]))
+            col.label(text="malformed {:.0f}, checksum failures {:.0f}".format(c[STATS_MALFORMED], c[STATS_CHECKSUM]))
+            col.label(text="jitter (ms) " + "  ".join("{}: {:.0f}".format(b, n) for b, n in zip(bins, stats.histogram)))
 
+        for label, arbiter in FreedInput.LIVE_ARBITERS:
+            box = layout.box()
+            box.label(text="{} redundant sources, {} failovers".format(label, arbiter.failovers))
+            col = box.column(align=True)
+            for k, c in enumerate(arbiter.counters):
+                share = c[ARBITER_FIRST]/c[ARBITER_PACKETS]*100 if c[ARBITER_PACKETS] > 0 else 0.0
+                col.label(text="source {}: first {:.0f}%, {:.2f} ms behind (max {:.2f}){}".format(
+                          k, share, c[ARBITER_DELAY]*1000, c[ARBITER_DELAY_MAX]*1000, ", stalled" if arbiter.stalled[k] else ""),
+                          icon='CHECKMARK' if k == arbiter.active else 'BLANK1')
+CLASSES.append(FreedStatsUi)
 
-class FreedReceiverUi_3(bpy.types.Panel):
-    bl_label = "Freed Receiver 3"
-    bl_parent_id = "julouj_virtual_prod.freed_input_receiver_list_ui"
-    bl_idname = "julouj_virtual_prod.freed_input_freed_receiver_ui_3"
+
+
+
+
+
+
+
+class JULOUJ_UL_freed_receivers(bpy.types.UIList):
+
+    def draw_item(self, context, layout, data, item, icon, active_data, active_propname, index):
+        target = item.posetarget.name if item.posetarget is not None else "(no target)"
+        camera_id = "any" if item.camera_id < 0 else item.camera_id
+        layout.label(text="{}  {}:{}  camera {}".format(target, item.ip, item.port, camera_id),
+                     icon='CAMERA_DATA' if item.lenstarget is not None else 'OBJECT_DATA')
+CLASSES.append(JULOUJ_UL_freed_receivers)
+
+
+class ReceiverListUi(bpy.types.Panel):
+    bl_label = "Tracking Receivers"
+    bl_parent_id = "julouj_virtual_prod.freed_input_ui"
+    bl_idname = "julouj_virtual_prod.freed_input_receiver_list_ui"
     bl_space_type = 'PROPERTIES'
     bl_region_type = 'WINDOW'
     bl_context = "scene"
 
     def draw(self, context):
-        self.layout.prop(context.scene.freed_receiver_3, "ip")
-        self.layout.prop(context.scene.freed_receiver_3, "port")
-        self.layout.prop(context.scene.freed_receiver_3, "posetarget")
-CLASSES.append(FreedReceiverUi_3)
+        layout = self.layout
+        scene = context.scene
+
+        row = layout.row()
+        row.template_list("JULOUJ_UL_freed_receivers", "", scene, "freed_receivers", scene, "freed_receivers_index")
+        col = row.column(align=True)
+        col.operator("julouj_virtual_prod.freed_input_add_receiver_op", text="", icon='ADD')
+        col.operator("julouj_virtual_prod.freed_input_remove_receiver_op", text="", icon='REMOVE')
+
+        if not 0 <= scene.freed_receivers_index < len(scene.freed_receivers):
+            return
+        receiver = scene.freed_receivers[scene.freed_receivers_index]
+        layout.prop(receiver, "ip")
+        layout.prop(receiver, "port")
+        layout.prop(receiver, "source")
+        layout.prop(receiver, "camera_id")
+        layout.prop(receiver, "posetarget", text="Pose Target")
+        layout.prop(receiver, "lenstarget", text="Lens Target")
+        layout.prop(receiver, "delivery")
+        layout.prop(receiver, "prediction")
+        if receiver.prediction != 'NONE':
+            layout.prop(receiver, "prediction_horizon")
+CLASSES.append(ReceiverListUi)
 
 
 
@@ -222,6 +845,36 @@ CLASSES.append(LensFilesListUi)
 # ========================================================== Registration
 
 
+# fixed receiver slots of the first versions, kept registered to read the files saved with them
+LEGACY_RECEIVERS = ["freed_receiver_{}".format(k) for k in range(4)]
+
+
+def migrate_legacy_receivers(scene):
+    """
+        move the receivers set in the legacy fixed slots to the receivers list, once.
+        as before, only the first slot drives a lens
+    """
+    for k, name in enumerate(LEGACY_RECEIVERS):
+        legacy = getattr(scene, name, None)
+        if legacy is None or legacy.posetarget is None:
+            continue
+        receiver = scene.freed_receivers.add()
+        receiver.ip = legacy.ip
+        receiver.port = legacy.port
+        receiver.posetarget = legacy.posetarget
+        if k == 0:
+            receiver.lenstarget = legacy.lenstarget
+        print("moved {} ({}:{}) to the receivers list".format(name, legacy.ip, legacy.port))
+        legacy.posetarget = None
+        legacy.lenstarget = None
+
+
+@persistent
+def migrate_legacy_receivers_on_load(dummy):
+    for scene in bpy.data.scenes:
+        migrate_legacy_receivers(scene)
+
+
 def register():
     # register all new classes
     for new_class in CLASSES:
@@ -229,19 +882,27 @@ def register():
 
     # instantiate our custom properties in the "freed" scene property
     bpy.types.Scene.virtual_prod_props = PointerProperty(type=SceneProperties)
-    bpy.types.Scene.freed_receiver_0 = PointerProperty(type=FreedReceiverProperties)
-    bpy.types.Scene.freed_receiver_1 = PointerProperty(type=FreedReceiverProperties)
-    bpy.types.Scene.freed_receiver_2 = PointerProperty(type=FreedReceiverProperties)
-    bpy.types.Scene.freed_receiver_3 = PointerProperty(type=FreedReceiverProperties)
+    bpy.types.Scene.freed_receivers = CollectionProperty(type=FreedReceiverProperties)
+    bpy.types.Scene.freed_receivers_index = IntProperty()
+    for name in LEGACY_RECEIVERS:
+        setattr(bpy.types.Scene, name, PointerProperty(type=FreedReceiverProperties))
+    bpy.app.handlers.load_post.append(migrate_legacy_receivers_on_load)
 
 
 def unregister():
+    if migrate_legacy_receivers_on_load in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.remove(migrate_legacy_receivers_on_load)
+
     # remove all new classes
     for class_to_remove in reversed(CLASSES):
         bpy.utils.unregister_class(class_to_remove)
 
     # throw our custom properties into the darkness of memory freeing oblivion
     del bpy.types.Scene.virtual_prod_props
+    del bpy.types.Scene.freed_receivers
+    del bpy.types.Scene.freed_receivers_index
+    for name in LEGACY_RECEIVERS:
+        delattr(bpy.types.Scene, name)
 
 
 
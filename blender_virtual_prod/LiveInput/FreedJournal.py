@@ -0,0 +1,198 @@
+"""
+Copyright Miraxyz 2024
+
+Defines the take journal format, recording the decoded, frame aligned samples keyed by all trackers
+during a take, so that a take survives a crash of Blender and can be imported back as F-curves.
+
+File layout: a header padded to JOURNAL_ALIGN bytes, then blocks of JOURNAL_BLOCK_RECORDS records
+stored column by column (all the timestamps of the block, then all the frames, ...), so that each
+column of the whole take reads as one strided numpy array.
+The header holds the number of records written at the last sync and the index of the trackers
+(object and camera names). The file grows by one zeroed block at a time and only the block being
+filled is mapped, appending costs the same at any take length.
+Records are synced to disk every JOURNAL_SYNC_INTERVAL seconds. A crash of Blender loses nothing
+(the mapped pages are kept by the system), a crash of the system loses at most the records after
+the last sync. Records after the header count with a non zero timestamp are recovered when reading.
+"""
+
+import os
+import time
+import struct
+
+import numpy as np
+
+try:
+    from .Freed import FREED_TIMESTAMP, FREED_ROW_WIDTH
+except ImportError: # used as a standalone module, outside of Blender
+    from Freed import FREED_TIMESTAMP, FREED_ROW_WIDTH
+
+
+JOURNAL_MAGIC = b'BVPTAKE\0'
+JOURNAL_VERSION = 1
+JOURNAL_ALIGN = 4096
+JOURNAL_BLOCK_RECORDS = 4096
+JOURNAL_SYNC_INTERVAL = 1.0 # s
+JOURNAL_NAME_SIZE = 64
+
+# magic, version, header size, records per block, block size, record count, tracker count, fps
+JOURNAL_HEADER = struct.Struct('<8sIIIIQId')
+# object name, camera name (empty if the tracker drives no lens), utf-8 zero padded
+JOURNAL_TRACKER = struct.Struct('<{0}s{0}s'.format(JOURNAL_NAME_SIZE))
+
+JOURNAL_SAMPLE_COLUMNS = ('x', 'y', 'z', 'pan', 'tilt', 'roll', 'zoom', 'focus')
+JOURNAL_COLUMNS = [
+    ('timestamp', '<f8'), # arrival time, seconds on the time.monotonic clock, written last
+    ('frame', '<f8'),     # scene frame the sample is keyed on
+    ('tracker', '<u2'),   # index in the header tracker table
+] + [(name, '<f8') for name in JOURNAL_SAMPLE_COLUMNS]
+
+
+def block_dtype(block_records):
+    return np.dtype([(name, dtype, (block_records,)) for name, dtype in JOURNAL_COLUMNS])
+
+
+def header_size(n_trackers):
+    size = JOURNAL_HEADER.size + n_trackers*JOURNAL_TRACKER.size
+    return -(-size // JOURNAL_ALIGN) * JOURNAL_ALIGN
+
+
+
+class FreedJournalWriter:
+    """
+        Appends the keyed samples of a take. trackers is a list of (object name, camera name),
+        a tracker is referred to by its index. Used from the main thread only.
+        The journal is a new file, FileExistsError is raised rather than overwriting a previous take
+    """
+
+    def __init__(self, path, trackers, fps, block_records = JOURNAL_BLOCK_RECORDS, sync_interval = JOURNAL_SYNC_INTERVAL):
+        self.path = path
+        self.trackers = [(str(name), str(camera or "")) for name, camera in trackers]
+        self.fps = fps
+        self.block_records = block_records
+        self.dtype = block_dtype(block_records)
+        self.header_size = header_size(len(self.trackers))
+        self.sync_interval = sync_interval
+        self.count = 0
+        self.n_blocks = 0
+        self.fill = block_records # records in the mapped block, full until the first one is added
+        self.block = None
+        self.last_sync = time.monotonic()
+
+        self.file = open(path, "x+b")
+        self.file.write(self.header())
+        self.file.flush()
+
+    def header(self):
+        header = JOURNAL_HEADER.pack(JOURNAL_MAGIC, JOURNAL_VERSION, self.header_size, self.block_records,
+                                     self.dtype.itemsize, self.count, len(self.trackers), self.fps)
+        for name, camera in self.trackers:
+            header += JOURNAL_TRACKER.pack(name.encode()[:JOURNAL_NAME_SIZE], camera.encode()[:JOURNAL_NAME_SIZE])
+        return header.ljust(self.header_size, b'\0')
+
+    def grow(self):
+        """
+            extend the file by one zeroed block and map it in place of the filled one
+        """
+        if self.block is not None:
+            self.block.flush()
+        # a mapped file cannot be resized (Windows), the filled block and its column views are dropped first
+        self.block = None
+        self.columns = None
+        offset = self.header_size + self.n_blocks*self.dtype.itemsize
+        self.n_blocks += 1
+        self.file.truncate(offset + self.dtype.itemsize)
+        self.block = np.memmap(self.file, dtype=self.dtype, mode='r+', offset=offset, shape=(1,))
+        self.columns = {name: self.block[name][0] for name, _ in JOURNAL_COLUMNS}
+        self.fill = 0
+
+    def append(self, tracker, frames, samples):
+        """
+            record the (N, 8+) samples of a tracker keyed on the N frames
+        """
+        if self.file is None:
+            return
+        n = len(frames)
+        i = 0
+        while i < n:
+            if self.fill == self.block_records:
+                self.grow()
+            m = min(n - i, self.block_records - self.fill)
+            rows = slice(self.fill, self.fill + m)
+            self.columns['frame'][rows] = frames[i:i+m]
+            self.columns['tracker'][rows] = tracker
+            for c, name in enumerate(JOURNAL_SAMPLE_COLUMNS):
+                self.columns[name][rows] = samples[i:i+m, c]
+            if samples.shape[1] > FREED_TIMESTAMP:
+                self.columns['timestamp'][rows] = samples[i:i+m, FREED_TIMESTAMP]
+            else:
+                self.columns['timestamp'][rows] = time.monotonic()
+            self.fill += m
+            self.count += m
+            i += m
+
+        if time.monotonic() - self.last_sync >= self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        """
+            write the mapped records and the header to disk
+        """
+        if self.file is None:
+            return
+        if self.block is not None:
+            self.block.flush()
+        self.file.seek(0)
+        self.file.write(self.header())
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        if self.file is None:
+            return
+        self.sync()
+        self.block = None
+        self.columns = None
+        self.file.close()
+        self.file = None
+
+
+
+def read_journal(path):
+    """
+        map a take journal, read only. returns the trackers [(object name, camera name)], the fps
+        and the columns {name: array} of the records
+    """
+    with open(path, "rb") as f:
+        magic, version, size, block_records, block_size, count, n_trackers, fps = JOURNAL_HEADER.unpack(f.read(JOURNAL_HEADER.size))
+        if magic != JOURNAL_MAGIC or block_size != block_dtype(block_records).itemsize:
+            raise ValueError("{} is not a take journal".format(path))
+        trackers = []
+        for _ in range(n_trackers):
+            name, camera = JOURNAL_TRACKER.unpack(f.read(JOURNAL_TRACKER.size))
+            trackers.append((name.rstrip(b'\0').decode(errors='replace'), camera.rstrip(b'\0').decode(errors='replace')))
+
+    n_blocks = (os.path.getsize(path) - size) // block_size
+    if n_blocks == 0:
+        return trackers, fps, {name: np.zeros(0, dtype=dtype) for name, dtype in JOURNAL_COLUMNS}
+    blocks = np.memmap(path, dtype=block_dtype(block_records), mode='r', offset=size, shape=(n_blocks,))
+    columns = {name: blocks[name].reshape(-1) for name, _ in JOURNAL_COLUMNS}
+
+    # recover the records written after the last sync
+    capacity = n_blocks*block_records
+    count = min(count, capacity)
+    tail = np.flatnonzero(columns['timestamp'][count:] == 0)
+    count += tail[0] if tail.size > 0 else capacity - count
+    return trackers, fps, {name: column[:count] for name, column in columns.items()}
+
+
+def journal_samples(columns, tracker):
+    """
+        frames and (N, 9) rows x,y,z,pan,tilt,roll,zoom,focus,timestamp of a tracker, in recording order
+    """
+    keep = np.flatnonzero(columns['tracker'] == tracker)
+    samples = np.empty((keep.size, FREED_ROW_WIDTH))
+    for c, name in enumerate(JOURNAL_SAMPLE_COLUMNS):
+        samples[:, c] = columns[name][keep]
+    samples[:, FREED_TIMESTAMP] = columns['timestamp'][keep]
+    return columns['frame'][keep], samples
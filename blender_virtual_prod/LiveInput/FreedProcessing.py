@@ -0,0 +1,526 @@
+"""
+Copyright Miraxyz 2024
+
+Defines the processing stages applied to the decoded FreeD samples before they reach the scene,
+numpy only so that they run the same in Blender and in the standalone tools
+"""
+
+import numpy as np
+
+try:
+    from .Freed import FREED_TIMESTAMP, FREED_SAMPLE_WIDTH, FREED_ROW_WIDTH
+except ImportError: # used as a standalone module, outside of Blender
+    from Freed import FREED_TIMESTAMP, FREED_SAMPLE_WIDTH, FREED_ROW_WIDTH
+
+
+# channel groups of the x,y,z,pan,tilt,roll,zoom,focus samples, keyed together
+GROUP_POSITION = slice(0, 3)
+GROUP_ROTATION = slice(3, 6)
+GROUP_LENS     = slice(6, 8)
+GROUPS = (GROUP_POSITION, GROUP_ROTATION, GROUP_LENS)
+
+# FreeD to Blender rotation: the FreeD rotation Rz(-pan) Ry(roll) Rx(tilt) followed by this constant rotation,
+# which holds the tracking to Blender axis change and the -90 degrees tilt offset (+90 degrees about x)
+FREED_TO_BLENDER = (0.5**0.5, 0.5**0.5, 0.0, 0.0) # w,x,y,z
+BLENDER_TO_FREED = (0.5**0.5, -0.5**0.5, 0.0, 0.0) # its inverse
+
+# angles wrap around at +-180 degrees
+ANGLES = np.array([False]*3 + [True]*3 + [False]*2)
+
+# constant velocity Kalman model of each channel: acceleration variance (unit/s^2)^2 and
+# measurement variance unit^2, units are mm, degrees and encoder steps
+KALMAN_PROCESS_NOISE     = np.array([1e6]*3 + [1e4]*3 + [1e8]*2)
+KALMAN_MEASUREMENT_NOISE = np.array([1.0]*3 + [1e-4]*3 + [4.0]*2)
+KALMAN_VELOCITY_VARIANCE = 1e6 # initial velocity uncertainty
+
+# one euro filter defaults: minimum cutoff (Hz), speed coefficient per unit/s of mm, degrees and encoder steps
+ONE_EURO_MIN_CUTOFF = 5.0
+ONE_EURO_BETA = np.array([0.05]*3 + [1.0]*3 + [0.01]*2)
+ONE_EURO_DERIVATIVE_CUTOFF = 1.0
+
+
+class KeyframeDecimator:
+    """
+        Change detection on the recorded samples: for each channel group (position, rotation, lens encoders),
+        a sample is keyed only when one of the group channels moved past the group tolerance
+        (mm, degrees, encoder steps) since the last key.
+
+        When a channel starts moving after a hold, the last sample of the hold is keyed too, so that the
+        interpolation between the keys stays exact over the hold. A hold is at least one skipped sample
+        followed by an end of hold sample that the interpolation from the last key to the moving sample
+        would misplace by more than the tolerance, a slow continuous move is not keyed twice per step.
+        Streaming: the last sample of a batch can be keyed at the next batch, or by flush() at the end of a take.
+    """
+
+    def __init__(self, position_tolerance = 0.5, angle_tolerance = 0.01, encoder_tolerance = 2):
+        self.tolerances = (position_tolerance, angle_tolerance, encoder_tolerance)
+        self.keys = [None]*len(GROUPS) # values of the last key, per group
+        self.key_frames = [None]*len(GROUPS) # frame of the last key, per group
+        self.last_keys = [None]*len(GROUPS) # index of the last key relative to the next batch (negative), per group
+        self.held = [None]*len(GROUPS) # (frame, sample) last sample of the previous batch if not keyed, per group
+
+    def select(self, frames, samples):
+        """
+            the (frames, samples) to key of each group, for a batch of samples on frames
+        """
+        return [self.selectGroup(g, frames, samples) for g in range(len(GROUPS))]
+
+    def misplaced(self, g, end_frame, end_values, frame, values):
+        """
+            whether the interpolation from the last key to values on frame misses end_values on end_frame
+        """
+        key_frame = self.key_frames[g]
+        expected = self.keys[g] + (values - self.keys[g])*((end_frame - key_frame)/(frame - key_frame))
+        return bool((np.abs(end_values - expected) > self.tolerances[g]).any())
+
+    def selectGroup(self, g, frames, samples):
+        values = samples[:, GROUPS[g]]
+        tolerance = self.tolerances[g]
+        n = values.shape[0]
+        held = self.held[g]
+        keys = [] # batch indices, -1 for the held sample of the previous batch
+        last_key = self.last_keys[g]
+        start = 0
+
+        if n > 0 and self.keys[g] is None: # first sample of the take
+            keys.append(0)
+            last_key = 0
+            self.keys[g] = values[0].copy()
+            self.key_frames[g] = frames[0]
+            start = 1
+
+        while start < n:
+            moved = np.flatnonzero((np.abs(values[start:] - self.keys[g]) > tolerance).any(axis=1))
+            if moved.size == 0:
+                break
+            i = start + int(moved[0])
+            end_of_hold = i - 1
+            if end_of_hold - last_key >= 2: # samples skipped since the last key
+                if end_of_hold >= 0:
+                    end_frame, end_values = frames[end_of_hold], values[end_of_hold]
+                else:
+                    end_frame, end_values = held[0], held[1][GROUPS[g]]
+                if self.misplaced(g, end_frame, end_values, frames[i], values[i]):
+                    keys.append(end_of_hold)
+            keys.append(i)
+            last_key = i
+            self.keys[g] = values[i].copy()
+            self.key_frames[g] = frames[i]
+            start = i + 1
+
+        if n > 0:
+            self.held[g] = (frames[-1], samples[-1].copy()) if last_key != n - 1 else None
+            self.last_keys[g] = last_key - n
+
+        if keys and keys[0] == -1:
+            return (np.concatenate(([held[0]], frames[keys[1:]])),
+                    np.concatenate((held[1][None, :samples.shape[1]], samples[keys[1:]])))
+        return frames[keys], samples[keys]
+
+    def flush(self):
+        """
+            the held (frames, samples) to key for each group at the end of a take,
+            the next sample is then keyed like the first one of a take
+        """
+        groups = []
+        for g, held in enumerate(self.held):
+            if held is None:
+                groups.append((np.zeros(0), np.zeros((0, 0))))
+            else:
+                groups.append((np.array([held[0]]), held[1][None, :]))
+            self.held[g] = None
+        self.keys = [None]*len(GROUPS)
+        self.key_frames = [None]*len(GROUPS)
+        self.last_keys = [None]*len(GROUPS)
+        return groups
+
+
+
+def ZYX_to_quat(yaw, pitch, roll):
+    """
+        angles in degrees, scalars or arrays of N angles (q is then (4, N))
+    """
+    yaw = yaw*(np.pi/180)
+    pitch = pitch*-(np.pi/180)
+    roll = roll*-(np.pi/180)
+
+    cy = np.cos(yaw * 0.5)
+    sy = np.sin(yaw * 0.5)
+    cp = np.cos(pitch * 0.5)
+    sp = np.sin(pitch * 0.5)
+    cr = np.cos(roll * 0.5)
+    sr = np.sin(roll * 0.5)
+
+    q = np.zeros((4,) + np.shape(yaw))
+    q[0] = cy * cr * cp + sy * sr * sp
+    q[1] = sy * cr * cp - cy * sr * sp
+    q[2] = cy * sr * cp + sy * cr * sp
+    q[3] = cy * cr * sp - sy * sr * cp
+
+    return q
+
+
+def freed_to_quat(pan, tilt, roll):
+    """
+        (N, 4) w,x,y,z Blender rotations of FreeD angles in degrees, the rotation applied by the receivers
+        (see FreedReferential.setPose and keyframeGroups)
+    """
+    q = ZYX_to_quat(-np.asarray(pan), np.asarray(tilt) - 90, np.asarray(roll))
+    return np.stack((q[3], q[0], q[1], q[2]), axis=-1)
+
+
+def quat_to_euler(q):
+    """
+        angles in degrees about z, y and x of (N, 4) w,x,y,z quaternions of Rz Ry Rx rotations
+    """
+    w, x, y, z = q.T
+    angle_z = np.arctan2(2*(w*z + x*y), 1 - 2*(y*y + z*z))
+    angle_y = np.arcsin(np.clip(2*(w*y - z*x), -1, 1))
+    angle_x = np.arctan2(2*(w*x + y*z), 1 - 2*(x*x + y*y))
+    return np.degrees(angle_z), np.degrees(angle_y), np.degrees(angle_x)
+
+
+def quat_to_freed(quaternions):
+    """
+        pan, tilt, roll in degrees of (N, 4) w,x,y,z Blender rotations, inverse of freed_to_quat
+    """
+    # undo the constant axis change, what is left is Rz(-pan) Ry(roll) Rx(tilt)
+    z, y, x = quat_to_euler(quat_multiply(quaternions, BLENDER_TO_FREED))
+    return -z, x, y
+
+
+def slerp(q0, q1, u):
+    """
+        spherical interpolation between the (N, 4) quaternions q0 and q1 at the (N,) fractions u
+    """
+    dot = np.einsum('ij,ij->i', q0, q1)
+    q1 = np.where(dot[:, None] < 0, -q1, q1) # shortest path
+    dot = np.abs(dot)
+
+    theta = np.arccos(np.clip(dot, -1, 1))
+    sin_theta = np.sin(theta)
+    close = sin_theta < 1e-6 # nearly identical, linear interpolation is exact enough
+    safe = np.where(close, 1.0, sin_theta)
+    w0 = np.where(close, 1 - u, np.sin((1 - u)*theta)/safe)
+    w1 = np.where(close, u, np.sin(u*theta)/safe)
+    q = w0[:, None]*q0 + w1[:, None]*q1
+    return q/np.linalg.norm(q, axis=1)[:, None]
+
+
+def quat_multiply(a, b):
+    """
+        Hamilton products of the (N, 4) w,x,y,z quaternions a and b, either can be a single (4,) quaternion
+    """
+    aw, ax, ay, az = np.moveaxis(np.asarray(a, dtype=np.float64), -1, 0)
+    bw, bx, by, bz = np.moveaxis(np.asarray(b, dtype=np.float64), -1, 0)
+    return np.stack((aw*bw - ax*bx - ay*by - az*bz,
+                     aw*bx + ax*bw + ay*bz - az*by,
+                     aw*by - ax*bz + ay*bw + az*bx,
+                     aw*bz + ax*by - ay*bx + az*bw), axis=-1)
+
+
+def pose_to_freed(locations, quaternions):
+    """
+        (N, 6) x,y,z,pan,tilt,roll FreeD values (mm, degrees) of (N, 3) Blender locations (m) and
+        (N, 4) w,x,y,z rotations, inverse of the receivers conversion (see FreedReferential.setPose)
+    """
+    values = np.empty((len(locations), 6))
+    values[:, 0:3] = np.asarray(locations)*1000 # mm
+    values[:, 3], values[:, 4], values[:, 5] = quat_to_freed(quaternions)
+    return values
+
+
+class FrameResampler:
+    """
+        Resamples timestamped samples onto the scene frame grid, one sample per frame
+        (or per subframe) of fps frames per second, from the arrival time of the first sample on start_frame.
+        Positions and encoders are interpolated linearly, rotations with SLERP.
+
+        Streaming: each batch is interpolated from the last sample of the previous one, samples arriving
+        out of order (older than an already received one) are dropped. reset() starts over at the end of a take.
+    """
+
+    def __init__(self, fps, subframes = 1, start_frame = 1):
+        self.subframes = subframes
+        self.step = 1/(fps*subframes)
+        self.start_frame = start_frame
+        self.start_time = None
+        self.next_tick = 0
+        self.previous = None # last sample of the previous batch
+
+    def reset(self, start_frame):
+        """
+            forget the previous samples, the next sample is put on start_frame like the first one
+        """
+        self.start_frame = start_frame
+        self.start_time = None
+        self.next_tick = 0
+        self.previous = None
+
+    def resample(self, samples):
+        """
+            (frames, samples) of the grid ticks covered by the samples received so far
+        """
+        if self.previous is not None:
+            samples = np.concatenate((self.previous[None, :], samples))
+        times = samples[:, FREED_TIMESTAMP]
+        newest = np.maximum.accumulate(times)
+        keep = np.concatenate(([True], times[1:] > newest[:-1]))
+        samples, times = samples[keep], times[keep]
+
+        self.previous = samples[-1].copy()
+        if self.start_time is None:
+            self.start_time = times[0]
+
+        last_tick = int(np.floor((times[-1] - self.start_time)/self.step + 1e-9))
+        ticks = np.arange(self.next_tick, last_tick + 1)
+        self.next_tick = max(self.next_tick, last_tick + 1)
+        grid = self.start_time + ticks*self.step
+        frames = self.start_frame + ticks/self.subframes
+
+        resampled = np.empty((ticks.size, samples.shape[1]))
+        if samples.shape[0] == 1:
+            resampled[:] = samples[0]
+        else:
+            i = np.clip(np.searchsorted(times, grid, side='right') - 1, 0, samples.shape[0] - 2)
+            u = np.clip((grid - times[i])/(times[i+1] - times[i]), 0, 1)
+            left, right = samples[i], samples[i+1]
+            resampled[:] = left + (right - left)*u[:, None]
+
+            q = slerp(freed_to_quat(*left[:, GROUP_ROTATION].T), freed_to_quat(*right[:, GROUP_ROTATION].T), u)
+            resampled[:, 3], resampled[:, 4], resampled[:, 5] = quat_to_freed(q)
+        resampled[:, FREED_TIMESTAMP] = grid
+        return frames, resampled
+
+
+def wrap_angles(values):
+    """
+        wrap the angle channels of (N, 8+) samples in [-180, 180[ degrees, in place without temporary arrays
+    """
+    angles = values[..., 3:6]
+    np.add(angles, 180, out=angles)
+    np.mod(angles, 360, out=angles)
+    np.subtract(angles, 180, out=angles)
+    return values
+
+
+class KalmanFilter:
+    """
+        Constant velocity Kalman filter of each of the 8 channels of the samples,
+        the state and covariance of all channels are updated together.
+        Each sample depends on the state left by the previous one, samples are filtered one at a time,
+        in preallocated arrays
+    """
+
+    def __init__(self, process_noise = KALMAN_PROCESS_NOISE, measurement_noise = KALMAN_MEASUREMENT_NOISE):
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.position = np.zeros(FREED_SAMPLE_WIDTH)
+        self.velocity = np.zeros(FREED_SAMPLE_WIDTH)
+        # symmetric covariance of each channel
+        self.p00 = np.zeros(FREED_SAMPLE_WIDTH)
+        self.p01 = np.zeros(FREED_SAMPLE_WIDTH)
+        self.p11 = np.zeros(FREED_SAMPLE_WIDTH)
+        self.innovation = np.zeros(FREED_SAMPLE_WIDTH)
+        self.s = np.zeros(FREED_SAMPLE_WIDTH)
+        self.k0 = np.zeros(FREED_SAMPLE_WIDTH)
+        self.k1 = np.zeros(FREED_SAMPLE_WIDTH)
+        self.scratch = np.zeros(FREED_SAMPLE_WIDTH)
+        self.time = None
+
+    def update(self, row):
+        """
+            correct the state with a (9,) timestamped sample
+        """
+        t = row[FREED_TIMESTAMP]
+        z = row[:FREED_SAMPLE_WIDTH]
+        if self.time is None:
+            self.position[:] = z
+            self.velocity[:] = 0
+            self.p00[:] = self.measurement_noise
+            self.p01[:] = 0
+            self.p11[:] = KALMAN_VELOCITY_VARIANCE
+            self.time = t
+            return
+        dt = max(t - self.time, 0.0)
+        self.time = max(t, self.time)
+
+        # predict, all the products are written to scratch
+        q = self.process_noise
+        scratch = self.scratch
+        self.position += np.multiply(self.velocity, dt, out=scratch)
+        self.p00 += np.multiply(self.p01, 2*dt, out=scratch)
+        self.p00 += np.multiply(self.p11, dt*dt, out=scratch)
+        self.p00 += np.multiply(q, dt**4/4, out=scratch)
+        self.p01 += np.multiply(self.p11, dt, out=scratch)
+        self.p01 += np.multiply(q, dt**3/2, out=scratch)
+        self.p11 += np.multiply(q, dt*dt, out=scratch)
+
+        # correct
+        innovation = wrap_angles(np.subtract(z, self.position, out=self.innovation))
+        np.add(self.p00, self.measurement_noise, out=self.s)
+        k0 = np.divide(self.p00, self.s, out=self.k0)
+        k1 = np.divide(self.p01, self.s, out=self.k1)
+        self.position += np.multiply(k0, innovation, out=scratch)
+        self.velocity += np.multiply(k1, innovation, out=scratch)
+        self.p11 -= np.multiply(k1, self.p01, out=scratch)
+        np.subtract(1, k0, out=k0)
+        self.p00 *= k0
+        self.p01 *= k0
+        wrap_angles(self.position)
+
+    def filter(self, samples):
+        """
+            filtered copy of (N, 9) timestamped samples
+        """
+        filtered = samples.copy()
+        for row in filtered:
+            self.update(row)
+            row[:FREED_SAMPLE_WIDTH] = self.position
+        return filtered
+
+
+
+class PosePredictor:
+    """
+        Extrapolates the pose and encoders of a tracker to a target time (typically the next display time)
+        from its recent timestamped samples, to compensate the network, queue and redraw latency.
+            VELOCITY: constant velocity, least squares line through the last history samples of each channel
+            KALMAN: constant velocity Kalman filter of each channel
+
+        Samples are kept in a preallocated ring of history rows, predictions only cost a few
+        vectorized operations on it.
+    """
+
+    def __init__(self, model = 'VELOCITY', history = 8):
+        self.model = model
+        self.ring = np.zeros((history, FREED_ROW_WIDTH))
+        self.count = 0
+        self.kalman = KalmanFilter() if model == 'KALMAN' else None
+
+    def update(self, samples):
+        """
+            add (N, 9) timestamped samples
+        """
+        samples = samples[:, :FREED_ROW_WIDTH]
+        if self.kalman is not None:
+            for row in samples:
+                self.kalman.update(row)
+        last = samples[-self.ring.shape[0]:]
+        self.ring[(self.count + np.arange(last.shape[0])) % self.ring.shape[0]] = last
+        self.count += last.shape[0]
+
+    def predict(self, target_time):
+        """
+            (9,) sample x,y,z,pan,tilt,roll,zoom,focus,timestamp extrapolated at target_time,
+            None before the first sample
+        """
+        if self.count == 0:
+            return None
+        n = min(self.count, self.ring.shape[0])
+        rows = self.ring[(self.count - n + np.arange(n)) % self.ring.shape[0]] # oldest first
+        newest = rows[-1, FREED_TIMESTAMP]
+        prediction = np.empty(FREED_ROW_WIDTH)
+        prediction[FREED_TIMESTAMP] = target_time
+
+        if self.kalman is not None:
+            prediction[:FREED_SAMPLE_WIDTH] = self.kalman.position + self.kalman.velocity*(target_time - self.kalman.time)
+            return wrap_angles(prediction)
+
+        values = rows[:, :FREED_SAMPLE_WIDTH].copy()
+        values[:, ANGLES] = np.unwrap(values[:, ANGLES], period=360, axis=0)
+        t = rows[:, FREED_TIMESTAMP] - newest
+        t_mean = t.mean()
+        spread = ((t - t_mean)**2).sum()
+        if n < 2 or spread == 0:
+            prediction[:FREED_SAMPLE_WIDTH] = values[-1]
+            return wrap_angles(prediction)
+        means = values.mean(axis=0)
+        slopes = ((t - t_mean) @ (values - means))/spread
+        prediction[:FREED_SAMPLE_WIDTH] = means + slopes*(target_time - newest - t_mean)
+        return wrap_angles(prediction)
+
+
+
+class OneEuroFilter:
+    """
+        One Euro filter of each of the 8 channels of the samples: an exponential smoothing whose cutoff
+        frequency rises with the channel speed, smoothing jitter at rest without lagging moves.
+            cutoff = min_cutoff + beta*|smoothed speed|, in Hz, speeds in unit/s (mm, degrees, encoder steps)
+        min_cutoff and beta are scalars or one value per channel.
+        Each sample depends on the state left by the previous one, samples are filtered one at a time,
+        in preallocated arrays
+    """
+
+    def __init__(self, min_cutoff = ONE_EURO_MIN_CUTOFF, beta = ONE_EURO_BETA, derivative_cutoff = ONE_EURO_DERIVATIVE_CUTOFF):
+        self.min_cutoff = np.broadcast_to(np.asarray(min_cutoff, dtype=np.float64), (FREED_SAMPLE_WIDTH,))
+        self.beta = np.broadcast_to(np.asarray(beta, dtype=np.float64), (FREED_SAMPLE_WIDTH,))
+        self.derivative_cutoff = derivative_cutoff
+        self.value = np.zeros(FREED_SAMPLE_WIDTH)
+        self.speed = np.zeros(FREED_SAMPLE_WIDTH)
+        self.delta = np.zeros(FREED_SAMPLE_WIDTH)
+        self.scratch = np.zeros(FREED_SAMPLE_WIDTH)
+        self.cutoff = np.zeros(FREED_SAMPLE_WIDTH)
+        self.alpha = np.zeros(FREED_SAMPLE_WIDTH)
+        self.time = None
+
+    def update(self, row):
+        """
+            filter a (9,) timestamped sample in place
+        """
+        t = row[FREED_TIMESTAMP]
+        x = row[:FREED_SAMPLE_WIDTH]
+        if self.time is None:
+            self.value[:] = x
+            self.speed[:] = 0
+            self.time = t
+            return
+        dt = t - self.time
+        if dt <= 0: # duplicated or out of order sample, keep the current estimate
+            x[:] = self.value
+            return
+        self.time = t
+
+        delta = wrap_angles(np.subtract(x, self.value, out=self.delta))
+
+        # smoothed speed
+        alpha_speed = 1/(1 + 1/(2*np.pi*self.derivative_cutoff*dt))
+        speed_change = np.multiply(delta, 1/dt, out=self.scratch)
+        speed_change -= self.speed
+        speed_change *= alpha_speed
+        self.speed += speed_change
+
+        # speed dependent smoothing of the value
+        np.abs(self.speed, out=self.cutoff)
+        self.cutoff *= self.beta
+        self.cutoff += self.min_cutoff
+        np.multiply(self.cutoff, 2*np.pi*dt, out=self.alpha)
+        np.reciprocal(self.alpha, out=self.alpha)
+        self.alpha += 1
+        np.reciprocal(self.alpha, out=self.alpha)
+        delta *= self.alpha
+        self.value += delta
+        wrap_angles(self.value)
+        x[:] = self.value
+
+    def filter(self, samples):
+        """
+            filtered copy of (N, 9) timestamped samples
+        """
+        filtered = samples.copy()
+        for row in filtered:
+            self.update(row)
+        return filtered
+
+
+def jitter_filter(model, min_cutoff = ONE_EURO_MIN_CUTOFF, beta = ONE_EURO_BETA):
+    """
+        filter of the model 'ONE_EURO' or 'KALMAN', None for 'NONE'.
+        Filters have a filter(samples) method returning the filtered copy of (N, 9) timestamped samples,
+        the same for live samples, replays and recorded takes
+    """
+    if model == 'ONE_EURO':
+        return OneEuroFilter(min_cutoff, beta)
+    if model == 'KALMAN':
+        return KalmanFilter()
+    return None
@@ -0,0 +1,227 @@
+"""
+Copyright Miraxyz 2024
+
+Defines the replay of raw FreeD captures (see FreedCapture) through the live pipeline,
+over loopback UDP or by direct injection into FreedReceiver, and measures what the pipeline achieved.
+
+Can also be run as a script to stream a capture to running receivers:
+    python FreedReplay.py capture.bvpcap --target 0 127.0.0.1 5000 [--target ...] [--speed 2]
+"""
+
+import time
+import socket
+import argparse
+from threading import Event
+
+import numpy as np
+
+try:
+    from .Freed import FREED_TIMESTAMP
+    from .FreedCapture import read_capture, capture_packets, capture_sources
+except ImportError: # used as a standalone script, outside of Blender
+    from Freed import FREED_TIMESTAMP
+    from FreedCapture import read_capture, capture_packets, capture_sources
+
+
+SPIN_THRESHOLD = 0.002 # s, sleep until that close to a send time, then spin
+DRAIN_TIMEOUT = 1.0 # s, wait for the hubs to run the injections still queued at the end of a replay
+
+
+class LatencyProbe:
+    """
+        Wraps the callback of a receiver (or of a FreedRoute) to count the delivered samples and measure,
+        for each, the time from its arrival (sample timestamp) to the end of the callback
+    """
+
+    def __init__(self, target, capacity = 1 << 20):
+        self.target = target
+        self.callback = target.callback
+        self.latencies = np.zeros(capacity)
+        self.count = 0
+        target.callback = self
+
+    def __call__(self, data):
+        if self.callback is not None:
+            self.callback(data)
+        now = time.monotonic()
+        timestamps = np.atleast_2d(data)[:, FREED_TIMESTAMP]
+        n = min(len(timestamps), self.latencies.size - self.count)
+        self.latencies[self.count:self.count+n] = now - timestamps[:n]
+        self.count += n
+
+    def detach(self):
+        self.target.callback = self.callback
+
+
+def attach_probes(receivers):
+    """
+        LatencyProbe of each receiver, or of each route of a FreedDemuxReceiver, which only calls its routes callbacks
+    """
+    probes = []
+    for receiver in receivers:
+        routes = getattr(receiver, 'routes', None)
+        if routes is None:
+            probes.append(LatencyProbe(receiver))
+        else:
+            probes += [LatencyProbe(route) for route in routes if route is not None]
+    return probes
+
+
+
+class FreedReplay:
+    """
+        Streams the D1 packets of a capture with their original timing.
+        speed: 1 real time, N for N times faster, 0 as fast as possible
+    """
+
+    def __init__(self, records, speed = 1.0):
+        self.records = records
+        self.speed = speed
+        self.isRunning = False
+
+    @classmethod
+    def fromFile(cls, path, speed = 1.0):
+        return cls(read_capture(path), speed)
+
+    def schedule(self, receiver_ids):
+        """
+            packets of the given receivers in capture order, with their capture receiver id, send time offsets
+            and source ip (ANY_SOURCE when the capture did not record it)
+        """
+        packets, records = capture_packets(self.records)
+        keep = np.isin(records['receiver'], list(receiver_ids))
+        packets, records = packets[keep], records[keep]
+        offsets = np.zeros(len(records))
+        if len(records) > 0 and self.speed > 0:
+            offsets = (records['timestamp'] - records['timestamp'][0]) / self.speed
+        return packets, records['receiver'], offsets, capture_sources(records)
+
+    def play(self, packets, offsets, send):
+        """
+            call send(first, last) for the packets due at each step, keeping the original timing.
+            returns the duration and the worst lateness relative to the schedule
+        """
+        self.isRunning = True
+        start = time.monotonic()
+        lateness = 0.0
+        i = 0
+        n = len(packets)
+        while i < n and self.isRunning:
+            now = time.monotonic() - start
+            wait = offsets[i] - now
+            if wait > SPIN_THRESHOLD:
+                time.sleep(wait - SPIN_THRESHOLD)
+                continue
+            if wait > 0:
+                continue
+            lateness = max(lateness, -wait)
+            last = int(np.searchsorted(offsets, now, side='right')) # every packet due now
+            last = max(last, i + 1)
+            send(i, last)
+            i = last
+        self.isRunning = False
+        return time.monotonic() - start, lateness
+
+    def toUdp(self, targets, receivers = None):
+        """
+            send to {capture receiver id: (ip, port)} over UDP.
+            receivers ({capture receiver id: FreedReceiver}) are probed to measure the pipeline, if given
+        """
+        packets, ids, offsets, _ = self.schedule(targets.keys())
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        addresses = [targets[int(receiver_id)] for receiver_id in ids]
+
+        def send(first, last):
+            for i in range(first, last):
+                try:
+                    sock.sendto(packets[i], addresses[i])
+                except OSError: # full send buffer, the packet is lost like on a real network
+                    pass
+
+        probes = attach_probes((receivers or {}).values())
+        duration, lateness = self.play(packets, offsets, send)
+        time.sleep(0.1) # let the receivers drain
+        sock.close()
+        return self.report(len(packets), duration, lateness, probes)
+
+    def toReceivers(self, receivers):
+        """
+            inject directly into {capture receiver id: FreedReceiver}, the packets arrival times are their injection times
+            and they keep their captured source ip, routed on by FreedDemuxReceiver.
+            Receivers served by a running FreedHub are injected on its thread, never along their receives
+        """
+        packets, ids, offsets, sources = self.schedule(receivers.keys())
+        targets = [receivers[int(receiver_id)] for receiver_id in ids]
+
+        def inject(target, first, end, now):
+            if target.hub is None:
+                target.inject(packets[first:end], np.full(end - first, now), sources[first:end])
+            else:
+                target.hub.call(lambda: target.inject(packets[first:end], np.full(end - first, now), sources[first:end]))
+
+        def send(first, last):
+            now = time.monotonic()
+            # consecutive packets of the same receiver are injected as one batch
+            while first < last:
+                end = first + 1
+                while end < last and ids[end] == ids[first]:
+                    end += 1
+                inject(targets[first], first, end, now)
+                first = end
+
+        probes = attach_probes(receivers.values())
+        duration, lateness = self.play(packets, offsets, send)
+        for hub in {receiver.hub for receiver in receivers.values() if receiver.hub is not None}:
+            done = Event()
+            hub.call(done.set)
+            done.wait(DRAIN_TIMEOUT)
+        return self.report(len(packets), duration, lateness, probes)
+
+    def stop(self):
+        self.isRunning = False
+
+    @staticmethod
+    def report(sent, duration, lateness, probes):
+        """
+            throughput and latency achieved by the pipeline
+        """
+        latencies = np.concatenate([probe.latencies[:probe.count] for probe in probes]) if probes else np.zeros(0)
+        for probe in probes:
+            probe.detach()
+        delivered = latencies.size
+        result = {
+            'sent': sent,
+            'duration': duration,
+            'send_rate': sent / duration if duration > 0 else 0.0,
+            'max_lateness': lateness,
+            'delivered': delivered,
+            'throughput': delivered / duration if duration > 0 else 0.0,
+        }
+        if delivered > 0:
+            result['latency_mean'] = float(latencies.mean())
+            result['latency_p50'] = float(np.percentile(latencies, 50))
+            result['latency_p99'] = float(np.percentile(latencies, 99))
+            result['latency_max'] = float(latencies.max())
+        return result
+
+
+def print_report(report):
+    print("replayed {sent} packets in {duration:.3f} s ({send_rate:.0f} packets/s), "
+          "schedule lateness up to {ms:.2f} ms".format(ms=report['max_lateness']*1000, **report))
+    if report['delivered'] > 0:
+        print("pipeline delivered {delivered} samples ({throughput:.0f} samples/s), latency mean {mean:.3f} ms, "
+              "p50 {p50:.3f} ms, p99 {p99:.3f} ms, max {max:.3f} ms".format(
+              mean=report['latency_mean']*1000, p50=report['latency_p50']*1000,
+              p99=report['latency_p99']*1000, max=report['latency_max']*1000, **report))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="replay a raw FreeD capture over UDP")
+    parser.add_argument("capture")
+    parser.add_argument("--target", nargs=3, action="append", default=[], metavar=("RECEIVER_ID", "IP", "PORT"),
+                        help="where to send the packets of a capture receiver")
+    parser.add_argument("--speed", type=float, default=1.0, help="1 real time, N for N times faster, 0 as fast as possible")
+    args = parser.parse_args()
+
+    targets = {int(receiver_id): (ip, int(port)) for receiver_id, ip, port in args.target}
+    print_report(FreedReplay.fromFile(args.capture, args.speed).toUdp(targets))
@@ -0,0 +1,219 @@
+"""
+Copyright Miraxyz 2024
+
+Defines a FreeD sender, streaming camera poses and lens encoders out as D1 packets, to LED wall
+render nodes or any other FreeD consumer: sample by sample, or from a packet table pre-rendered
+from a whole animation range and sent on a precise schedule.
+Also defines the relay re-broadcasting received samples to a multicast group.
+
+Can also be run as a script to stream a tracker of a take journal (see FreedJournal):
+    python FreedSender.py take.bvptake --tracker 0 --target 192.168.1.20 6000 [--target ...] [--camera-id 1] [--loop]
+"""
+
+import time
+import socket
+import struct
+import argparse
+from threading import Thread
+
+import numpy as np
+
+try:
+    from .Freed import FREED_D1, FREED_PACKET_SIZE, FREED_SCALES, pack_batch
+    from .FreedJournal import read_journal, journal_samples
+except ImportError: # used as a standalone script, outside of Blender
+    from Freed import FREED_D1, FREED_PACKET_SIZE, FREED_SCALES, pack_batch
+    from FreedJournal import read_journal, journal_samples
+
+
+SPIN_THRESHOLD = 0.002 # s, sleep until that close to a send time, then spin
+
+# D1 packet layout: D1 and camera id, the 24 bits big endian fields pan,tilt,roll,x,y,z,zoom,focus,
+# 2 spare bytes and the checksum. A 24 bits field is packed as the low bytes of a 32 bits word starting
+# one byte before it: the fields are packed last to first so that the high byte of each word is
+# overwritten by the field before it, and the one of the first field by the header
+FREED_HEADER = struct.Struct('>BB')
+FREED_FIELD = struct.Struct('>i')
+FREED_FIELD_ORDER = (3, 4, 5, 0, 1, 2, 6, 7) # sample index of each packet field
+FREED_FIELD_LAYOUT = [(1 + 3*k, i, 1/FREED_SCALES[i], 0 if i >= 6 else -(1 << 23), (1 << 24) - 1 if i >= 6 else (1 << 23) - 1)
+                      for k, i in reversed(list(enumerate(FREED_FIELD_ORDER)))] # word offset, sample index, inverse scale, min, max
+
+
+class FreedSender:
+    """
+        Sends D1 packets of camera camera_id to targets, a list of (ip, port).
+        send() packs one x,y,z,pan,tilt,roll,zoom,focus sample (mm, degrees, raw encoders) in a reused buffer,
+        play() sends a packet table (see packetTable) at a fixed rate on the monotonic clock.
+    """
+
+    def __init__(self, targets, camera_id = 1):
+        self.targets = [(ip, int(port)) for ip, port in targets]
+        self.camera_id = camera_id
+        self.buffer = bytearray(FREED_PACKET_SIZE)
+        self.view = memoryview(self.buffer)
+        self.packets = np.zeros((0, FREED_PACKET_SIZE), dtype=np.uint8) # reused by sendBatch
+        self.sock = None
+        self.isRunning = False
+        self.thread = None
+        self.report = None
+
+    def open(self):
+        if self.sock is None:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1) # render nodes are often reached by broadcast
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def pack(self, sample):
+        """
+            encode a sample into self.buffer, returns it
+        """
+        buffer = self.buffer
+        for offset, i, inverse_scale, low, high in FREED_FIELD_LAYOUT:
+            value = min(max(round(sample[i]*inverse_scale), low), high)
+            FREED_FIELD.pack_into(buffer, offset, value & 0xFFFFFF)
+        FREED_HEADER.pack_into(buffer, 0, FREED_D1, self.camera_id)
+        buffer[FREED_PACKET_SIZE-1] = (0x40 - sum(self.view[:FREED_PACKET_SIZE-1])) & 0xFF
+        return buffer
+
+    def send(self, sample):
+        self.open()
+        self.pack(sample)
+        for target in self.targets:
+            try:
+                self.sock.sendto(self.buffer, target)
+            except OSError: # full send buffer or unreachable target, the packet is lost like on a real network
+                pass
+
+    def sendBatch(self, samples, camera_id = None):
+        """
+            send (N, 8+) samples at once, with the camera id given or the sender's one
+        """
+        self.open()
+        n = len(samples)
+        if n > len(self.packets):
+            self.packets = np.zeros((max(n, 2*len(self.packets)), FREED_PACKET_SIZE), dtype=np.uint8)
+        packets = pack_batch(samples, self.camera_id if camera_id is None else camera_id, out=self.packets[:n])
+        for packet in packets:
+            for target in self.targets:
+                try:
+                    self.sock.sendto(packet, target)
+                except OSError:
+                    pass
+
+    def packetTable(self, samples):
+        """
+            (N, 29) D1 packets of (N, 8) samples, in one vectorized pass
+        """
+        return pack_batch(samples, self.camera_id)
+
+    def play(self, packets, rate, loop = False):
+        """
+            send the packet table at rate packets per second, from the first packet again if loop,
+            until the end or stop(). Send times are kept on a fixed grid so that the rate does not drift.
+            returns a report of the packets sent and the achieved rate
+        """
+        self.open()
+        self.isRunning = True
+        period = 1/rate
+        n = len(packets)
+        sent = 0
+        errors = 0
+        lateness = 0.0
+        tick = 0
+
+        start = time.monotonic()
+        while self.isRunning and n > 0 and (loop or tick < n):
+            wait = start + tick*period - time.monotonic()
+            if wait > SPIN_THRESHOLD:
+                time.sleep(wait - SPIN_THRESHOLD)
+                continue
+            if wait > 0:
+                continue
+            lateness = max(lateness, -wait)
+            packet = packets[tick % n]
+            for target in self.targets:
+                try:
+                    self.sock.sendto(packet, target)
+                    sent += 1
+                except OSError:
+                    errors += 1
+            tick += 1
+
+        elapsed = time.monotonic() - start
+        self.isRunning = False
+        self.close()
+        self.report = {
+            'sent': sent,
+            'send_errors': errors,
+            'duration': elapsed,
+            'send_rate': sent/elapsed if elapsed > 0 else 0.0,
+            'max_lateness': lateness,
+        }
+        return self.report
+
+    def start(self, packets, rate, loop = False):
+        self.stop()
+        self.isRunning = True
+        self.thread = Thread(target=self.play, args=(packets, rate, loop))
+        self.thread.start()
+
+    def stop(self):
+        self.isRunning = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.close()
+
+
+class FreedRelay(FreedSender):
+    """
+        Re-broadcasts samples to a multicast group, so that one tracker stream reaches any number of consumers
+        joining the group (see FreedReceiver ip) without more load on the tracker or on the receiving host.
+        ttl is the number of routers the packets may cross, 1 keeps them on the local network.
+        The relayed packets are looped back to the consumers running on this machine.
+    """
+
+    def __init__(self, group, port, ttl = 1, interface = "0.0.0.0"):
+        super().__init__([(group, port)])
+        self.ttl = ttl
+        self.interface = interface
+
+    def open(self):
+        if self.sock is None:
+            super().open()
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, self.ttl)
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(self.interface))
+
+
+
+def print_report(report):
+    print("sent {sent} packets in {duration:.3f} s ({send_rate:.0f} packets/s), {send_errors} send errors, "
+          "schedule lateness up to {ms:.2f} ms".format(ms=report['max_lateness']*1000, **report))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="stream a tracker of a take journal as FreeD D1 packets")
+    parser.add_argument("journal")
+    parser.add_argument("--tracker", type=int, default=0, help="index of the tracker in the journal")
+    parser.add_argument("--target", nargs=2, action="append", default=[], metavar=("IP", "PORT"))
+    parser.add_argument("--camera-id", type=int, default=1)
+    parser.add_argument("--rate", type=float, default=None, help="packets per second, the journal fps if not given")
+    parser.add_argument("--loop", action="store_true")
+    args = parser.parse_args()
+
+    trackers, fps, columns = read_journal(args.journal)
+    _, samples = journal_samples(columns, args.tracker)
+    sender = FreedSender(args.target or [("127.0.0.1", 6000)], args.camera_id)
+    sender.start(sender.packetTable(samples), args.rate or fps, args.loop)
+    try:
+        while sender.thread.is_alive():
+            sender.thread.join(0.5)
+    except KeyboardInterrupt:
+        pass
+    sender.stop()
+    print_report(sender.report)
@@ -1,6 +1,6 @@
 # ========================================================== Import Addon Modules
 
-modulesNames = ['Freed', 'FreedInput', 'FreedInput_ui']
+modulesNames = ['Freed', 'FreedProcessing', 'FreedHub', 'FreedArbiter', 'FreedCapture', 'FreedJournal', 'FreedReplay', 'FreedSender', 'FreedIngest', 'FreedInput', 'FreedInput_ui']
 
 modulesFullNames = []
 for currentModuleName in modulesNames:
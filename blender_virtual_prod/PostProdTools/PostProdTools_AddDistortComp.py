@@ -4,6 +4,8 @@ import mathutils
 import addon_utils
 import numpy as np
 
+from ..Tracing.Tracing import TRACER, traced
+
 
 
 class AddDistortCompOp(bpy.types.Operator):
@@ -11,6 +13,7 @@ class AddDistortCompOp(bpy.types.Operator):
     bl_idname = "julouj_virtual_prod.post_prod_tools_add_distort_comp_op"
     bl_description = "Create a compositing nodegraph that distorts the CG over the plate"
 
+    @traced("AddDistortCompOp")
     def execute(self, context):
         scene = context.scene
         props = scene.post_prod_tools_props
@@ -45,6 +48,7 @@ class AddDistortCompOp(bpy.types.Operator):
 
 
         # --------------------------------------------------------------- Create Video Plate Input
+        TRACER.instant("distort_comp: Create Video Plate Input")
         img_frame = nodes.new(type='NodeFrame')
         img_frame.label = "Video Plate"
 
@@ -64,6 +68,7 @@ class AddDistortCompOp(bpy.types.Operator):
         
         
         # -------------------------------------------------------------- Create Render Layer
+        TRACER.instant("distort_comp: Create Render Layer")
         
         render_frame = nodes.new(type='NodeFrame')
         render_frame.label = "Video Plate"
@@ -154,6 +159,7 @@ class AddDistortCompOp(bpy.types.Operator):
         
         
         # --------------------------------------------------------------- Brown-Conrady Distortion Block
+        TRACER.instant("distort_comp: Brown-Conrady Distortion Block")
         stmaps_frame = nodes.new(type='NodeFrame')
         stmaps_frame.label = "Screen Coordinates"
         
@@ -409,6 +415,7 @@ class AddDistortCompOp(bpy.types.Operator):
         
         
         # --------------------------------------------------------------- Compute Overscan Block
+        TRACER.instant("distort_comp: Compute Overscan Block")
         overscan_frame = nodes.new(type='NodeFrame')
         overscan_frame.label = "Divide ST coords according to Overscan"
         overscan_frame.parent = cmbXYZ_frame
@@ -441,6 +448,7 @@ class AddDistortCompOp(bpy.types.Operator):
         
         
         # --------------------------------------------------------------- CenterShift Block
+        TRACER.instant("distort_comp: CenterShift Block")
         centershift_frame = nodes.new(type='NodeFrame')
         centershift_frame.label = "Centershift"
         #centershift_frame.parent = cmbXYZ_frame
@@ -655,6 +663,7 @@ class AddDistortCompOp(bpy.types.Operator):
         
         
         # --------------------------------------------------------------- Compositing Block
+        TRACER.instant("distort_comp: Compositing Block")
         comp_frame = nodes.new(type='NodeFrame')
         comp_frame.label = "Scale the undistorted plate to render size including overscan"
         
@@ -668,6 +677,7 @@ class AddDistortCompOp(bpy.types.Operator):
 
 
         # --------------------------------------------------------------- Output Block
+        TRACER.instant("distort_comp: Output Block")
         output_frame = nodes.new(type='NodeFrame')
         output_frame.label = "Output"
 
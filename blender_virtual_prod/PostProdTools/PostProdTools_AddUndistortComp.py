@@ -4,6 +4,8 @@ import mathutils
 import addon_utils
 import numpy as np
 
+from ..Tracing.Tracing import TRACER, traced
+
 
 
 class AddUndistortCompOp(bpy.types.Operator):
@@ -11,6 +13,7 @@ class AddUndistortCompOp(bpy.types.Operator):
     bl_idname = "julouj_virtual_prod.post_prod_tools_add_undistort_comp_op"
     bl_description = "Create a compositing nodegraph that undistorts the plate"
 
+    @traced("AddUndistortCompOp")
     def execute(self, context):
         scene = context.scene
         props = scene.post_prod_tools_props
@@ -45,6 +48,7 @@ class AddUndistortCompOp(bpy.types.Operator):
 
 
         # --------------------------------------------------------------- Create Video Plate Input
+        TRACER.instant("undistort_comp: Create Video Plate Input")
         img_frame = nodes.new(type='NodeFrame')
         img_frame.label = "Video Plate"
 
@@ -137,6 +141,7 @@ class AddUndistortCompOp(bpy.types.Operator):
         
         
         # --------------------------------------------------------------- Brown-Conrady Distortion Block
+        TRACER.instant("undistort_comp: Brown-Conrady Distortion Block")
         stmaps_frame = nodes.new(type='NodeFrame')
         stmaps_frame.label = "ST-maps"
         
@@ -188,6 +193,7 @@ class AddUndistortCompOp(bpy.types.Operator):
         
         
         # --------------------------------------------------------------- CenterShift Block
+        TRACER.instant("undistort_comp: CenterShift Block")
         centershift_frame = nodes.new(type='NodeFrame')
         centershift_frame.label = "Centershift"
         #centershift_frame.parent = cmbXYZ_frame
@@ -542,6 +548,7 @@ class AddUndistortCompOp(bpy.types.Operator):
 
 
         # --------------------------------------------------------------- Compute Overscan Block
+        TRACER.instant("undistort_comp: Compute Overscan Block")
         overscan_frame = nodes.new(type='NodeFrame')
         overscan_frame.label = "Do overscan now as this will be used as ref later for CG"
 
@@ -563,6 +570,7 @@ class AddUndistortCompOp(bpy.types.Operator):
 
 
         # --------------------------------------------------------------- Apply Overscan Block
+        TRACER.instant("undistort_comp: Apply Overscan Block")
         scale_frame = nodes.new(type='NodeFrame')
         scale_frame.label = "Scale the undistorted plate to render size including overscan"
         # render size should account for overscan, put render size in plugin and overwrite
@@ -587,6 +595,7 @@ class AddUndistortCompOp(bpy.types.Operator):
 
 
         # --------------------------------------------------------------- Output Block
+        TRACER.instant("undistort_comp: Output Block")
         output_frame = nodes.new(type='NodeFrame')
         output_frame.label = "Output"
 
@@ -2,6 +2,8 @@ import bpy
 import mathutils
 import numpy as np
 
+from ..Tracing.Tracing import TRACER, traced
+
 
 
 def ZXY_to_quat(yaw, pitch, roll):
@@ -81,6 +83,7 @@ class ImportTrackingCSVOp(bpy.types.Operator):
     bl_idname = "julouj_virtual_prod.post_prod_tools_import_tracking_csv_op"
     bl_description = "Import tracking data on selected camera using EZtrack CSV format"
 
+    @traced("ImportTrackingCSVOp")
     def execute(self, context):
         scene = context.scene
         props = scene.post_prod_tools_props
@@ -160,6 +163,7 @@ class ImportTrackingCSVOp(bpy.types.Operator):
                 splitline = line.split(",")
                 if (not line.startswith("Camera Model")) and len(splitline) > 2: # avoid empty lines
                     #print(current_frame)
+                    start = TRACER.begin() if TRACER.enabled else 0
 
                     # TC of the frame, check against video start TC to align tracking
                     f = int(splitline[10])
@@ -202,6 +206,8 @@ class ImportTrackingCSVOp(bpy.types.Operator):
                     quat = ZXY_to_quat(pan, tilt-90, roll) # -90 to handle blender default camera orientation (toward the ground)
                     quat2 = np.array([quat[3],quat[0],quat[1],quat[2]])
                     rotation_world = mathutils.Quaternion(quat2)
+                    if start:
+                        start = TRACER.end("csv.parse", start)
 
 
                     # apply the transforms to the blender camera
@@ -223,6 +229,8 @@ class ImportTrackingCSVOp(bpy.types.Operator):
                     obj_camera.keyframe_insert(data_path="location", frame=current_frame)
                     camera.keyframe_insert(data_path="lens", frame=current_frame)
                     camera.dof.keyframe_insert(data_path="focus_distance", frame=current_frame)
+                    if start:
+                        TRACER.end("csv.keyframe_insert", start)
 
 
                     # go to next frame
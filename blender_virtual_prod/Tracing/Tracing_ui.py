@@ -0,0 +1,136 @@
+# https://blender.stackexchange.com/questions/57306/how-to-create-a-custom-ui
+
+import bpy
+
+from bpy.props import (StringProperty, BoolProperty, IntProperty, FloatProperty,
+                       FloatVectorProperty, EnumProperty, PointerProperty, CollectionProperty)
+
+from bpy.types import Panel, Menu, Operator, PropertyGroup
+
+from .Tracing import TRACER, TRACE_CAPACITY
+
+
+# all classes defined in this file
+CLASSES = []
+
+
+
+
+# ========================================================== Scene Properties
+
+
+def update_tracing(self, context):
+    TRACER.enable(self.enabled, self.capacity)
+
+
+class TracingProperties(PropertyGroup):
+    enabled: BoolProperty(
+        name = "Record Trace",
+        description = "record timed spans of the add-on hot paths (FreeD receive, scene updates, lens mapping, operators)",
+        default = False,
+        update = update_tracing
+        )
+
+    capacity: IntProperty(
+        name = "Capacity",
+        description = "number of events kept, the oldest are overwritten",
+        default = TRACE_CAPACITY,
+        min = 1024,
+        update = update_tracing
+        )
+
+    trace_path: StringProperty(
+        name = "Trace File",
+        description = "Chrome / Perfetto trace JSON file, open it in chrome://tracing or ui.perfetto.dev",
+        default = "//bvp_trace.json",
+        subtype='FILE_PATH'
+        )
+CLASSES.append(TracingProperties)
+
+
+
+
+# ========================================================== Operators
+
+
+class ExportTraceOp(Operator):
+    bl_label = "Export Trace Operator"
+    bl_idname = "julouj_virtual_prod.tracing_export_op"
+    bl_description = "Write the recorded trace to the trace file"
+
+    def execute(self, context):
+        path = bpy.path.abspath(context.scene.tracing_props.trace_path)
+        try:
+            n_events = TRACER.export(path)
+        except OSError as e:
+            print("could not write trace {}: {}".format(path, e))
+            return {'CANCELLED'}
+        print("exported {} trace events to {}".format(n_events, path))
+
+        return {'FINISHED'}
+CLASSES.append(ExportTraceOp)
+
+
+class ClearTraceOp(Operator):
+    bl_label = "Clear Trace Operator"
+    bl_idname = "julouj_virtual_prod.tracing_clear_op"
+    bl_description = "Forget the recorded trace events"
+
+    def execute(self, context):
+        TRACER.clear()
+
+        return {'FINISHED'}
+CLASSES.append(ClearTraceOp)
+
+
+
+
+# ========================================================== Menus
+
+
+class TracingUi(bpy.types.Panel):
+    bl_label = "[BVP] Tracing"
+    bl_idname = "julouj_virtual_prod.tracing_ui"
+    bl_space_type = 'PROPERTIES'
+    bl_region_type = 'WINDOW'
+    bl_context = "scene"
+    bl_options = {'DEFAULT_CLOSED'}
+
+    def draw(self, context):
+        layout = self.layout
+
+        layout.prop(context.scene.tracing_props, "enabled")
+        layout.prop(context.scene.tracing_props, "capacity")
+        layout.label(text="{} events recorded".format(min(TRACER.count, TRACER.events.size)))
+        layout.prop(context.scene.tracing_props, "trace_path")
+        layout.operator("julouj_virtual_prod.tracing_export_op", text="Export Trace")
+        layout.operator("julouj_virtual_prod.tracing_clear_op", text="Clear")
+CLASSES.append(TracingUi)
+
+
+
+
+# ========================================================== Registration
+
+
+def register():
+    # register all new classes
+    for new_class in CLASSES:
+        bpy.utils.register_class(new_class)
+
+    # instantiate our custom properties in the "tracing" scene property
+    bpy.types.Scene.tracing_props = PointerProperty(type=TracingProperties)
+
+
+def unregister():
+    # remove all new classes
+    for class_to_remove in reversed(CLASSES):
+        bpy.utils.unregister_class(class_to_remove)
+
+    # throw our custom properties into the darkness of memory freeing oblivion
+    del bpy.types.Scene.tracing_props
+
+
+
+if __name__ == "__main__":
+    register()
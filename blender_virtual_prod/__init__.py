@@ -16,7 +16,7 @@ bl_info = {
 
 # ========================================================== Import Addon Modules
 
-modulesNames = ['LiveInput', 'LensMapping', 'PostProdTools']
+modulesNames = ['Tracing', 'LiveInput', 'LensMapping', 'PostProdTools']
 
 modulesFullNames = []
 for currentModuleName in modulesNames: